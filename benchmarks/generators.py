@@ -0,0 +1,83 @@
+''' writes synthetic lots in the instrument formats, for the benchmarks.
+
+VSP: two columns, current (A) | time (s) at 20 Hz with a 1 line header. the current rises to a level set by the concentration.
+Stone: ten columns with a 4 line header, time (ms) in column 0, the two count channels in columns 3 and 5 and the
+stage in column 4 (1, then 2 once the measurement starts). one channel responds to the concentration, the other stays low.
+
+files are named like the real ones, "<concentration with _ for .>_rep<n>.txt", ie 2_50_rep0.txt is 2.50 mg/dL
+'''
+import os
+import numpy
+
+WRITE_CHUNK_ROWS = 500_000 # rows written per savetxt call, keeps memory flat for huge files
+VSP_SAMPLE_PERIOD = 0.05 # s
+STONE_SAMPLE_PERIOD = 10.0 # ms
+STONE_STAGE_1_FRACTION = 0.15 # fraction of a stone run before stage 2
+VSP_HEADER = "Current\tTime\n"
+VSP_FORMAT = ("%.6e", "%.3f")
+STONE_HEADER = "header\nheader\nheader\nheader\n"
+STONE_FORMAT = "%.2f"
+
+
+def concentration_file_name(concentration: float, replicate: int) -> str:
+    ''' file name for a run, with the concentration encoded the way ConcentrationParser reads it '''
+    return f"{concentration:.2f}".replace(".", "_") + f"_rep{replicate}.txt"
+
+def vsp_rows(start: int, rows: int, concentration: float, noise: float, rng: numpy.random.Generator) -> numpy.ndarray:
+    ''' rows start:start + rows of a VSP file, as (rows, 2) current | time '''
+    level = (100 + 70 * concentration) * 1E-6 # A, ends up ~100 - 1500 nA after scaling
+    elapsed = numpy.arange(start, start + rows) * VSP_SAMPLE_PERIOD
+    current_array = level * (1 - numpy.exp(-elapsed / 3)) + rng.normal(0, noise * level, rows)
+    return numpy.column_stack((current_array, elapsed + 1000))
+
+def stone_rows(start: int, rows: int, total_rows: int, concentration: float, noise: float, rng: numpy.random.Generator) -> numpy.ndarray:
+    ''' rows start:start + rows of a stone file that's total_rows long (stage 2 starts a fixed fraction in), as (rows, 10) '''
+    level = 200 + 50 * concentration
+    stage_2_start = int(total_rows * STONE_STAGE_1_FRACTION)
+    indexes = numpy.arange(start, start + rows)
+    elapsed = numpy.maximum(indexes - stage_2_start, 0) * STONE_SAMPLE_PERIOD / 1000
+    columns = numpy.zeros((rows, 10))
+    columns[:, 0] = indexes * STONE_SAMPLE_PERIOD
+    columns[:, 3] = level * (1 - numpy.exp(-elapsed / 3)) + rng.normal(0, noise * level, rows)
+    columns[:, 4] = numpy.where(indexes < stage_2_start, 1, 2)
+    columns[:, 5] = 0.3 * level + rng.normal(0, noise * level, rows)
+    return columns
+
+def write_vsp_file(file_path: str, rows: int, concentration: float = 5.0, noise: float = 0.01, seed: int = 0):
+    ''' two column current | time file with a 1 line header. noise is the standard deviation as a fraction of the final current '''
+    rng = numpy.random.default_rng(seed)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(VSP_HEADER)
+        for start in range(0, rows, WRITE_CHUNK_ROWS):
+            numpy.savetxt(f, vsp_rows(start, min(WRITE_CHUNK_ROWS, rows - start), concentration, noise, rng), fmt=VSP_FORMAT, delimiter="\t")
+
+def write_stone_file(file_path: str, rows: int, concentration: float = 5.0, noise: float = 0.01, seed: int = 0):
+    ''' ten column stone file with a 4 line header. noise is the standard deviation as a fraction of the final counts '''
+    rng = numpy.random.default_rng(seed)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(STONE_HEADER)
+        for start in range(0, rows, WRITE_CHUNK_ROWS):
+            numpy.savetxt(f, stone_rows(start, min(WRITE_CHUNK_ROWS, rows - start), rows, concentration, noise, rng), fmt=STONE_FORMAT, delimiter="\t")
+
+WRITERS = {
+    "LactateVSPCalibration": write_vsp_file,
+    "LactateStoneCalibration": write_stone_file,
+}
+
+def write_lot(directory: str, analysis_type: str, files: int, rows: int, replicates: int = 3, noise: float = 0.01,
+              max_concentration: float = 20.0, seed: int = 0) -> list[str]:
+    ''' writes a lot of files runs into directory, replicates runs per concentration (the last concentration
+    gets fewer if files doesn't divide evenly), concentrations spread evenly from 0 to max_concentration.
+    returns the file paths
+    '''
+    writer = WRITERS[analysis_type]
+    os.makedirs(directory, exist_ok=True)
+    concentration_count = max(-(-files // replicates), 2) # ceil, and a line needs at least 2 concentrations
+    concentrations = numpy.linspace(0, max_concentration, concentration_count)
+    file_paths = []
+    for run in range(files):
+        concentration = float(concentrations[run // replicates % concentration_count])
+        file_path = os.path.join(directory, concentration_file_name(concentration, run % replicates))
+        writer(file_path, rows, concentration, noise, seed + run)
+        file_paths.append(file_path)
+    return file_paths
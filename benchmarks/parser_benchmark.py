@@ -0,0 +1,51 @@
+''' benchmarks the ColumnParser against the old all-columns numpy.loadtxt call on synthetic VSP and Stone files.
+
+run from the repo root:
+    python -m benchmarks.parser_benchmark            (10k, 1M and 10M rows)
+    python -m benchmarks.parser_benchmark 10000 100000
+'''
+import os
+import sys
+import tempfile
+import time
+import numpy
+
+from src.analysis.parsers import ColumnParser
+from benchmarks.generators import write_vsp_file, write_stone_file
+
+DEFAULT_ROW_COUNTS = (10_000, 1_000_000, 10_000_000)
+
+
+def time_call(function, repeats: int) -> float:
+    ''' best of n wall times, in seconds '''
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmark(row_counts) -> list[dict]:
+    ''' times both readers for each format / size and prints a table '''
+    formats = {
+        "VSP": (write_vsp_file, ColumnParser(usecols=(0, 1), skiprows=1), lambda path: numpy.loadtxt(path, skiprows=1, unpack=True)),
+        "Stone": (write_stone_file, ColumnParser(usecols=(0, 3, 4, 5), skiprows=4), lambda path: numpy.loadtxt(path, skiprows=4, unpack=True)),
+    }
+    results = []
+    print(f"{'format':<8}{'rows':>12}{'loadtxt (s)':>14}{'parser (s)':>14}{'speedup':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (writer, parser, loadtxt) in formats.items():
+            for rows in row_counts:
+                file_path = os.path.join(directory, f"{name}_{rows}.txt")
+                writer(file_path, rows)
+                repeats = 3 if rows <= 1_000_000 else 1
+                loadtxt_time = time_call(lambda: loadtxt(file_path), repeats)
+                parser_time = time_call(lambda: parser.parse(file_path), repeats)
+                os.remove(file_path)
+                results.append({"format": name, "rows": rows, "loadtxt": loadtxt_time, "parser": parser_time})
+                print(f"{name:<8}{rows:>12}{loadtxt_time:>14.3f}{parser_time:>14.3f}{loadtxt_time / parser_time:>9.1f}x")
+    return results
+
+if __name__ == "__main__":
+    counts = tuple(int(arg) for arg in sys.argv[1:]) or DEFAULT_ROW_COUNTS
+    run_benchmark(counts)
@@ -0,0 +1,227 @@
+''' benchmarks each stage of the analysis pipeline on synthetic lots (see generators.py), reporting the time,
+throughput and peak memory of every stage. results are saved as json so runs can be compared across commits.
+
+run from the repo root:
+    python -m benchmarks.pipeline_benchmark
+    python -m benchmarks.pipeline_benchmark --formats vsp --files 15 150 --rows 600 100000 --replicates 3 --noise 0.01 0.05
+    python -m benchmarks.pipeline_benchmark --compare benchmarks/results/<older run>.json
+    python -m benchmarks.pipeline_benchmark --precision float64 float32
+
+timings are the best of --repeats runs. peak memory is measured in a separate run under tracemalloc
+(numpy reports its array allocations to it), as bytes allocated above what was in use when the stage started
+'''
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from benchmarks.generators import write_lot
+from src.analysis.analysis import AnalysisCore, LinearityAnalysis, QAAnalysis, SubplotAnalysis
+from src.analysis.data import Data
+from src.analysis.run_store import RunStore
+from src.analysis.sweep import LinearitySweep
+from src.analysis.filtering import FilteredLot, TraceFilter
+from src.analysis.streaming import StreamingReader
+
+FORMATS = {"vsp": "LactateVSPCalibration", "stone": "LactateStoneCalibration"}
+RESULTS_DIRECTORY = os.path.join("benchmarks", "results")
+
+
+def measure_stage(function, repeats: int, setup=None) -> tuple[float, int]:
+    ''' best wall time of repeats calls, then the peak memory of one more call under tracemalloc.
+    setup (if given) is called, untimed, before every call
+    '''
+    best = float('inf')
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, max(peak - baseline, 0)
+
+def pipeline_stages(directory: str, analysis_type: str, precision: str = "float64") -> list[tuple[str, object, object]]:
+    ''' the stages in pipeline order, as (name, function, setup). each stage works on the output of the ones before it
+    (kept in state), so it can be run again on its own for repeats. the Data / LinearityAnalysis the later
+    stages work on are built up front, untimed, with the same loader / modifier the stages use
+    '''
+    data = Data(directory, analysis_type, dtype=precision)
+    linearity = LinearityAnalysis(data)
+    linearity.fit() # so scipy's (lazy) import isn't timed as part of the regression
+    state = {}
+    def scan():
+        state["file_paths"] = data.list_files()
+    def load():
+        state["loaded"] = [data.text_loader.load_data(file_path) for file_path in state["file_paths"]]
+    def stream():
+        # the same files through the bounded memory reader (parse + modify + keep), its peak memory stays flat as rows go up
+        reader = StreamingReader(analysis_type, time_point=linearity.measurement_engine.time_point, min_bytes=1, dtype=data.dtype)
+        for file_path in state["file_paths"]:
+            reader.read(file_path)
+    def fresh_loaded():
+        # the modifiers work in place, so every repeat needs its own copy of what was loaded
+        state["modifying"] = [tuple(column.copy() for column in loaded) for loaded in state["loaded"]]
+    def modify():
+        state["modified"] = [data.data_modifier.modify_data(loaded) for loaded in state["modifying"]]
+    def store():
+        run_store = RunStore(data.dtype)
+        for file_path, (x_axis, y_axis) in zip(state["file_paths"], state["modified"]):
+            run_store.append(file_path, data.concentration_parser.extract_concentration_from_filename(file_path), x_axis, y_axis)
+    def sort():
+        data.sort_data()
+    def forget_measurement():
+        # find_measurement / fit are memoized on the lot (see StageMemo), the benchmark wants them actually done
+        data.stage_memo.invalidate("measure")
+    def find_measurement():
+        linearity.find_measurement()
+    def forget_fit():
+        data.stage_memo.invalidate("fit")
+    def regression():
+        linearity.fit()
+    def qa():
+        qa_analysis = QAAnalysis(linearity.measured_line())
+        qa_analysis.run_analysis()
+        qa_analysis.get_rpds()
+    def filter_traces():
+        # a fresh FilteredLot has nothing cached, so every run is resampled and filtered (one batch)
+        FilteredLot(data, TraceFilter("savgol", 1.0)).nested_data
+    def sweep():
+        LinearitySweep(data.nested_data, 1000, time_point=linearity.measurement_engine.time_point).best_index()
+    def figures():
+        state["figures"] = (SubplotAnalysis(data).run_analysis()[0], linearity.run_analysis()[0])
+    def draw():
+        for figure in state["figures"]:
+            FigureCanvasAgg(figure).draw()
+    def end_to_end():
+        AnalysisCore(directory, analysis_type, load_workers=1, use_cache=False, precision=precision, record_results=False).run()
+    def rerun():
+        # a preference edit on a lot that's already loaded, nothing changed so every stage is reused
+        state["core"].apply_preferences()
+        state["core"].check()
+    def loaded_core():
+        if "core" not in state:
+            state["core"] = AnalysisCore(directory, analysis_type, load_workers=1, use_cache=False, precision=precision, record_results=False)
+            state["core"].check()
+    return [
+        ("scan", scan, None), ("load", load, None), ("stream", stream, None), ("modify", modify, fresh_loaded), ("store", store, None), ("sort", sort, None),
+        ("find_measurement", find_measurement, forget_measurement), ("regression", regression, forget_fit), ("qa", qa, None), ("filter", filter_traces, None), ("sweep", sweep, None),
+        ("figures", figures, None), ("draw", draw, None), ("end_to_end", end_to_end, None), ("rerun", rerun, loaded_core)
+    ]
+
+def benchmark_lot(analysis_type: str, files: int, rows: int, replicates: int, noise: float, repeats: int, precision: str = "float64") -> dict:
+    ''' writes one synthetic lot to a temp folder and measures every stage on it '''
+    with tempfile.TemporaryDirectory() as directory:
+        file_paths = write_lot(directory, analysis_type, files, rows, replicates, noise)
+        total_bytes = sum(os.path.getsize(file_path) for file_path in file_paths)
+        total_rows = files * rows
+        stages = {}
+        for name, function, setup in pipeline_stages(directory, analysis_type, precision):
+            seconds, peak_bytes = measure_stage(function, repeats, setup)
+            stages[name] = {
+                "seconds": seconds,
+                "rows_per_second": total_rows / seconds if seconds > 0 else None,
+                "files_per_second": files / seconds if seconds > 0 else None,
+                "megabytes_per_second": total_bytes / 1E6 / seconds if seconds > 0 else None,
+                "peak_bytes": peak_bytes
+            }
+    return {
+        "analysis_type": analysis_type, "files": files, "rows": rows, "replicates": replicates, "noise": noise, "precision": precision,
+        "total_rows": total_rows, "total_bytes": total_bytes, "stages": stages
+    }
+
+def environment() -> dict:
+    ''' what the results were measured on, so runs from different commits / machines can be told apart '''
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def config_key(result: dict) -> tuple:
+    ''' what identifies a lot configuration between two result files '''
+    return (result["analysis_type"], result["files"], result["rows"], result["replicates"], result["noise"], result.get("precision", "float64"))
+
+def print_results(results: list[dict]):
+    ''' one table per lot: time, throughput and peak memory of every stage '''
+    for result in results:
+        print(f"\n{result['analysis_type']}: {result['files']} files x {result['rows']} rows, "
+              f"{result['replicates']} replicates, noise {result['noise']}, {result.get('precision', 'float64')}")
+        print(f"  {'stage':<18}{'time (s)':>12}{'rows/s':>14}{'peak (MB)':>12}")
+        for name, stage in result["stages"].items():
+            rows_per_second = f"{stage['rows_per_second']:.3g}" if stage["rows_per_second"] else "-"
+            print(f"  {name:<18}{stage['seconds']:>12.4f}{rows_per_second:>14}{stage['peak_bytes'] / 1E6:>12.1f}")
+
+def print_comparison(results: list[dict], old_report: dict):
+    ''' speedup of every stage against an older result file, for the lot configurations both have '''
+    old_results = {config_key(result): result for result in old_report["results"]}
+    print(f"\ncompared with {old_report['environment'].get('commit')} ({old_report['environment'].get('timestamp')}), >1x is faster now")
+    for result in results:
+        old_result = old_results.get(config_key(result))
+        if old_result is None:
+            continue
+        print(f"  {result['analysis_type']} {result['files']} x {result['rows']}:")
+        for name, stage in result["stages"].items():
+            old_stage = old_result["stages"].get(name)
+            if old_stage is not None and stage["seconds"] > 0:
+                print(f"    {name:<18}{old_stage['seconds']:>10.4f} -> {stage['seconds']:<10.4f}{old_stage['seconds'] / stage['seconds']:>6.2f}x")
+
+def parse_args(argv=None) -> argparse.Namespace:
+    ''' command line arguments, every combination of the lists is benchmarked '''
+    parser = argparse.ArgumentParser(description="benchmark each stage of the analysis pipeline on synthetic lots")
+    parser.add_argument("--formats", nargs="+", choices=tuple(FORMATS), default=tuple(FORMATS))
+    parser.add_argument("--files", nargs="+", type=int, default=(15, 60), help="files per lot")
+    parser.add_argument("--rows", nargs="+", type=int, default=(600, 20_000), help="rows per file")
+    parser.add_argument("--replicates", nargs="+", type=int, default=(3,), help="replicates per concentration")
+    parser.add_argument("--noise", nargs="+", type=float, default=(0.01,), help="noise, as a fraction of the signal")
+    parser.add_argument("--precision", nargs="+", choices=("float64", "float32"), default=("float64",), help="dtype the samples are kept as")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per stage, the best is kept")
+    parser.add_argument("--output", default=None, help=f"json file for the results (default: in {RESULTS_DIRECTORY})")
+    parser.add_argument("--compare", default=None, help="older result file to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    ''' runs the suite from the command line '''
+    args = parse_args(argv)
+    run_environment = environment()
+    results = []
+    for format_name, files, rows, replicates, noise, precision in itertools.product(args.formats, args.files, args.rows, args.replicates, args.noise, args.precision):
+        results.append(benchmark_lot(FORMATS[format_name], files, rows, replicates, noise, args.repeats, precision))
+        print_results(results[-1:])
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, f"pipeline_{run_environment['commit'] or 'unknown'}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"environment": run_environment, "results": results}, f, indent=2)
+    print(f"\nsaved {output}")
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
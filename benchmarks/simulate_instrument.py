@@ -0,0 +1,87 @@
+''' pretends to be a VSP-3000 / Stone writing a run: appends rows to a file in real time (same data as generators.py),
+so live tailing (File > Live Tail File in the app) can be tried without an instrument.
+
+run from the repo root:
+    python -m benchmarks.simulate_instrument live/5_00_rep0.txt
+    python -m benchmarks.simulate_instrument live/5_00_rep0.txt --format stone --seconds 60 --speed 10 --torn-writes
+
+--speed runs the clock faster than real time. --torn-writes flushes part of the last line now and the rest on the
+next write, like an instrument whose buffer doesn't line up with its rows
+'''
+import argparse
+import io
+import os
+import random
+import sys
+import time
+import numpy
+
+from benchmarks.generators import (
+    vsp_rows, stone_rows, VSP_HEADER, VSP_FORMAT, VSP_SAMPLE_PERIOD, STONE_HEADER, STONE_FORMAT, STONE_SAMPLE_PERIOD
+)
+
+WRITE_INTERVAL = 0.05 # s between writes
+
+
+def format_rows(rows: numpy.ndarray, fmt) -> str:
+    ''' rows as the instrument writes them '''
+    buffer = io.StringIO()
+    numpy.savetxt(buffer, rows, fmt=fmt, delimiter="\t")
+    return buffer.getvalue()
+
+def simulate(file_path: str, file_format: str, seconds: float, concentration: float, noise: float, speed: float,
+             torn_writes: bool, seed: int = 0):
+    ''' writes the run a few rows at a time, as fast as the sample rate (times speed) '''
+    if file_format == "vsp":
+        header, fmt, period = VSP_HEADER, VSP_FORMAT, VSP_SAMPLE_PERIOD
+    else:
+        header, fmt, period = STONE_HEADER, STONE_FORMAT, STONE_SAMPLE_PERIOD / 1000
+    total_rows = int(seconds / period)
+    rng = numpy.random.default_rng(seed)
+    tear = random.Random(seed)
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    held_back = ""
+    written = 0
+    started = time.perf_counter()
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(header)
+        f.flush()
+        while written < total_rows:
+            time.sleep(WRITE_INTERVAL)
+            due = min(int((time.perf_counter() - started) * speed / period), total_rows)
+            if due <= written:
+                continue
+            if file_format == "vsp":
+                rows = vsp_rows(written, due - written, concentration, noise, rng)
+            else:
+                rows = stone_rows(written, due - written, total_rows, concentration, noise, rng)
+            text = held_back + format_rows(rows, fmt)
+            held_back = ""
+            if torn_writes and due < total_rows:
+                cut = len(text) - tear.randint(1, len(text.rsplit("\n", 2)[-2]) + 1)
+                text, held_back = text[:cut], text[cut:]
+            f.write(text)
+            f.flush()
+            written = due
+            print(f"\r{written} / {total_rows} rows", end="", file=sys.stderr)
+        f.write(held_back)
+    print(file=sys.stderr)
+
+def main(argv=None):
+    ''' parses the command line and writes the run '''
+    parser = argparse.ArgumentParser(description="write a run into a file in real time, like the instrument does")
+    parser.add_argument("file_path", help="name it like a real run, ie 5_00_rep0.txt is 5.00 mg/dL")
+    parser.add_argument("--format", choices=("vsp", "stone"), default="vsp")
+    parser.add_argument("--seconds", type=float, default=30, help="length of the run (instrument time)")
+    parser.add_argument("--concentration", type=float, default=5.0)
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument("--speed", type=float, default=1.0, help="how much faster than real time to write")
+    parser.add_argument("--torn-writes", action="store_true", help="split lines across writes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    simulate(args.file_path, args.format, args.seconds, args.concentration, args.noise, args.speed, args.torn_writes, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
 ''' runs the app '''
-from src.core import Core
+from multiprocessing import freeze_support
+from src.startup import StartupTimer
+
+startup_timer = StartupTimer() # first thing, so the startup report covers every import after this
+with startup_timer.span("src.core (PyQt6 + main window)", "import"):
+    from src.core import Core
 
 def main():
     ''' runs the app '''
@@ -7,4 +12,5 @@ def main():
     core.run()
 
 if __name__ == "__main__":
+    freeze_support() # needed for the loading worker processes when frozen with pyinstaller
     main()
@@ -1,11 +1,25 @@
 ''' handles the analysis of the data '''
 from abc import ABC, abstractmethod
+import functools
 import json
+import os
+import threading
+from collections.abc import Callable
 import numpy
-import matplotlib.pyplot as plt
-from scipy.stats import linregress
+from matplotlib.figure import Figure
 
-from src.analysis.data import Data
+from src.analysis.data import Data, AnalysisCancelled
+from src.analysis.cache import RunCache
+from src.analysis.measurement import MeasurementEngine
+from src.analysis.decimation import TraceDecimator, min_max_decimate
+from src.analysis.instrumentation import Instrumentation
+from src.analysis.bootstrap import LineBootstrap
+from src.analysis.sweep import LinearitySweep, SweepRun
+from src.analysis.results_db import ResultsDatabase
+from src.analysis.comparison import LotCache, LotComparison
+from src.analysis.pipeline import StageMemo
+from src.analysis.filtering import TraceFilter
+from src.analysis.streaming import StreamingReader
 from src.menu.preferences import Preferences
 
 '''
@@ -13,8 +27,8 @@ Hows this work?
 
 Top level, you have an Analysis, which will run a specific type of analysis / plot data.
 An Analysis has a Data object
-A Data object has a list of Run objects
-A Run can contain different kinds of TextLoader or ConcentrationParser.
+A Data object keeps all of its runs in a columnar RunStore, and hands out Run-like views of them (nested_data)
+Runs are loaded with different kinds of TextLoader / DataModifier, and a ConcentrationParser.
 '''
 
 class Analysis(ABC):
@@ -45,112 +59,369 @@ class Line():
         self.r_squared = r_squared
 
 
+class RunningRegression():
+    ''' least squares line kept as running sums, so points can be added / removed without refitting everything.
+    used for incremental (watch folder) updates, gives the same line as linregress on the same points
+    '''
+    def __init__(self):
+        self.n = 0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+        self.sum_yy = 0.0
+
+    def add_point(self, x: float, y: float, weight: int = 1):
+        ''' adds a point to the sums. a weight of -1 takes it back out '''
+        self.n += weight
+        self.sum_x += weight * x
+        self.sum_y += weight * y
+        self.sum_xx += weight * x * x
+        self.sum_xy += weight * x * y
+        self.sum_yy += weight * y * y
+
+    def remove_point(self, x: float, y: float):
+        ''' removes a point that was added before '''
+        self.add_point(x, y, -1)
+
+    def fit(self) -> tuple[float, float, float]:
+        ''' returns slope, intercept, r_value, same as the first 3 from linregress '''
+        if self.n < 2:
+            raise ValueError("Need at least 2 points to fit a line")
+        centered_xx = self.sum_xx - self.sum_x * self.sum_x / self.n
+        centered_xy = self.sum_xy - self.sum_x * self.sum_y / self.n
+        centered_yy = self.sum_yy - self.sum_y * self.sum_y / self.n
+        if centered_xx <= 0:
+            raise ValueError("Need at least 2 different x values to fit a line")
+        slope = centered_xy / centered_xx
+        intercept = (self.sum_y - slope * self.sum_x) / self.n
+        if centered_yy <= 0:
+            return slope, intercept, 0.0
+        r_value = centered_xy / numpy.sqrt(centered_xx * centered_yy)
+        return slope, intercept, float(numpy.clip(r_value, -1.0, 1.0))
+
+
 class SubplotAnalysis(Analysis):
     ''' specific analysis with subplots, ie multiple curves for current / counts vs time '''
-    def __init__(self, data: Data):
+    def __init__(self, data: Data, time_point: float = 10, full_resolution: bool = False, instrumentation: Instrumentation | None = None):
         self.data = data
-    def run_analysis(self):
-        fig, ax = plt.subplots()
-        ax.set_xlabel("Time (s)")
-        ax.axvline(x = 10, linestyle = "dashed", color = "black")
+        self.time_point = time_point # where the measurement is taken, marked with a dashed line
+        self.full_resolution = full_resolution # plot every raw sample instead of decimating
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+    def run_analysis(self, fig: Figure | None = None, traces: list[tuple] | None = None, decimated: list[tuple] | None = None,
+                     decimated_points: int | None = None):
+        ''' plots every run. pass in the figure from a previous analysis to update it in place,
+        its lines are reused and only added / removed when the set of runs changes. traces / decimated are from
+        traces(), if they were made already (ie on the analysis worker)
+        '''
+        with self.instrumentation.span("plot.traces"):
+            return self.plot_traces(fig, traces, decimated, decimated_points)
+
+    def traces(self, max_points: int | None = None) -> tuple[list[tuple], list[tuple] | None]:
+        ''' the (key, x, y, label) of every run for TraceDecimator.set_traces, and each one decimated to max_points
+        over its full range (None if max_points is None). doesn't touch a figure, so it can run off the GUI thread
+        '''
+        traces = [(run.file_path, run.x_axis, run.y_axis, run.concentration + " mg/dL") for run in self.data.nested_data]
+        if max_points is None or self.full_resolution:
+            return traces, None
+        with self.instrumentation.span("decimate"):
+            return traces, [min_max_decimate(x_axis, y_axis, max_points) for _, x_axis, y_axis, _ in traces]
+
+    def plot_traces(self, fig: Figure | None = None, traces: list[tuple] | None = None, decimated: list[tuple] | None = None,
+                    decimated_points: int | None = None):
+        ''' does the actual plotting for run_analysis '''
+        if fig is None:
+            fig = Figure() # not pyplot, so figures can be built off the GUI thread and aren't kept alive by pyplot
+        if not fig.axes:
+            ax = fig.subplots()
+            ax.set_xlabel("Time (s)")
+            fig.measurement_marker = ax.axvline(x = self.time_point, linestyle = "dashed", color = "black")
+            # traces are decimated to the canvas width, and re-decimated from the full data on zoom
+            fig.trace_decimator = TraceDecimator(ax, self.full_resolution) # the axes callbacks only hold a weak reference, the figure keeps it alive
+            fig.stage_memo = StageMemo() # the render stage, so the same runs aren't handed to the decimator again
+        ax = fig.axes[0]
+        fig.measurement_marker.set_xdata([self.time_point, self.time_point])
+        ax.set_autoscale_on(True) # undo any zoom / fixed limits from the last analysis
         if self.data.analysis_type == "LactateVSPCalibration":
             ax.set_ylabel("Current (nA)")
-            ax.set_ylim(bottom = 0, top = 2000)
         elif self.data.analysis_type == "LactateStoneCalibration":
             ax.set_ylabel("Counts")
             # ax.set_ylim(bottom = 0, top = 2000)
-        
-        for run in self.data.nested_data:
-            x = run.x_axis
-            y = run.y_axis
-            conc = run.concentration
-            ax.plot(x, y, label = conc + " mg/dL")
-        ax.legend()
-        ax.legend(loc = "lower right")
-        ax.legend(fontsize = "xx-small")
+
+        if traces is None:
+            traces, decimated = self.traces()
+        # same lot with the same runs (and samples, a live tail keeps growing) -> the traces on screen are still right
+        lines = fig.stage_memo.run("render", (self.data, tuple(len(x_axis) for _, x_axis, _, _ in traces)),
+                                   lambda: fig.trace_decimator.set_traces(traces, decimated, decimated_points), self.instrumentation)
+        ax.relim()
+        ax.autoscale_view()
+        if self.data.analysis_type == "LactateVSPCalibration":
+            ax.set_ylim(bottom = 0, top = 2000)
+        ax.legend(handles = lines, fontsize = "xx-small")
         return fig, ax
 
 class LinearityAnalysis(Analysis):
     ''' plots linearity between current / count and conc. '''
-    def __init__(self, data):
-        self.data = data
+    def __init__(self, data, time_point: float = 10, interpolate: bool = False, instrumentation: Instrumentation | None = None,
+                 window: float = 0.0):
+        self.data = data # a Data, or a FilteredLot of one
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+        self.stage_memo = data.stage_memo # shared with every other analysis of this lot
+        self.measurement_engine = MeasurementEngine(time_point, interpolate, window)
         self.currents = []
         self.concentrations = []
+        self.current_stds = [] # spread of the replicates at each concentration
+        self.replicate_counts = []
+        self.run_concentrations = numpy.empty(0) # every run's concentration / reading, for the bootstrap
+        self.run_measurements = numpy.empty(0)
+        self.group_totals = {} # concentration -> [mean, sum of squared deviations from it, count], kept for incremental updates
+        self.regression = RunningRegression() # running sums over the (concentration, mean) points
         self.find_measurement()
 
     def find_measurement(self):
         ''' groups concentrations and averages them, to get final averaged conc. and current / count point '''
-        # Group runs by concentration
-        concentration_groups = {}
-        for run in self.data.nested_data:
-            if run.concentration in concentration_groups:
-                concentration_groups[run.concentration].append(run)
-            else:
-                concentration_groups[run.concentration] = [run]
+        with self.instrumentation.span("find_measurement"):
+            runs = self.data.nested_data
+            engine = self.measurement_engine
+            measurements = self.stage_memo.run("measure", (len(runs), engine.time_point, engine.interpolate, engine.window),
+                                               lambda: engine.measure_runs(runs), self.instrumentation)
+            run_concentrations = numpy.array([float(run.concentration) for run in runs])
+            concentrations, means, stds, counts = self.measurement_engine.group(run_concentrations, measurements)
+            self.run_concentrations = run_concentrations
+            self.run_measurements = measurements
 
-        self.currents = []
-        self.concentrations = []
+            self.concentrations = concentrations.tolist()
+            self.currents = means.tolist()
+            self.current_stds = stds.tolist()
+            self.replicate_counts = counts.tolist()
+            self.group_totals = {conc: [mean, std**2 * (count - 1), count] for conc, mean, std, count
+                                 in zip(self.concentrations, self.currents, self.current_stds, self.replicate_counts)}
+            self.regression = RunningRegression()
+            for conc, mean in zip(self.concentrations, self.currents):
+                self.regression.add_point(conc, mean)
 
-        time_point = 10
-        for conc, runs in concentration_groups.items():
-            avg_currents = []
-            for run in runs:
-                closest_index = numpy.abs(numpy.array(run.x_axis) - time_point).argmin()
-                avg_currents.append(run.y_axis[closest_index])
-            avg_current = numpy.mean(avg_currents)
-            self.currents.append(avg_current)
-            self.concentrations.append(conc)
+    def add_run(self, run):
+        ''' folds one new run into its concentration mean / std and the running regression, without touching the other runs '''
+        conc = float(run.concentration)
+        mean, squared_deviations, count = self.group_totals.get(conc, [0.0, 0.0, 0])
+        if count > 0:
+            self.regression.remove_point(conc, mean) # the old mean of this group
+        measurement = self.measurement_engine.measure(run.x_axis, run.y_axis)
+        self.run_concentrations = numpy.append(self.run_concentrations, conc)
+        self.run_measurements = numpy.append(self.run_measurements, measurement)
+        # Welford's update, a running sum of squares would lose the spread of big readings (ie counts) to rounding
+        count += 1
+        delta = measurement - mean
+        mean += delta / count
+        squared_deviations += delta * (measurement - mean)
+        self.group_totals[conc] = [mean, squared_deviations, count]
+        self.regression.add_point(conc, mean)
 
-    def run_analysis(self):
-        fig, ax = plt.subplots()
-        ax.set_xlabel("Concentration (mg/dL)")
+        ordered = sorted(self.group_totals.items())
+        self.concentrations = [conc for conc, _ in ordered]
+        self.currents = [mean for _, (mean, _, _) in ordered]
+        # ddof=1 (0 for a single replicate), like MeasurementEngine.group
+        self.current_stds = [float(numpy.sqrt(squared_deviations / max(count - 1, 1))) for _, (_, squared_deviations, count) in ordered]
+        self.replicate_counts = [count for _, (_, _, count) in ordered]
+
+    def fit(self, use_running_fit: bool = False) -> tuple[float, float, float]:
+        ''' fits current / counts vs concentration, returns slope, intercept, r_value. use_running_fit takes the
+        line from the running sums (cheap after add_run) instead of refitting with linregress
+        '''
+        inputs = (use_running_fit, tuple(self.concentrations), tuple(self.currents))
+        return self.stage_memo.run("fit", inputs, lambda: self.fit_points(use_running_fit), self.instrumentation)
+
+    def fit_points(self, use_running_fit: bool = False) -> tuple[float, float, float]:
+        ''' does the actual fitting for fit '''
+        if use_running_fit:
+            with self.instrumentation.span("regression"):
+                return self.regression.fit()
+        from scipy.stats import linregress # pylint: disable=import-outside-toplevel # slow import, kept off the startup path
+        with self.instrumentation.span("regression"):
+            slope, intercept, r_value, _, _ = linregress(numpy.array(self.concentrations, dtype=float), numpy.array(self.currents, dtype=float))
+        return slope, intercept, r_value
+
+    def make_measured_line(self, slope: float, intercept: float, r_value: float) -> Line:
+        ''' turns a fit into the measured Line, which is concentration vs current like the master line '''
+        measured_line = Line()
+        measured_line.set_values(1 / slope, -intercept / slope, r_value**2)
+        return measured_line
+
+    def measured_line(self, use_running_fit: bool = False) -> Line:
+        ''' fits and returns the measured Line without plotting anything, ie for batch QA '''
+        return self.make_measured_line(*self.fit(use_running_fit))
+
+    def points(self, use_running_fit: bool = False) -> tuple[numpy.ndarray, numpy.ndarray, tuple[float, float, float]]:
+        ''' the (concentration, mean) points and their fit (slope, intercept, r_value), what plot_linearity draws '''
+        x = numpy.array([float(i) for i in self.concentrations])
+        y = numpy.array(self.currents, dtype=float)
+        return x, y, self.fit(use_running_fit)
+
+    def run_analysis(self, use_running_fit: bool = False, fig: Figure | None = None, points: tuple | None = None):
+        ''' plots the points and fitted line. use_running_fit takes the line from the running sums
+        (cheap after add_run) instead of refitting with linregress. pass in the figure from a
+        previous analysis to update it in place, and points if they were worked out already (see points)
+        '''
+        with self.instrumentation.span("plot.linearity"): # includes the regression, which also has its own span
+            return self.plot_linearity(use_running_fit, fig, points)
+
+    def plot_linearity(self, use_running_fit: bool = False, fig: Figure | None = None, points: tuple | None = None):
+        ''' does the actual plotting for run_analysis '''
+        if fig is None:
+            fig = Figure()
+        if not fig.axes:
+            ax = fig.subplots()
+            ax.set_xlabel("Concentration (mg/dL)")
+            # kept on the figure so the next analysis can update them in place
+            fig.linearity_artists = (ax.scatter([], []), ax.plot([], [], 'r')[0], ax.text(0.05, 0.75, '', transform=ax.transAxes))
+        ax = fig.axes[0]
+        scatter, fit_line, r_squared_text = fig.linearity_artists
+        ax.set_autoscale_on(True)
 
         if self.data.analysis_type == "LactateVSPCalibration":
             ax.set_ylabel("Current (nA)")
         elif self.data.analysis_type == "LactateStoneCalibration":
             ax.set_ylabel("Counts")
 
-        x = numpy.array([float(i) for i in self.concentrations])
-        y = numpy.array(self.currents, dtype=float)
-        ax.scatter(x, y)
-
         # Calculate the linear regression
-        slope, intercept, r_value, _, _ = linregress(x, y)
+        x, y, (slope, intercept, r_value) = self.points(use_running_fit) if points is None else points
+        scatter.set_offsets(numpy.column_stack((x, y)))
         line = slope*x + intercept
 
         # Plot the linear regression line
-        ax.plot(x, line, 'r', label=f'y={slope:.2f}x+{intercept:.2f}')
+        fit_line.set_data(x, line)
+        fit_line.set_label(f'y={slope:.2f}x+{intercept:.2f}')
 
         # if slope != 0:  # To avoid division by zero
         #     ax.plot(x, line, 'g--', label=f'x={(1/slope):.2f}y{-intercept/slope:.2f}')
         # else:
         #     print("Slope is zero, cannot solve for x.")
 
-        new_slope = 1 / slope
-        new_int = -intercept / slope
-        
-
         # Calculate and display R^2 value
-        r_squared = r_value**2
-        ax.text(0.05, 0.75, f'R^2 = {r_squared:.2f}', transform=ax.transAxes)
+        measured_line = self.make_measured_line(slope, intercept, r_value)
+        r_squared_text.set_text(f'R^2 = {measured_line.r_squared:.2f}')
 
+        ax.relim()
+        ax.update_datalim(scatter.get_offsets()) # relim skips collections like the scatter points
+        ax.autoscale_view()
         ax.legend()
 
-        measured_line = Line()
-        measured_line.set_values(new_slope, new_int, r_squared)
-
         return fig, ax, measured_line
     
+class SweepAnalysis(Analysis):
+    ''' plots a LinearitySweep: R^2 and the measured slope against the read time, with the measurement time
+    (dashed, like the traces) and the suggested read time (dotted) marked
+    '''
+    def __init__(self, sweep: LinearitySweep, time_point: float = 10):
+        self.sweep = sweep
+        self.time_point = time_point
+
+    def run_analysis(self, fig: Figure | None = None):
+        ''' plots the sweep. pass in the figure from a previous sweep to update it in place '''
+        if fig is None:
+            fig = Figure()
+        if not fig.axes:
+            r_squared_ax, slope_ax = fig.subplots(2, 1, sharex=True)
+            r_squared_ax.set_ylabel("R^2")
+            slope_ax.set_ylabel("Slope")
+            slope_ax.set_xlabel("Read time (s)")
+            # kept on the figure so the next sweep can update them in place
+            fig.sweep_artists = {
+                "r_squared": r_squared_ax.plot([], [])[0],
+                "slope": slope_ax.plot([], [])[0],
+                "markers": [ax.axvline(0, linestyle="dashed", color="black") for ax in (r_squared_ax, slope_ax)],
+                "best": [ax.axvline(0, linestyle="dotted", color="green") for ax in (r_squared_ax, slope_ax)],
+                "cursor": [ax.axvline(0, color="red", visible=False) for ax in (r_squared_ax, slope_ax)]
+            }
+        artists = fig.sweep_artists
+        artists["r_squared"].set_data(self.sweep.times, self.sweep.r_squared)
+        artists["slope"].set_data(self.sweep.times, self.sweep.slopes)
+        best_time = self.sweep.times[self.sweep.best_index()]
+        for marker, best, cursor in zip(artists["markers"], artists["best"], artists["cursor"]):
+            marker.set_xdata([self.time_point, self.time_point])
+            best.set_xdata([best_time, best_time])
+            cursor.set_visible(False)
+        for ax in fig.axes:
+            ax.relim(visible_only=True)
+            ax.autoscale_view()
+        return fig
+
+    @staticmethod
+    def mark_time(fig: Figure, time: float):
+        ''' moves the cursor of a sweep figure to a time, ie the one clicked on '''
+        for cursor in fig.sweep_artists["cursor"]:
+            cursor.set_xdata([time, time])
+            cursor.set_visible(True)
+
+class ComparisonAnalysis(Analysis):
+    ''' overlays several lots on shared axes: every lot's linearity points and fitted line, and optionally all of their
+    traces, one colour per lot. lots is label -> AnalysisCore (ie from AnalysisCore.compare)
+    '''
+    def __init__(self, lots: dict, show_traces: bool = False, full_resolution: bool = False):
+        self.lots = lots
+        self.show_traces = show_traces
+        self.full_resolution = full_resolution
+
+    def run_analysis(self, fig: Figure | None = None):
+        ''' plots the comparison, into fig if one is passed in (it's cleared first, the set of lots changes every time).
+        returns the figure and label -> measured Line of every lot that could be fitted
+        '''
+        if fig is None:
+            fig = Figure()
+        fig.clear()
+        if self.show_traces:
+            traces_ax, linearity_ax = fig.subplots(1, 2)
+            traces_ax.set_xlabel("Time (s)")
+            fig.trace_decimator = TraceDecimator(traces_ax, self.full_resolution)
+        else:
+            linearity_ax = fig.subplots()
+        linearity_ax.set_xlabel("Concentration (mg/dL)")
+        measured_lines = {}
+        traces = []
+        for number, (label, core) in enumerate(self.lots.items()):
+            color = f"C{number % 10}"
+            x = numpy.array(core.la.concentrations, dtype=float)
+            y = numpy.array(core.la.currents, dtype=float)
+            linearity_ax.scatter(x, y, color=color, s=12)
+            if core.can_fit():
+                slope, intercept, r_value = core.la.fit()
+                measured_lines[label] = core.la.make_measured_line(slope, intercept, r_value)
+                linearity_ax.plot(x, slope * x + intercept, color=color,
+                                  label=f"{label}: slope {measured_lines[label].slope:.4g}, R^2 {measured_lines[label].r_squared:.4f}")
+            traces.extend(((label, run.file_path), run.x_axis, run.y_axis, color) for run in core.traces.nested_data)
+        if self.show_traces:
+            # one legend entry per lot, the colour is the lot
+            lines = fig.trace_decimator.set_traces([(key, x_axis, y_axis, "_nolegend_") for key, x_axis, y_axis, _ in traces])
+            for line, (_, _, _, color) in zip(lines, traces):
+                line.set_color(color)
+            traces_ax.relim()
+            traces_ax.autoscale_view()
+        analysis_types = {core.data.analysis_type for core in self.lots.values()}
+        if analysis_types == {"LactateVSPCalibration"}:
+            linearity_ax.set_ylabel("Current (nA)")
+        elif analysis_types == {"LactateStoneCalibration"}:
+            linearity_ax.set_ylabel("Counts")
+        if measured_lines:
+            linearity_ax.legend(fontsize="x-small")
+        return fig, measured_lines
+
 class QAAnalysis(Analysis):
     ''' quality assurance analysis, which will take the slope and y intercept from the linearity analysis and compare it to expected values '''
-    def __init__(self, measured_line: Line):
+    def __init__(self, measured_line: Line, master_line: Line | None = None):
         self.measured_line = measured_line
-        self.master_line = Line()
-        self.master_line.get_values_from_preferences()
+        if master_line is None: # the usual case, otherwise ie rechecking old lots against a new master line
+            master_line = Line()
+            master_line.get_values_from_preferences()
+        self.master_line = master_line
         prefs = Preferences()
         self.slope_rpd_percent = float(prefs.get_preference("qa_parameters", "slope_rpd"))
         self.y_int_rpd_percent = float(prefs.get_preference("qa_parameters", "y_intercept_rpd"))
 
+    def inputs(self) -> tuple:
+        ''' everything the checks depend on, ie to tell whether they need redoing '''
+        return (self.measured_line.slope, self.measured_line.y_intercept, self.measured_line.r_squared, self.master_line.slope,
+                self.master_line.y_intercept, self.master_line.r_squared, self.slope_rpd_percent, self.y_int_rpd_percent)
+
     def run_analysis(self) -> dict[str, bool]:
         slope_check = self.check_slope_rpd(self.master_line.slope, self.measured_line.slope)
         int_check = self.check_y_intercept_rpd(self.master_line.y_intercept, self.measured_line.y_intercept)
@@ -161,8 +432,37 @@ class QAAnalysis(Analysis):
             "r_squared": r_squared_check
         }
 
+    def get_rpds(self) -> dict[str, float]:
+        ''' the slope / y intercept RPDs (%) the checks are based on, ie for reporting '''
+        return {
+            "slope": self.get_rpd(self.master_line.slope, self.measured_line.slope),
+            "y_intercept": self.get_rpd(self.master_line.y_intercept, self.measured_line.y_intercept)
+        }
+
+    def get_confidence(self, resampled_lines: dict[str, numpy.ndarray], confidence: float = 95) -> dict:
+        ''' confidence intervals of the line and the RPDs from bootstrapped lines (see LineBootstrap), plus the fraction
+        of resamples that pass each check, so a lot that passes or fails by a hair shows up as one
+        '''
+        rpds = {
+            "slope_rpd": self.get_rpd(self.master_line.slope, resampled_lines["slope"]),
+            "y_intercept_rpd": self.get_rpd(self.master_line.y_intercept, resampled_lines["y_intercept"])
+        }
+        with numpy.errstate(invalid="ignore"):
+            pass_rates = {
+                "slope": float(numpy.mean(rpds["slope_rpd"] <= self.slope_rpd_percent)),
+                "y_intercept": float(numpy.mean(rpds["y_intercept_rpd"] <= self.y_int_rpd_percent)),
+                "r_squared": float(numpy.mean(resampled_lines["r_squared"] >= self.master_line.r_squared))
+            }
+        values = {**resampled_lines, **rpds}
+        return {
+            "resamples": len(resampled_lines["slope"]),
+            "confidence": confidence,
+            "intervals": {name: LineBootstrap.interval(array, confidence) for name, array in values.items()},
+            "pass_rates": pass_rates
+        }
+
     def get_rpd(self, true_value: float, measured_value: float) -> float:
-        ''' calculates the RPD (relative measure of difference) for any 2 numbers '''
+        ''' calculates the RPD (relative measure of difference) for any 2 numbers (or a number and an array of them) '''
         rpd = abs(true_value - measured_value) / ((true_value + measured_value) / 2) * 100
         return rpd
 
@@ -187,20 +487,351 @@ class QAAnalysis(Analysis):
         return True
 
 
+class AnalysisResult():
+    ''' everything a run of the lot works out before it's drawn (see AnalysisCore.compute / draw): the measured line,
+    its QA, the linearity points / fit and the traces, decimated for the trace plot if its point budget was known
+    '''
+    def __init__(self, use_running_fit: bool, measured_line: Line, qa_checks: dict[str, bool], rpds: dict[str, float],
+                 points: tuple, traces: list[tuple], decimated: list[tuple] | None, decimated_points: int | None):
+        self.use_running_fit = use_running_fit
+        self.measured_line = measured_line
+        self.qa_checks = qa_checks
+        self.rpds = rpds
+        self.points = points # (concentrations, means, (slope, intercept, r_value)), see LinearityAnalysis.points
+        self.traces = traces # (key, x, y, label) per run, see SubplotAnalysis.traces
+        self.decimated = decimated
+        self.decimated_points = decimated_points
+
+
 class AnalysisCore():
     
     ''' handles the core functionality tying together the analyses and data handling'''
-    def __init__(self, directory: str, analysis_type: str, axis_order_in_file: tuple[str, str] = ('current', 'time')): #this all needs to grab right from UI choices
-        self.data = Data(directory, analysis_type, axis_order_in_file)
-        self.sp = SubplotAnalysis(self.data)
-        self.la = LinearityAnalysis(self.data)
+    def __init__(self, directory: str, analysis_type: str, axis_order_in_file: tuple[str, str] = ('current', 'time'), #this all needs to grab right from UI choices
+                 progress_callback: Callable[[int, int], None] | None = None, cancel_event: threading.Event | None = None,
+                 load_workers: int | None = None, use_cache: bool = True, precision: str | None = None, record_results: bool = True,
+                 use_lot_cache: bool = False, run_cache: RunCache | None = None):
+        # load_workers / use_cache / precision override the preferences, ie the batch runner loads each lot serially and uncached.
+        # record_results=False keeps run() out of the results database (ie benchmarks). use_lot_cache takes the lot from
+        # the in memory LotCache if it's there (the GUI), run_cache shares one run cache between lots loading at once
+        if load_workers is None:
+            load_workers = self.get_load_workers()
+        dtype = self.get_precision() if precision is None else numpy.dtype(precision)
+        if use_cache and run_cache is None:
+            run_cache = self.get_run_cache()
+        self.instrumentation = self.get_instrumentation()
+        self.cancel_event = cancel_event # checked between the load and the figures, raises AnalysisCancelled once set
+        self.lot_cache = self.get_lot_cache() if use_lot_cache else None
+        self.shared_data = self.lot_cache is not None # the Data is in the lot cache (or came from it), so other cores may have it too
+        streaming_reader = self.get_streaming_reader(analysis_type, axis_order_in_file, dtype)
+        self.data = self.load_data(directory, analysis_type, axis_order_in_file, load_workers, run_cache if use_cache else None,
+                                   progress_callback, cancel_event, dtype, streaming_reader)
+        self.traces = self.data # what's measured / plotted, the lot's FilteredLot when a trace filter is on
+        self.sp = None
+        self.la = None
+        self.make_analyses()
         self.qa = None
+        self.confidence = None # bootstrap intervals from the last bootstrap(), None until then
+        self.results_database = self.get_results_database() if record_results else None
+
+    def load_data(self, directory: str, analysis_type: str, axis_order_in_file: tuple[str, str], load_workers: int, cache: RunCache | None,
+                  progress_callback: Callable[[int, int], None] | None, cancel_event: threading.Event | None, dtype: numpy.dtype,
+                  streaming_reader: StreamingReader | None = None) -> Data:
+        ''' the lot's Data, from the lot cache if it's on and has it, otherwise loaded (and cached) '''
+        if self.lot_cache is None:
+            return Data(directory, analysis_type, axis_order_in_file, load_workers, cache, progress_callback, cancel_event, self.instrumentation, dtype,
+                        streaming_reader)
+        with self.instrumentation.span("lot_cache"):
+            key = self.lot_cache.make_key(directory, analysis_type, axis_order_in_file, dtype, streaming_reader)
+            data = self.lot_cache.get(key)
+        if data is None:
+            data = Data(directory, analysis_type, axis_order_in_file, load_workers, cache, progress_callback, cancel_event, self.instrumentation, dtype,
+                        streaming_reader)
+            self.lot_cache.put(key, data)
+            return data
+        self.instrumentation.count("lot_cache_hits")
+        if progress_callback is not None:
+            progress_callback(data.files_total, data.files_total)
+        return data
+
+    def make_analyses(self):
+        ''' filters the traces (if it's on) and sets up the plots / measurement with the settings from the preferences.
+        cheap on a lot that's been through it before, see StageMemo / FilterCache
+        '''
+        trace_filter = self.get_trace_filter()
+        if trace_filter.enabled:
+            self.traces = self.data.filtered_lots.get(self.data, trace_filter)
+            self.traces.filter_missing(self.instrumentation)
+        else:
+            self.traces = self.data
+        time_point, interpolate, window = self.get_measurement_settings()
+        self.sp = SubplotAnalysis(self.traces, time_point, instrumentation=self.instrumentation)
+        self.la = LinearityAnalysis(self.traces, time_point, interpolate, self.instrumentation, window)
+
+    def get_measurement_settings(self) -> tuple[float, bool, float]:
+        ''' measurement time (s), whether to interpolate to it exactly and the window (s) readings are averaged over
+        (0 takes the single reading), from the preferences
+        '''
+        prefs = Preferences()
+        time_point = float(prefs.get_preference("analysis_parameters", "measurement_time", "10"))
+        interpolate = prefs.get_preference("analysis_parameters", "interpolate_measurement", "0") == "1"
+        window = float(prefs.get_preference("analysis_parameters", "measurement_window", "0"))
+        return time_point, interpolate, window
+
+    def get_streaming_reader(self, analysis_type: str, axis_order_in_file: tuple[str, str], dtype: numpy.dtype) -> StreamingReader | None:
+        ''' the bounded memory reader for very long files, with its size threshold from the preferences and the
+        measurement settings it keeps the samples for. None if it's set to 0
+        '''
+        prefs = Preferences()
+        min_megabytes = float(prefs.get_preference("performance_parameters", "stream_min_mb", "256"))
+        if min_megabytes <= 0:
+            return None
+        max_points = int(prefs.get_preference("performance_parameters", "stream_max_points", "4000"))
+        time_point, _, window = self.get_measurement_settings()
+        return StreamingReader(analysis_type, axis_order_in_file, time_point, window, int(min_megabytes * 1024 * 1024), max_points, dtype)
+
+    @staticmethod
+    def get_trace_filter() -> TraceFilter:
+        ''' the smoothing for the traces from the preferences, method "none" leaves them raw '''
+        prefs = Preferences()
+        return TraceFilter(prefs.get_preference("analysis_parameters", "trace_filter", "none"),
+                           float(prefs.get_preference("analysis_parameters", "filter_window", "1")),
+                           int(prefs.get_preference("analysis_parameters", "filter_polyorder", "2")))
+
+    @staticmethod
+    def get_load_workers() -> int:
+        ''' number of worker processes for loading, from the preferences. 0 means use every core '''
+        prefs = Preferences()
+        workers = int(prefs.get_preference("performance_parameters", "load_workers", "1"))
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        return workers
+
+    def get_precision(self) -> numpy.dtype:
+        ''' dtype the samples are loaded / kept as, from the preferences. float32 halves the memory a lot takes,
+        the measurements and the regression are still done in float64
+        '''
+        prefs = Preferences()
+        precision = prefs.get_preference("performance_parameters", "precision", "float64")
+        if precision not in ("float64", "float32"):
+            raise ValueError(f"Unknown precision {precision}, must be float64 or float32")
+        return numpy.dtype(precision)
+
+    def get_bootstrap_settings(self) -> tuple[int, float]:
+        ''' bootstrap resamples (0 turns it off) and confidence level (%), from the preferences '''
+        prefs = Preferences()
+        resamples = int(prefs.get_preference("analysis_parameters", "bootstrap_resamples", "0"))
+        confidence = float(prefs.get_preference("analysis_parameters", "bootstrap_confidence", "95"))
+        return resamples, confidence
+
+    def get_sweep_points(self) -> int:
+        ''' grid size of the linearity sweep, from the preferences '''
+        prefs = Preferences()
+        return int(prefs.get_preference("analysis_parameters", "sweep_points", "1000"))
+
+    def get_results_database(self) -> ResultsDatabase | None:
+        ''' the results history database from the preferences, or None if recording is turned off '''
+        prefs = Preferences()
+        if prefs.get_preference("history_parameters", "record_results", "1") != "1":
+            return None
+        return ResultsDatabase(prefs.get_preference("history_parameters", "database_path", "results/history.sqlite3"))
+
+    @staticmethod
+    def get_run_cache() -> RunCache | None:
+        ''' builds the on disk run cache from the preferences, or None if it's turned off '''
+        prefs = Preferences()
+        if prefs.get_preference("performance_parameters", "cache_enabled", "1") != "1":
+            return None
+        max_megabytes = float(prefs.get_preference("performance_parameters", "cache_max_mb", "1024"))
+        hash_contents = prefs.get_preference("performance_parameters", "cache_hash_contents", "0") == "1"
+        return RunCache("cache", int(max_megabytes * 1024 * 1024), hash_contents)
+
+    @staticmethod
+    def get_lot_cache() -> LotCache | None:
+        ''' the in memory lot cache with its ceiling from the preferences, or None if it's set to 0 '''
+        prefs = Preferences()
+        max_megabytes = float(prefs.get_preference("performance_parameters", "lot_cache_mb", "1024"))
+        if max_megabytes <= 0:
+            return None
+        lot_cache = LotCache()
+        lot_cache.set_max_bytes(int(max_megabytes * 1024 * 1024))
+        return lot_cache
+
+    @classmethod
+    def compare(cls, directories: list[str], analysis_type: str, axis_order_in_file: tuple[str, str] = ('current', 'time'),
+                progress_callback: Callable[[int, int], None] | None = None, cancel_event: threading.Event | None = None) -> LotComparison:
+        ''' loads several lots at once for the comparison view (see LotComparison), through the lot cache. the loading
+        workers from the preferences are split between the lots loading at the same time, and they share one run cache
+        '''
+        concurrent_lots = max(min(LotComparison.MAX_CONCURRENT_LOTS, len(directories)), 1)
+        load_workers = max(cls.get_load_workers() // concurrent_lots, 1)
+        run_cache = cls.get_run_cache()
+        def make_core(directory: str, cancel_event: threading.Event | None):
+            return cls(directory, analysis_type, axis_order_in_file, cancel_event=cancel_event, load_workers=load_workers,
+                       use_cache=run_cache is not None, record_results=False, use_lot_cache=True, run_cache=run_cache)
+        comparison = LotComparison(directories, make_core, progress_callback, cancel_event)
+        comparison.load()
+        return comparison
+
+    def get_instrumentation(self) -> Instrumentation:
+        ''' timing spans / counters for this analysis, on unless turned off in the preferences '''
+        prefs = Preferences()
+        return Instrumentation(prefs.get_preference("performance_parameters", "instrumentation", "1") == "1")
+
+    def timings(self) -> dict:
+        ''' the instrumentation as a dict (spans in seconds, counters), ie for logging '''
+        return self.instrumentation.to_dict()
+
+    def check_cancelled(self):
+        ''' raises AnalysisCancelled if this analysis was cancelled '''
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise AnalysisCancelled(f"Analysis of {self.data.directory} was cancelled")
+
+    def can_fit(self) -> bool:
+        ''' whether there are enough concentrations for a line yet (ie a watched folder that's still filling up) '''
+        return len(self.la.group_totals) >= 2
+
+    def read_file(self, file_path: str, instrumentation: Instrumentation | None = None) -> tuple:
+        ''' the slow part of add_file, parsing / modifying (or streaming) a new file. the lot isn't changed, so this can
+        run on a worker thread (with its own instrumentation) while the lot is on screen, add_file adds what it read
+        '''
+        return self.data.read_run(file_path, instrumentation)
+
+    def add_file(self, file_path: str, read_run: tuple | None = None):
+        ''' adds one new file to the data and the linearity analysis, for watch folder mode. read_run is what
+        read_file gave for it, if it was read already
+        '''
+        with self.instrumentation.span("add_file"):
+            if read_run is None:
+                read_run = self.read_file(file_path, self.instrumentation)
+            if self.shared_data:
+                # other cores (ie the comparison) may be using this Data, so it's copied rather than changed under them.
+                # the cached one is dropped, its key has the old files in it and won't be asked for again
+                self.lot_cache.discard(self.data)
+                self.data = self.data.copy()
+                self.shared_data = False
+                self.make_analyses()
+            run = self.data.add_run(file_path, self.instrumentation, read_run)
+            if self.traces is not self.data:
+                run = self.traces.filtered(run, self.instrumentation)
+            self.la.add_run(run)
+
+    def apply_preferences(self) -> bool:
+        ''' picks up changed measurement / filter / QA preferences without reloading the lot. only the stages downstream
+        of what changed are redone on the next run() / check() (see StageMemo), ie a new QA threshold doesn't remeasure,
+        and going back to a filter that was used before doesn't refilter. returns False (and changes nothing) if the
+        lot has streamed runs that were kept for other measurement settings, those need the lot loaded again
+        '''
+        if self.data.streamed:
+            streaming_reader = self.get_streaming_reader(self.data.analysis_type, self.data.axis_order_in_file, self.data.dtype)
+            if streaming_reader is None or streaming_reader.key() != self.data.streaming_reader.key():
+                return False
+        self.make_analyses()
+        self.confidence = None # the bootstrap was for the old settings
+        return True
+
+    def check(self, master_line: Line | None = None) -> tuple[Line, dict[str, bool], dict[str, float]]:
+        ''' fits and QA checks without making any figures. returns the measured line, the checks and the RPDs '''
+        measured_line = self.la.measured_line()
+        qa_checks, rpds = self.run_qa(measured_line, master_line)
+        return measured_line, qa_checks, rpds
+
+    def run_qa(self, measured_line: Line, master_line: Line | None = None) -> tuple[dict[str, bool], dict[str, float]]:
+        ''' the QA stage: checks and RPDs of a measured line, reused if neither it nor the thresholds / master line changed '''
+        with self.instrumentation.span("qa"):
+            self.qa = QAAnalysis(measured_line, master_line)
+            return self.data.stage_memo.run("qa", self.qa.inputs(), lambda: (self.qa.run_analysis(), self.qa.get_rpds()), self.instrumentation)
+
+    def bootstrap(self, master_line: Line | None = None, resamples: int | None = None, confidence: float | None = None,
+                  time_budget: float = LineBootstrap.TIME_BUDGET) -> dict | None:
+        ''' bootstrap confidence intervals for the line / RPDs and QA pass rates (see QAAnalysis.get_confidence),
+        kept in self.confidence. resamples / confidence default to the preferences. None if it's turned off or there
+        aren't 2 concentrations yet
+        '''
+        default_resamples, default_confidence = self.get_bootstrap_settings()
+        resamples = default_resamples if resamples is None else resamples
+        confidence = default_confidence if confidence is None else confidence
+        if resamples <= 0 or not self.can_fit():
+            self.confidence = None
+            return None
+        with self.instrumentation.span("bootstrap"):
+            line_bootstrap = LineBootstrap(self.la.run_concentrations, self.la.run_measurements)
+            resampled_lines = line_bootstrap.resample_lines(resamples, time_budget)
+            self.confidence = QAAnalysis(self.la.measured_line(), master_line).get_confidence(resampled_lines, confidence)
+        return self.confidence
+
+    def sweep(self, points: int | None = None) -> LinearitySweep:
+        ''' fits the line at every time of a grid over the runs (see LinearitySweep), ie to pick a better read time.
+        points defaults to the preferences, the reading is taken the same way as the measurement
+        '''
+        with self.instrumentation.span("sweep"):
+            return self.prepare_sweep(points)()
+
+    def prepare_sweep(self, points: int | None = None) -> Callable[[], LinearitySweep]:
+        ''' the sweep of the lot as it is right now, to be run later (ie on a worker thread). the runs and settings are
+        taken here, so runs added in the meantime (watch mode) don't change what it works on
+        '''
+        points = self.get_sweep_points() if points is None else points
+        engine = self.la.measurement_engine
+        runs = [SweepRun(run.concentration, run.x_axis, run.y_axis) for run in self.traces.nested_data]
+        return functools.partial(LinearitySweep, runs, points, engine.interpolate, engine.time_point, engine.window)
+
+    def record_results(self, measured_line: Line, qa_checks: dict[str, bool], rpds: dict[str, float], provisional: bool = False) -> int | None:
+        ''' saves a result to the results database, returns its row id (None if recording is off).
+        provisional results (watch mode, the running fit) are kept too, but trend queries leave them out
+        '''
+        if self.results_database is None:
+            return None
+        with self.instrumentation.span("record"):
+            result = {
+                "lot": os.path.abspath(self.data.directory),
+                "analysis_type": self.data.analysis_type,
+                "provisional": int(provisional),
+                "runs": len(self.data.nested_data),
+                "concentrations": len(self.la.concentrations),
+                "slope": float(measured_line.slope),
+                "y_intercept": float(measured_line.y_intercept),
+                "r_squared": float(measured_line.r_squared),
+                "slope_rpd": float(rpds["slope"]),
+                "y_intercept_rpd": float(rpds["y_intercept"]),
+                "slope_passed": int(qa_checks["slope"]),
+                "y_intercept_passed": int(qa_checks["y_intercept"]),
+                "r_squared_passed": int(qa_checks["r_squared"]),
+                "passed": int(all(qa_checks.values())),
+                "flagged_runs": len(self.data.flags)
+            }
+            la = self.la
+            measurements = [
+                (float(conc), float(mean), float(std), int(count))
+                for conc, mean, std, count in zip(la.concentrations, la.currents, la.current_stds, la.replicate_counts)
+            ]
+            return self.results_database.record(result, measurements, self.timings(), self.confidence)
+
+    def compute(self, use_running_fit: bool = False, record: bool = True, max_points: int | None = None) -> AnalysisResult:
+        ''' everything in run() but the figures: the fit, QA, recording the result (unless record=False) and the traces,
+        decimated to max_points (the trace plot's budget, see TraceDecimator.max_points) if it's given. doesn't touch
+        a figure, so it can run on the analysis worker, draw puts the result on screen
+        '''
+        self.check_cancelled()
+        points = self.la.points(use_running_fit)
+        measured_line = self.la.make_measured_line(*points[2])
+        qa_checks, rpds = self.run_qa(measured_line)
+        if record:
+            self.record_results(measured_line, qa_checks, rpds, provisional=use_running_fit)
+        traces, decimated = self.sp.traces(max_points)
+        return AnalysisResult(use_running_fit, measured_line, qa_checks, rpds, points, traces, decimated, max_points)
+
+    def draw(self, result: AnalysisResult, fig1: Figure | None = None, fig2: Figure | None = None):
+        ''' puts a result from compute into the figures (new ones if they aren't passed in), returns fig1, ax1, fig2, ax2 '''
+        fig1, ax1 = self.sp.run_analysis(fig1, result.traces, result.decimated, result.decimated_points)
+        fig2, ax2, _ = self.la.run_analysis(result.use_running_fit, fig2, result.points)
+        return fig1, ax1, fig2, ax2
 
-    def run(self):
-        ''' runs the app '''
-        fig1, ax1 = self.sp.run_analysis()
-        fig2, ax2, measured_line = self.la.run_analysis()
-        self.qa = QAAnalysis(measured_line)
-        qa_checks = self.qa.run_analysis()
+    def run(self, use_running_fit: bool = False, fig1: Figure | None = None, fig2: Figure | None = None, record: bool = True):
+        ''' runs the app. figures from a previous run can be passed in to be updated in place instead of rebuilt.
+        the last thing returned is the timings dict (see timings), covering the load and this run. record=False only
+        makes the figures, ie for a lot whose result was already recorded (against another master line)
+        '''
+        result = self.compute(use_running_fit, record)
+        fig1, ax1, fig2, ax2 = self.draw(result, fig1, fig2)
 
-        return fig1, ax1, fig2, ax2, measured_line, qa_checks
+        return fig1, ax1, fig2, ax2, result.measured_line, result.qa_checks, self.timings()
@@ -0,0 +1,261 @@
+''' binary lot archives: a whole lot folder packed into one file, so it can be loaded with a memory map instead of parsing.
+
+layout (every section starts on a 64 byte boundary, offsets in the header are from the start of the data):
+    magic "TRAQLOT1" | header length (uint64) | header crc32 (uint32) | 4 bytes padding
+    header, utf-8 json: version, analysis type, axis order, column names, run index
+        (file name, concentration label, rows, crc32 of the original file) and every section's offset / size / crc32
+    sections: "offsets" int64 run offsets into the columns, one float64 array per loader column (every run
+        concatenated, like a RunStore), and "originals", the original text files lzma compressed back to back
+
+the columns hold what the TextLoader returns (before the DataModifier), so loading an archive still runs the
+modifier like a folder would. the original files are kept byte for byte, unpack writes them back out.
+
+run from the repo root:
+    python -m src.analysis.archive pack lots/lot_001 lot_001.traqlot LactateVSPCalibration [--axis-order current time]
+    python -m src.analysis.archive unpack lot_001.traqlot lots/lot_001_restored
+    python -m src.analysis.archive verify lot_001.traqlot
+    python -m src.analysis.archive info lot_001.traqlot
+'''
+import argparse
+import json
+import lzma
+import os
+import struct
+import sys
+import zlib
+import numpy
+
+from src.analysis.run import TextLoader, RunFactory, ConcentrationParser
+
+ARCHIVE_EXTENSION = ".traqlot"
+MAGIC = b"TRAQLOT1"
+VERSION = 1
+PREFIX = struct.Struct("<8sQI4x") # magic, header length, header crc32
+ALIGNMENT = 64
+COLUMN_NAMES = {
+    "LactateVSPCalibration": ("time", "current"),
+    "LactateStoneCalibration": ("time", "count2", "stage2", "count3"),
+}
+
+
+class ArchiveError(ValueError):
+    ''' raised for a file that isn't a lot archive, or one that doesn't match its checksums '''
+
+
+def align(position: int) -> int:
+    ''' rounds a position up to the section alignment '''
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+def crc32(data) -> int:
+    ''' crc32 of bytes / an array, as an unsigned int '''
+    return zlib.crc32(memoryview(data).cast("B")) & 0xFFFFFFFF
+
+def list_lot_files(directory: str) -> list[str]:
+    ''' the data files of a lot folder, same rules as Data.list_files, sorted so archives come out the same every time '''
+    return sorted(entry.path for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith('.'))
+
+
+class LotArchive():
+    ''' an open lot archive. the whole file is memory mapped once and every column / the offsets are
+    read only views into that map, so opening costs a few syscalls and no parsing, whatever the run count.
+    checksums are only checked by verify() (it has to read everything), opening checks the header's
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            prefix = f.read(PREFIX.size)
+            if len(prefix) < PREFIX.size:
+                raise ArchiveError(f"{path} is not a lot archive")
+            magic, header_length, header_crc = PREFIX.unpack(prefix)
+            if magic != MAGIC:
+                raise ArchiveError(f"{path} is not a lot archive")
+            header_bytes = f.read(header_length)
+        if len(header_bytes) != header_length or crc32(header_bytes) != header_crc:
+            raise ArchiveError(f"{path} has a damaged header")
+        self.header = json.loads(header_bytes)
+        if self.header["version"] > VERSION:
+            raise ArchiveError(f"{path} is archive version {self.header['version']}, this app reads up to {VERSION}")
+        self.data_start = align(PREFIX.size + header_length)
+        self.map = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+        self.analysis_type = self.header["analysis_type"]
+        self.axis_order_in_file = tuple(self.header["axis_order"])
+        self.file_names = [run["file_name"] for run in self.header["runs"]]
+        self.concentration_labels = [run["concentration"] for run in self.header["runs"]]
+        self.run_indexes = {file_name: index for index, file_name in enumerate(self.file_names)}
+        self.offsets = self.section("offsets")
+        self.columns = [self.section(f"columns/{name}") for name in self.header["columns"]]
+
+    @staticmethod
+    def is_archive(path: str) -> bool:
+        ''' whether a path is a lot archive (checks the magic, not the extension) '''
+        if not os.path.isfile(path):
+            return False
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+
+    def __len__(self) -> int:
+        return len(self.file_names)
+
+    def section(self, name: str) -> numpy.ndarray:
+        ''' read only view of a section, typed and shaped from the header '''
+        section = self.header["sections"][name]
+        start = self.data_start + section["offset"]
+        return self.map[start:start + section["size"]].view(numpy.dtype(section["dtype"]))
+
+    def run_columns(self, index: int) -> tuple[numpy.ndarray, ...]:
+        ''' the loader columns of one run, as views into the map '''
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        return tuple(column[start:stop] for column in self.columns)
+
+    def index_of(self, file_path: str) -> int:
+        ''' run index from a file name or a path ending in one (ie the virtual paths Data uses) '''
+        try:
+            return self.run_indexes[os.path.basename(file_path)]
+        except KeyError as e:
+            raise ArchiveError(f"{os.path.basename(file_path)} is not in {self.path}") from e
+
+    def original_bytes(self, index: int) -> bytes:
+        ''' the original text file of a run, byte for byte '''
+        run = self.header["runs"][index]
+        start = self.data_start + self.header["sections"]["originals"]["offset"] + run["original_offset"]
+        contents = lzma.decompress(self.map[start:start + run["original_size"]])
+        if crc32(contents) != run["crc32"]:
+            raise ArchiveError(f"{run['file_name']} in {self.path} doesn't match its checksum")
+        return contents
+
+    def verify(self):
+        ''' checks every section and original file against the checksums in the header, raises ArchiveError if any don't match '''
+        for name, section in self.header["sections"].items():
+            start = self.data_start + section["offset"]
+            if crc32(self.map[start:start + section["size"]]) != section["crc32"]:
+                raise ArchiveError(f"section {name} of {self.path} doesn't match its checksum")
+        for index in range(len(self)):
+            self.original_bytes(index)
+
+    def unpack(self, directory: str) -> list[str]:
+        ''' writes the original text files back out into directory, returns their paths '''
+        os.makedirs(directory, exist_ok=True)
+        file_paths = []
+        for index, file_name in enumerate(self.file_names):
+            file_path = os.path.join(directory, file_name)
+            with open(file_path, "wb") as f:
+                f.write(self.original_bytes(index))
+            file_paths.append(file_path)
+        return file_paths
+
+
+class ArchiveTextLoader(TextLoader):
+    ''' TextLoader for runs in a lot archive. returns the same columns the text loader of the archive's
+    analysis type would, straight out of the memory map (read only, the modifiers make new arrays)
+    '''
+    def __init__(self, archive: LotArchive):
+        self.archive = archive
+        # text rows (ie appended to one of the original files) parse like the analysis type's files
+        self.text_loader, _ = RunFactory().return_components(archive.analysis_type, archive.axis_order_in_file)
+        self.parser = self.text_loader.parser
+
+    def load_data(self, file_path: str) -> tuple[numpy.ndarray, ...]:
+        ''' file_path is the archive path joined with the original file name, or just the file name '''
+        return self.archive.run_columns(self.archive.index_of(file_path))
+
+    def load_text(self, text: str) -> tuple[numpy.ndarray, ...]:
+        return self.text_loader.load_text(text)
+
+
+def pack_lot(directory: str, archive_path: str, analysis_type: str, axis_order_in_file: tuple[str, str] = ('current', 'time')) -> dict:
+    ''' packs every data file of a lot folder into one archive, returns the header '''
+    if analysis_type not in COLUMN_NAMES:
+        raise ValueError(f"Unknown run type: {analysis_type}")
+    text_loader, _ = RunFactory().return_components(analysis_type, axis_order_in_file)
+    concentration_parser = ConcentrationParser()
+    column_names = COLUMN_NAMES[analysis_type]
+    runs, columns, originals = [], [], []
+    original_offset = 0
+    for file_path in list_lot_files(directory):
+        with open(file_path, "rb") as f:
+            contents = f.read()
+        loaded = text_loader.load_data(file_path)
+        compressed = lzma.compress(contents) # slower than zlib, but packing is a one off and it's ~1/3 smaller on these files
+        runs.append({
+            "file_name": os.path.basename(file_path),
+            "concentration": concentration_parser.extract_concentration_from_filename(file_path),
+            "rows": len(loaded[0]),
+            "crc32": crc32(contents),
+            "original_offset": original_offset,
+            "original_size": len(compressed)
+        })
+        columns.append(loaded)
+        originals.append(compressed)
+        original_offset += len(compressed)
+
+    lengths = numpy.array([run["rows"] for run in runs], dtype=numpy.int64)
+    sections = {"offsets": numpy.concatenate(([0], numpy.cumsum(lengths))).astype(numpy.int64)}
+    for position, name in enumerate(column_names):
+        parts = [numpy.asarray(loaded[position], dtype=numpy.float64) for loaded in columns]
+        sections[f"columns/{name}"] = numpy.concatenate(parts) if parts else numpy.empty(0, dtype=numpy.float64)
+    sections["originals"] = numpy.frombuffer(b"".join(originals), dtype=numpy.uint8)
+
+    header = {
+        "version": VERSION,
+        "analysis_type": analysis_type,
+        "axis_order": list(axis_order_in_file),
+        "columns": list(column_names),
+        "runs": runs,
+        "sections": {}
+    }
+    position = 0
+    for name, array in sections.items():
+        header["sections"][name] = {"offset": position, "size": array.nbytes, "dtype": array.dtype.str, "crc32": crc32(array)}
+        position = align(position + array.nbytes)
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    temp_path = archive_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, len(header_bytes), crc32(header_bytes)))
+        f.write(header_bytes)
+        data_start = align(f.tell())
+        for name, array in sections.items():
+            f.seek(data_start + header["sections"][name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + position) # trailing alignment, so the last section ends where the header says
+    os.replace(temp_path, archive_path)
+    return header
+
+def main(argv=None) -> int:
+    ''' pack / unpack / verify / info from the command line '''
+    parser = argparse.ArgumentParser(description="pack lot folders into binary archives and back")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_parser = commands.add_parser("pack", help="pack a lot folder into an archive")
+    pack_parser.add_argument("directory")
+    pack_parser.add_argument("archive")
+    pack_parser.add_argument("analysis_type", choices=tuple(COLUMN_NAMES))
+    pack_parser.add_argument("--axis-order", nargs=2, default=("current", "time"), metavar=("FIRST", "SECOND"))
+    unpack_parser = commands.add_parser("unpack", help="write the original files of an archive back out")
+    unpack_parser.add_argument("archive")
+    unpack_parser.add_argument("directory")
+    for command in ("verify", "info"):
+        commands.add_parser(command, help=f"{command} an archive").add_argument("archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        header = pack_lot(args.directory, args.archive, args.analysis_type, tuple(args.axis_order))
+        text_bytes = sum(os.path.getsize(file_path) for file_path in list_lot_files(args.directory))
+        print(f"packed {len(header['runs'])} runs into {args.archive}: {os.path.getsize(args.archive) / 1E6:.1f} MB (text was {text_bytes / 1E6:.1f} MB)")
+        return 0
+    try:
+        archive = LotArchive(args.archive)
+        if args.command == "unpack":
+            print(f"wrote {len(archive.unpack(args.directory))} files to {args.directory}")
+        elif args.command == "verify":
+            archive.verify()
+            print(f"{args.archive}: ok, {len(archive)} runs")
+        else:
+            print(json.dumps({key: value for key, value in archive.header.items() if key != "runs"}, indent=2))
+            print(f"{len(archive)} runs, {int(archive.offsets[-1])} rows")
+    except ArchiveError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
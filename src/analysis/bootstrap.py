@@ -0,0 +1,78 @@
+''' bootstrap confidence intervals for the calibration line, so a borderline lot shows how close to the QA limits it really is '''
+import time
+import numpy
+
+
+class LineBootstrap():
+    ''' resamples the replicate runs of every concentration (with replacement, within each concentration) and refits
+    the line to the resampled means, the same fit LinearityAnalysis does on the real means. each batch of resamples is
+    drawn as one index array and fitted with array math (the closed form least squares sums over every resample at
+    once), no per resample fit. batches stop once the resamples are done or the time budget is used up
+    '''
+    TIME_BUDGET = 1.0 # s, at least one batch always runs
+    BATCH_SIZE = 1000
+
+    def __init__(self, concentrations, measurements, seed: int | None = None):
+        concentrations = numpy.asarray(concentrations, dtype=numpy.float64)
+        measurements = numpy.asarray(measurements, dtype=numpy.float64)
+        order = numpy.argsort(concentrations, kind="stable")
+        self.measurements = measurements[order] # grouped by concentration
+        self.concentrations, group_of_run, counts = numpy.unique(concentrations[order], return_inverse=True, return_counts=True)
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        # every run slot draws from its own concentration: start of the group + a random offset inside it
+        self.slot_starts = starts[group_of_run]
+        self.slot_counts = counts[group_of_run]
+        # (runs, concentrations) matrix that averages the runs of each concentration
+        self.averaging = numpy.zeros((len(self.measurements), len(self.concentrations)))
+        self.averaging[numpy.arange(len(self.measurements)), group_of_run] = 1 / counts[group_of_run]
+        self.rng = numpy.random.default_rng(seed)
+
+    def resample_means(self, resamples: int) -> numpy.ndarray:
+        ''' (resamples, concentrations) means of resampled replicates '''
+        offsets = (self.rng.random((resamples, len(self.measurements))) * self.slot_counts).astype(numpy.int64)
+        return self.measurements[self.slot_starts + offsets] @ self.averaging
+
+    def fit_many(self, means: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        ''' least squares of every row of means against the concentrations, returns slopes, intercepts, r values '''
+        x_deviations = self.concentrations - self.concentrations.mean()
+        mean_of_means = means.mean(axis=1)
+        y_deviations = means - mean_of_means[:, None]
+        sxx = x_deviations @ x_deviations
+        sxy = y_deviations @ x_deviations
+        syy = numpy.einsum("ij,ij->i", y_deviations, y_deviations)
+        slopes = sxy / sxx
+        intercepts = mean_of_means - slopes * self.concentrations.mean()
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            r_values = sxy / numpy.sqrt(sxx * syy)
+        return slopes, intercepts, r_values
+
+    def resample_lines(self, resamples: int = 5000, time_budget: float = TIME_BUDGET) -> dict[str, numpy.ndarray]:
+        ''' the measured line (concentration vs current, like LinearityAnalysis.make_measured_line) of every resample.
+        fewer than resamples come back if the time budget ran out
+        '''
+        if len(self.concentrations) < 2:
+            raise ValueError("Need at least 2 concentrations to bootstrap the line")
+        started = time.perf_counter()
+        fits = []
+        done = 0
+        while done < resamples:
+            batch = min(self.BATCH_SIZE, resamples - done)
+            fits.append(self.fit_many(self.resample_means(batch)))
+            done += batch
+            if time.perf_counter() - started > time_budget:
+                break
+        slopes, intercepts, r_values = (numpy.concatenate(values) for values in zip(*fits))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return {"slope": 1 / slopes, "y_intercept": -intercepts / slopes, "r_squared": r_values ** 2}
+
+    @staticmethod
+    def interval(values: numpy.ndarray, confidence: float = 95) -> tuple[float, float] | None:
+        ''' percentile interval holding confidence % of the values. the nans / infs from flat resamples (1 / a zero slope)
+        are left out, None if that leaves nothing
+        '''
+        values = values[numpy.isfinite(values)]
+        if not len(values):
+            return None
+        tail = (100 - confidence) / 2
+        low, high = numpy.percentile(values, (tail, 100 - tail))
+        return float(low), float(high)
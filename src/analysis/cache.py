@@ -0,0 +1,145 @@
+''' on disk cache of loaded runs, so rerunning the same folder doesn't reparse every text file '''
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy
+
+
+class RunCache():
+    ''' caches the (x_axis, y_axis) arrays of runs as .npy files, loaded back with memory mapping.
+    entries are keyed on the file identity (path, size, mtime or a hash of the contents) plus the
+    loader config (analysis type, axis order), so editing a file or changing the axis order misses.
+    the total size is capped, with the least recently used entries evicted first. one cache can be shared by lots
+    loading at the same time (ie the comparison view), the index is only touched under a lock
+    '''
+    INDEX_FILE_NAME = "index.json"
+
+    def __init__(self, directory: str = "cache", max_bytes: int = 1024 * 1024 * 1024, hash_contents: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hash_contents = hash_contents # slower, but survives files being copied around / touched
+        self.hits = 0
+        self.misses = 0
+        self.index = {} # key -> {"size": bytes, "last_used": timestamp, "flags": modifier flags, only if there were any}
+        self.lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        ''' loads the index of entries from disk, dropping any whose files went missing '''
+        try:
+            with open(self.index_path(), "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+        self.index = {key: entry for key, entry in self.index.items() if os.path.exists(self.entry_path(key))}
+
+    def save_index(self):
+        ''' writes the index to disk. called once per load, not per run '''
+        with self.lock:
+            temp_path = self.index_path() + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.index, f)
+            os.replace(temp_path, self.index_path())
+
+    def index_path(self) -> str:
+        ''' path of the index file '''
+        return os.path.join(self.directory, self.INDEX_FILE_NAME)
+
+    def entry_path(self, key: str) -> str:
+        ''' path of the .npy file for a key '''
+        return os.path.join(self.directory, key + ".npy")
+
+    def make_key(self, file_path: str, analysis_type: str, axis_order_in_file: tuple[str, str], stage: str = "modified") -> str:
+        ''' builds the cache key for a run. stage is which arrays are cached ("modified" is what Run keeps) '''
+        stat = os.stat(file_path)
+        if self.hash_contents:
+            with open(file_path, "rb") as f:
+                identity = hashlib.sha1(f.read()).hexdigest()
+        else:
+            identity = str(stat.st_mtime_ns)
+        parts = (os.path.abspath(file_path), str(stat.st_size), identity, analysis_type, "|".join(axis_order_in_file), stage)
+        return hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> numpy.ndarray | None:
+        ''' returns the cached (2, n) array for a key, memory mapped read only, or None on a miss '''
+        with self.lock:
+            if key not in self.index:
+                self.misses += 1
+                return None
+            try:
+                array = numpy.load(self.entry_path(key), mmap_mode="r")
+            except (OSError, ValueError): # missing / truncated file, treat it as a miss
+                self.index.pop(key, None)
+                self.misses += 1
+                return None
+            self.index[key]["last_used"] = time.time()
+            self.hits += 1
+            return array
+
+    def get_flags(self, key: str) -> list[str]:
+        ''' modifier flags (ie no stage 2) stored with an entry, so a cache hit still reports them '''
+        return self.index.get(key, {}).get("flags", [])
+
+    def put(self, key: str, x_axis: numpy.ndarray, y_axis: numpy.ndarray, flags: list[str] | None = None):
+        ''' stores the axes of a run (and any modifier flags) under a key, then evicts down to the size cap '''
+        array = numpy.stack((x_axis, y_axis))
+        temp_path = self.entry_path(key) + ".tmp"
+        with open(temp_path, "wb") as f:
+            numpy.save(f, array)
+        os.replace(temp_path, self.entry_path(key))
+        entry = {"size": os.path.getsize(self.entry_path(key)), "last_used": time.time()}
+        if flags:
+            entry["flags"] = list(flags)
+        with self.lock:
+            self.index[key] = entry
+            self.evict()
+
+    def total_bytes(self) -> int:
+        ''' size of everything in the cache '''
+        with self.lock:
+            return sum(entry["size"] for entry in self.index.values())
+
+    def evict(self):
+        ''' removes least recently used entries until the cache is under max_bytes '''
+        with self.lock:
+            total = self.total_bytes()
+            if total <= self.max_bytes:
+                return
+            for key in sorted(self.index, key=lambda key: self.index[key]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                total -= self.index[key]["size"]
+                self.remove(key)
+
+    def remove(self, key: str):
+        ''' removes a single entry '''
+        with self.lock:
+            self.index.pop(key, None)
+        try:
+            os.remove(self.entry_path(key))
+        except OSError: # still memory mapped somewhere on windows, invalidate picks it up later
+            pass
+
+    def invalidate(self):
+        ''' empties the whole cache, including files left behind by failed removes '''
+        with self.lock:
+            self.index = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        self.save_index()
+
+    def stats(self) -> dict[str, int]:
+        ''' hit / miss counters and size, ie for logging '''
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.index),
+            "bytes": self.total_bytes()
+        }
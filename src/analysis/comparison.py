@@ -0,0 +1,148 @@
+''' comparing lots side by side: an in memory cache of loaded lots, and loading several lots at once '''
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy
+
+from src.analysis.data import Data, AnalysisCancelled
+from src.analysis.archive import LotArchive
+from src.analysis.streaming import StreamingReader
+
+
+def lot_signature(directory: str) -> tuple:
+    ''' (name, size, mtime) of every data file of a lot folder (or of the archive), so a lot whose files were added,
+    removed or rewritten gets a new cache key. same files as Data.list_files
+    '''
+    if LotArchive.is_archive(directory):
+        stat = os.stat(directory)
+        return ((os.path.basename(directory), stat.st_size, stat.st_mtime_ns),)
+    return tuple(sorted(
+        (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+        for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith('.')
+    ))
+
+
+class LotCache():
+    ''' singleton LRU cache of loaded Data, so going back to a lot (in the main window or the comparison view) doesn't
+    reload it. the samples of the cached lots (filtered traces included) are kept under max_bytes, least recently
+    used lots are dropped first, and a lot bigger than the whole ceiling is never kept. dropping a lot only lets go
+    of the cache's reference, a lot that's still on screen stays in memory until it's replaced
+    '''
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LotCache, cls).__new__(cls)
+            cls._instance.initialize()
+        return cls._instance
+
+    def initialize(self):
+        ''' init for the singleton '''
+        self.max_bytes = 1024 * 1024 * 1024
+        self.lots = OrderedDict() # key -> Data, least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, directory: str, analysis_type: str, axis_order_in_file: tuple[str, str], dtype,
+                 streaming_reader: StreamingReader | None = None) -> tuple:
+        ''' key of a lot: where it is, how it's loaded and what files it has right now. a lot with files big enough to
+        be streamed also depends on the streaming settings (the measurement time, for one)
+        '''
+        signature = lot_signature(directory)
+        streamed = (streaming_reader is not None and not LotArchive.is_archive(directory)
+                    and streaming_reader.min_bytes > 0 and any(size >= streaming_reader.min_bytes for _, size, _ in signature))
+        return (os.path.realpath(directory), analysis_type, tuple(axis_order_in_file), numpy.dtype(dtype).name, signature,
+                streaming_reader.key() if streamed else None)
+
+    def set_max_bytes(self, max_bytes: int):
+        ''' changes the ceiling, evicting straight away if it went down '''
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict()
+
+    def get(self, key: tuple) -> Data | None:
+        ''' the cached lot for a key (and marks it as just used), or None '''
+        with self.lock:
+            data = self.lots.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.lots.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: tuple, data: Data):
+        ''' keeps a loaded lot, then evicts down to the ceiling '''
+        if data.nbytes() > self.max_bytes:
+            return
+        with self.lock:
+            self.lots[key] = data
+            self.lots.move_to_end(key)
+            self.evict()
+
+    def discard(self, data: Data):
+        ''' forgets a lot, ie one that's about to be changed (files added in watch mode) '''
+        with self.lock:
+            for key in [key for key, cached in self.lots.items() if cached is data]:
+                del self.lots[key]
+
+    def evict(self):
+        ''' drops least recently used lots until the rest fit under max_bytes. called with the lock held '''
+        while self.lots and self.total_bytes() > self.max_bytes:
+            self.lots.popitem(last=False)
+
+    def total_bytes(self) -> int:
+        ''' sample memory of every cached lot '''
+        return sum(data.nbytes() for data in self.lots.values())
+
+    def clear(self):
+        ''' drops every lot '''
+        with self.lock:
+            self.lots.clear()
+
+    def stats(self) -> dict[str, int]:
+        ''' hit / miss counters and size, ie for the UI '''
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "lots": len(self.lots), "bytes": self.total_bytes(), "max_bytes": self.max_bytes}
+
+
+class LotComparison():
+    ''' several lots of one analysis type loaded side by side. up to MAX_CONCURRENT_LOTS load at once, each on its
+    own thread with its share of the loading worker processes, all going through the lot cache and one shared run
+    cache. make_core builds (or fetches) the AnalysisCore of one lot, see AnalysisCore.compare
+    '''
+    MAX_CONCURRENT_LOTS = 4
+
+    def __init__(self, directories: list[str], make_core: Callable, progress_callback: Callable[[int, int], None] | None = None,
+                 cancel_event: threading.Event | None = None):
+        self.directories = list(directories)
+        self.make_core = make_core
+        self.progress_callback = progress_callback
+        self.cancel_event = cancel_event
+        self.cores = {} # directory -> AnalysisCore
+        self.errors = {} # directory -> why it couldn't be loaded
+
+    def load(self) -> dict:
+        ''' loads every lot, returns the cores in the order the lots were given. a lot that fails is left out
+        (see errors), a cancel stops everything with AnalysisCancelled
+        '''
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(min(self.MAX_CONCURRENT_LOTS, len(self.directories)), 1)) as pool:
+            futures = {pool.submit(self.make_core, directory, self.cancel_event): directory for directory in self.directories}
+            for future in as_completed(futures):
+                directory = futures[future]
+                try:
+                    self.cores[directory] = future.result()
+                except AnalysisCancelled:
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    raise
+                except Exception as e: # pylint: disable=broad-except
+                    self.errors[directory] = f"{type(e).__name__}: {e}"
+                done += 1
+                if self.progress_callback is not None:
+                    self.progress_callback(done, len(self.directories))
+        self.cores = {directory: self.cores[directory] for directory in self.directories if directory in self.cores}
+        return self.cores
@@ -1,25 +1,329 @@
 ''' defines Data objects '''
+import copy
 import os
-from src.analysis.run import RunFactory
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy
+from src.analysis.run import RunFactory, ConcentrationParser
+from src.analysis.run_store import RunStore, RunView
+from src.analysis.cache import RunCache
+from src.analysis.instrumentation import Instrumentation
+from src.analysis.archive import LotArchive, ArchiveTextLoader
+from src.analysis.pipeline import StageMemo
+from src.analysis.filtering import FilterCache
+from src.analysis.streaming import StreamingReader
+
+
+def load_run_into_block(analysis_type: str, file_path: str, axis_order_in_file: tuple[str, str], block_name: str, total_rows: int, offset: int, capacity: int,
+                        dtype: str = "float64") -> tuple[int, float, float, list[str]]:
+    ''' worker side of the parallel load. parses / modifies a single run and writes the axes straight
+    into its slice of the lot's shared memory block (which holds dtype), so only the row count (plus the
+    parse / modify seconds for the instrumentation, and any flags from the modifier) have to be pickled back
+    '''
+    text_loader, data_modifier = RunFactory().return_components(analysis_type, axis_order_in_file, dtype)
+    started = time.perf_counter()
+    loaded_data_tuple = text_loader.load_data(file_path)
+    parsed = time.perf_counter()
+    x_axis, y_axis = data_modifier.modify_data(loaded_data_tuple)
+    modified = time.perf_counter()
+    length = len(x_axis)
+    if length > capacity:
+        raise ValueError(f"{file_path} produced {length} rows but only {capacity} were reserved")
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        lot_array = numpy.ndarray((2, total_rows), dtype=dtype, buffer=block.buf)
+        lot_array[0, offset:offset + length] = x_axis
+        lot_array[1, offset:offset + length] = y_axis
+        del lot_array # release the view before closing, otherwise close() complains about exported pointers
+    finally:
+        block.close()
+    return length, parsed - started, modified - parsed, list(data_modifier.flags)
+
+
+class AnalysisCancelled(Exception):
+    ''' raised when a load is cancelled (ie from the UI) between runs '''
+
+
+class LoadContext():
+    ''' what one load reports to and is stopped by: its timings, progress callback (files done, total files) and cancel
+    event. Data gets one per call that loads instead of keeping them, since a lot in the lot cache is shared by every
+    analysis using it and each of those has its own
+    '''
+    def __init__(self, instrumentation: Instrumentation | None = None, progress_callback: Callable[[int, int], None] | None = None,
+                 cancel_event: threading.Event | None = None):
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+        self.progress_callback = progress_callback
+        self.cancel_event = cancel_event
+        self.files_done = 0
+        self.files_total = 0
+
+    def report_progress(self):
+        ''' counts a finished run and reports it '''
+        self.files_done += 1
+        if self.progress_callback is not None:
+            self.progress_callback(self.files_done, self.files_total)
+
+    def cancelled(self) -> bool:
+        ''' whether the cancel event is set '''
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
 
 class Data():
-    ''' handles multiple Run objects, but as a container '''
+    ''' handles multiple runs, but as a container. the samples live in a columnar RunStore,
+    nested_data gives Run-like views of them in sorted order '''
     #this should only handle mu8ltiple runs, should not know about analyses
-    def __init__(self, directory: str, analysis_type: str, axis_order_in_file: tuple[str, str] = ('current', 'time')):
+    MODIFIER_VERSION = 2 # bump whenever a modifier changes what a run holds, the cached runs are keyed on it
+    def __init__(self, directory: str, analysis_type: str, axis_order_in_file: tuple[str, str] = ('current', 'time'), workers: int = 1, cache: RunCache | None = None,
+                 progress_callback: Callable[[int, int], None] | None = None, cancel_event: threading.Event | None = None,
+                 instrumentation: Instrumentation | None = None, dtype=numpy.float64, streaming_reader: StreamingReader | None = None):
         self.directory = directory
         self.analysis_type = analysis_type
-        self.nested_data = []
+        self.workers = workers # 1 (or less) loads serially in this process
+        self.cache = cache # None means always parse
+        self.axis_order_in_file = axis_order_in_file
+        self.dtype = numpy.dtype(dtype) # what the samples are kept as. float32 halves the memory, the fit still works in float64
+        self.files_total = 0
+        self.flags = {} # file path -> problems the modifier found in that run (ie no stage 2), for the UI / batch output
+        self.store = RunStore(self.dtype)
         self.run_factory = RunFactory()
-        self.load_data(axis_order_in_file)
-        self.sort_data()
+        self.concentration_parser = ConcentrationParser()
+        # one loader / modifier pair for the whole lot, instead of a pair per run
+        self.text_loader, self.data_modifier = self.run_factory.return_components(analysis_type, axis_order_in_file, self.dtype)
+        self.archive = None # a LotArchive if directory is an archive file instead of a folder
+        self.stage_memo = StageMemo() # measure / fit / qa outputs on this lot, shared by every AnalysisCore using it
+        self.filtered_lots = FilterCache() # the filtered traces of this lot, per filter setting
+        self.streaming_reader = streaming_reader # reads files past its size threshold in bounded memory, None reads every file whole
+        self.streamed = set() # file paths of the runs that were streamed, only kept around the measurement time
+        if LotArchive.is_archive(directory):
+            self.open_archive()
+        # progress_callback is called with (files done, total files) after every run, cancel_event is checked between
+        # runs. they and the instrumentation are only for this first load, see LoadContext
+        context = LoadContext(instrumentation, progress_callback, cancel_event)
+        self.load_data(axis_order_in_file, context)
+        self.sort_data(context.instrumentation)
+
+    def open_archive(self):
+        ''' loads runs from a lot archive instead of text files. nothing to parse, so no cache / worker processes.
+        the axis order was fixed when the archive was packed
+        '''
+        self.archive = LotArchive(self.directory)
+        if self.archive.analysis_type != self.analysis_type:
+            raise ValueError(f"{self.directory} is a {self.archive.analysis_type} archive, not {self.analysis_type}")
+        self.text_loader = ArchiveTextLoader(self.archive)
+        self.cache = None
+        self.workers = 1
+
+    def copy(self) -> "Data":
+        ''' a copy that can be changed (ie runs added in watch mode) without touching this one, which may be shared
+        through the lot cache. the samples are copied, the memoized stages / filtered traces start over
+        '''
+        data = copy.copy(self)
+        data.store = self.store.copy()
+        data.flags = dict(self.flags)
+        data.streamed = set(self.streamed)
+        data.stage_memo = StageMemo()
+        data.filtered_lots = FilterCache()
+        data.data_modifier = self.run_factory.return_components(self.analysis_type, self.axis_order_in_file, self.dtype)[1] # it keeps the last run's flags
+        return data
+
+    def nbytes(self) -> int:
+        ''' memory of the samples, including any filtered copies of them '''
+        return self.store.nbytes() + self.filtered_lots.nbytes()
+
+    @property
+    def nested_data(self) -> list[RunView]:
+        ''' the runs, sorted by concentration '''
+        return self.store.views()
+
+    def file_paths(self) -> set[str]:
+        ''' paths of every file that has been loaded '''
+        return set(self.store.file_paths)
 
-    def load_data(self, axis_order_in_file):
-        ''' loads data thru all Run objects '''
+    def add_run(self, file_path: str, instrumentation: Instrumentation | None = None, read_run: tuple | None = None) -> RunView:
+        ''' loads one more file and inserts it in sorted position, ie a file that just showed up in a watched folder.
+        read_run is what read_run() gave for the file if it was read already (ie on a worker thread)
+        '''
+        if read_run is None:
+            read_run = self.read_run(file_path, instrumentation)
+        index = self.store_run(file_path, *read_run)
+        self.store.insert_sorted(index)
+        return RunView(self.store, index)
+
+    def streams(self, file_path: str) -> bool:
+        ''' whether a file is read by the streaming reader instead of whole '''
+        return self.streaming_reader is not None and self.archive is None and self.streaming_reader.should_stream(file_path)
+
+    def read_run(self, file_path: str, instrumentation: Instrumentation | None = None) -> tuple[numpy.ndarray, numpy.ndarray, list[str], bool]:
+        ''' parses / modifies (or streams, if it's long enough) one file without adding it to the lot, returns the
+        x / y axes, the modifier flags and whether it was streamed. nothing the lot is read from is changed, so this
+        can run on a worker thread while the lot is in use, store_run adds it afterwards
+        '''
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+        if self.streams(file_path):
+            # streams one (very long) file, only what the analysis needs of it is kept
+            with instrumentation.span("load.stream"):
+                x_axis, y_axis, flags, rows = self.streaming_reader.read(file_path)
+            instrumentation.count("files_streamed")
+            instrumentation.count("rows", rows)
+            return x_axis, y_axis, flags, True
+        with instrumentation.span("load.parse"):
+            loaded_data_tuple = self.text_loader.load_data(file_path)
+        with instrumentation.span("load.modify"):
+            x_axis, y_axis = self.data_modifier.modify_data(loaded_data_tuple)
+        instrumentation.count("files_parsed")
+        instrumentation.count("rows", len(x_axis))
+        return x_axis, y_axis, list(self.data_modifier.flags), False
+
+    def store_run(self, file_path: str, x_axis: numpy.ndarray, y_axis: numpy.ndarray, flags: list[str], streamed: bool) -> int:
+        ''' adds a run read by read_run to the store, returns its storage index '''
+        if streamed:
+            self.streamed.add(file_path)
+        self.add_flags(file_path, flags)
+        return self.store.append(file_path, self.concentration_parser.extract_concentration_from_filename(file_path), x_axis, y_axis)
+
+    def load_file(self, file_path: str, context: LoadContext) -> int:
+        ''' parses / modifies (or streams) one file into the store, returns its storage index '''
+        return self.store_run(file_path, *self.read_run(file_path, context.instrumentation))
+
+    def add_flags(self, file_path: str, flags):
+        ''' keeps the modifier flags of a run, if there are any '''
+        if flags:
+            self.flags[file_path] = list(flags)
+
+    def list_files(self) -> list[str]:
+        ''' lists all data files in the directory, in scandir order. for an archive, the runs it holds
+        (as archive path / original file name, so the concentration still comes from the file name)
+        '''
+        if self.archive is not None:
+            return [os.path.join(self.directory, file_name) for file_name in self.archive.file_names]
+        file_paths = []
         for file in os.scandir(self.directory):
             if file.is_file() and not file.name.startswith('.'): # you can access the str name of the file path using file.path. also ignores hidden files like . ds store
-                run_obj = self.run_factory.return_run(self.analysis_type, file.path, axis_order_in_file)
-                self.nested_data.append(run_obj)
+                file_paths.append(file.path)
+        return file_paths
+
+    def cache_key(self, file_path: str, axis_order_in_file) -> str:
+        ''' cache key of a run, float64 and float32 runs are cached separately. the modifier version is in it too, so
+        runs cached by older modifiers (ie the stone channel picked over the whole run, no flags) miss
+        '''
+        stage = f"modified-v{self.MODIFIER_VERSION}"
+        if self.dtype != numpy.float64:
+            stage += f"-{self.dtype.name}"
+        return self.cache.make_key(file_path, self.analysis_type, axis_order_in_file, stage)
+
+    def report_progress(self, context: LoadContext):
+        ''' counts a finished run, reports it and stops here if the load was cancelled '''
+        context.report_progress()
+        self.check_cancelled(context)
+
+    def check_cancelled(self, context: LoadContext):
+        ''' raises AnalysisCancelled if the load was cancelled '''
+        if context.cancelled():
+            raise AnalysisCancelled(f"Loading {self.directory} was cancelled")
+
+    def load_data(self, axis_order_in_file, context: LoadContext):
+        ''' loads data from every file into the store '''
+        with context.instrumentation.span("load"):
+            file_paths = self.list_files()
+            self.files_total = context.files_total = len(file_paths)
+            self.check_cancelled(context)
+            # streamed runs depend on the measurement time, so they're neither cached nor sent to the worker processes
+            streamed_file_paths = [file_path for file_path in file_paths if self.streams(file_path)]
+            file_paths = [file_path for file_path in file_paths if file_path not in streamed_file_paths]
+            for file_path in streamed_file_paths:
+                self.load_file(file_path, context)
+                self.report_progress(context)
+            if self.cache is not None:
+                file_paths = self.load_cached_data(file_paths, axis_order_in_file, context)
+            first_loaded = len(self.store)
+            if self.workers > 1 and len(file_paths) > 1:
+                self.load_data_parallel(file_paths, axis_order_in_file, context)
+            else:
+                for file_path in file_paths:
+                    self.load_file(file_path, context)
+                    self.report_progress(context)
+            self.store.shrink_to_fit()
+            if self.cache is not None:
+                with context.instrumentation.span("load.cache_write"):
+                    for index in range(first_loaded, len(self.store)):
+                        run = RunView(self.store, index)
+                        self.cache.put(self.cache_key(run.file_path, axis_order_in_file), run.x_axis, run.y_axis, self.flags.get(run.file_path))
+                    self.cache.save_index()
+
+    def load_cached_data(self, file_paths: list[str], axis_order_in_file, context: LoadContext) -> list[str]:
+        ''' loads every run that is in the cache, returns the file paths that still need parsing. the hits are only
+        mapped until the store has been sized for all of them, then each is copied in once
+        '''
+        missed_file_paths = []
+        hits = []
+        for file_path in file_paths:
+            with context.instrumentation.span("load.cache"):
+                key = self.cache_key(file_path, axis_order_in_file)
+                cached = self.cache.get(key)
+            if cached is None:
+                missed_file_paths.append(file_path)
+                continue
+            self.add_flags(file_path, self.cache.get_flags(key))
+            hits.append((file_path, cached))
+        self.store.reserve(self.store.sample_count + sum(cached.shape[1] for _, cached in hits))
+        self.store.reserve_runs(len(self.store) + len(hits))
+        for file_path, cached in hits:
+            with context.instrumentation.span("load.cache"):
+                self.store.append(file_path, self.concentration_parser.extract_concentration_from_filename(file_path), cached[0], cached[1])
+            context.instrumentation.count("cache_hits")
+            context.instrumentation.count("rows", cached.shape[1])
+            self.report_progress(context)
+        return missed_file_paths
+
+    def load_data_parallel(self, file_paths: list[str], axis_order_in_file, context: LoadContext):
+        ''' loads runs across a process pool. every worker writes into one shared memory block for the whole lot,
+        which is copied into the store once at the end (one memcpy, no pickling of the arrays) and then freed
+        '''
+        # sized from the file sizes, nothing is read here. the unused reserved rows are never written, so they
+        # don't take any memory on Linux / macOS
+        capacities = [self.text_loader.parser.max_rows(os.path.getsize(file_path)) for file_path in file_paths]
+        offsets = numpy.concatenate(([0], numpy.cumsum(capacities)[:-1])).astype(int)
+        total_rows = max(int(sum(capacities)), 1)
+
+        block = shared_memory.SharedMemory(create=True, size=2 * total_rows * self.dtype.itemsize)
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(file_paths))) as pool:
+                futures = [
+                    pool.submit(load_run_into_block, self.analysis_type, file_path, axis_order_in_file, block.name, total_rows, int(offset), capacity, self.dtype.name)
+                    for file_path, offset, capacity in zip(file_paths, offsets, capacities)
+                ]
+                try:
+                    for future in as_completed(futures):
+                        future.result() # raises straight away if a worker failed
+                        self.report_progress(context)
+                except BaseException:
+                    pool.shutdown(wait=True, cancel_futures=True) # workers still write into the block, let them finish before it's freed
+                    raise
+                lengths = []
+                for file_path, future in zip(file_paths, futures):
+                    length, parse_seconds, modify_seconds, flags = future.result()
+                    lengths.append(length)
+                    self.add_flags(file_path, flags)
+                    context.instrumentation.add_time("load.parse", parse_seconds) # worker process time, these overlap
+                    context.instrumentation.add_time("load.modify", modify_seconds)
+                    context.instrumentation.count("files_parsed")
+                    context.instrumentation.count("rows", length)
+            shared_array = numpy.ndarray((2, total_rows), dtype=self.dtype, buffer=block.buf)
+            # copy out of the block (dropping the unused reserved rows) so it can be freed
+            self.store.reserve(self.store.sample_count + sum(lengths))
+            for file_path, offset, length in zip(file_paths, offsets, lengths):
+                label = self.concentration_parser.extract_concentration_from_filename(file_path)
+                self.store.append(file_path, label, shared_array[0, offset:offset + length], shared_array[1, offset:offset + length])
+            del shared_array
+        finally:
+            block.close()
+            block.unlink()
 
-    def sort_data(self):
-        ''' sorts run objects by their concentration / count, lowest to highest '''
-        self.nested_data = sorted(self.nested_data, key=lambda run: float(run.concentration))
\ No newline at end of file
+    def sort_data(self, instrumentation: Instrumentation | None = None):
+        ''' sorts runs by their concentration / count, lowest to highest '''
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+        with instrumentation.span("sort"):
+            self.store.sort_by_concentration()
@@ -0,0 +1,207 @@
+''' level of detail for the trace plots, so huge traces don't slow down drawing / pan / zoom '''
+import numpy
+
+
+def min_max_decimate(x_axis: numpy.ndarray, y_axis: numpy.ndarray, max_points: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+    ''' cuts a trace down to about max_points by splitting it into max_points / 2 bins and keeping the
+    min and the max sample of each bin (in the order they happen), so peaks and dips stay visible
+    '''
+    sample_count = len(x_axis)
+    bin_count = max(max_points // 2, 1)
+    if sample_count <= max_points or sample_count < 2 * bin_count:
+        return x_axis, y_axis
+    bin_size = -(-sample_count // bin_count) # ceil
+    bin_count = -(-sample_count // bin_size) # so no bin is only padding
+    padded = numpy.empty(bin_count * bin_size, dtype=y_axis.dtype)
+    padded[:sample_count] = y_axis
+    padded[sample_count:] = y_axis[-1] # pad with the last sample, it's already in the last bin anyway
+    bins = padded.reshape(bin_count, bin_size)
+    starts = numpy.arange(bin_count) * bin_size
+    min_indexes = starts + bins.argmin(axis=1)
+    max_indexes = starts + bins.argmax(axis=1)
+    # the first / last samples are always kept, so autoscaling sees the full x range
+    indexes = numpy.unique(numpy.concatenate(([0, sample_count - 1], min_indexes, max_indexes)))
+    return x_axis[indexes], y_axis[indexes]
+
+
+class BucketDecimator():
+    ''' min_max_decimate for a trace that comes in a block at a time and whose length isn't known up front (see
+    StreamingReader). time is split into max_points / 2 buckets of equal width, each keeping its min and max sample.
+    when a sample lands past the last bucket the width doubles and neighbouring buckets are merged pairwise, so the
+    memory is a fixed 5 arrays of max_points / 2 whatever the length of the trace
+    '''
+    def __init__(self, max_points: int = 4000):
+        self.bucket_count = max(max_points // 4, 1) * 2 # even, so the buckets merge in pairs
+        self.width = None # s per bucket, from the first block
+        self.origin = None # time of the first sample
+        self.filled = numpy.zeros(self.bucket_count, dtype=bool)
+        self.min_times = numpy.empty(self.bucket_count)
+        self.min_values = numpy.empty(self.bucket_count)
+        self.max_times = numpy.empty(self.bucket_count)
+        self.max_values = numpy.empty(self.bucket_count)
+
+    def nbytes(self) -> int:
+        ''' memory of the buckets, the same from the first sample to the last '''
+        return self.filled.nbytes + self.min_times.nbytes + self.min_values.nbytes + self.max_times.nbytes + self.max_values.nbytes
+
+    def add(self, x_axis: numpy.ndarray, y_axis: numpy.ndarray):
+        ''' folds a block of samples into the buckets '''
+        if not len(x_axis):
+            return
+        if self.origin is None:
+            self.origin = float(x_axis[0])
+            self.width = max((float(x_axis[-1]) - self.origin) / self.bucket_count, 1E-6)
+        buckets = numpy.maximum(numpy.floor((x_axis - self.origin) / self.width), 0).astype(numpy.int64)
+        while buckets.max() >= self.bucket_count:
+            self.merge()
+            buckets >>= 1 # floor(t / 2w) is floor(t / w) // 2
+        block_buckets, mins, maxes = self.extremes(buckets, y_axis)
+        empty = ~self.filled[block_buckets]
+        lower = empty | (y_axis[mins] < self.min_values[block_buckets])
+        higher = empty | (y_axis[maxes] > self.max_values[block_buckets])
+        self.min_times[block_buckets[lower]] = x_axis[mins[lower]]
+        self.min_values[block_buckets[lower]] = y_axis[mins[lower]]
+        self.max_times[block_buckets[higher]] = x_axis[maxes[higher]]
+        self.max_values[block_buckets[higher]] = y_axis[maxes[higher]]
+        self.filled[block_buckets] = True
+
+    @staticmethod
+    def extremes(buckets: numpy.ndarray, y_axis: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        ''' the buckets a block touches, with the index of its min and max sample in each '''
+        if numpy.all(buckets[1:] >= buckets[:-1]):
+            # time goes forwards (the usual), each bucket is one run of the block, no sort needed
+            firsts = numpy.flatnonzero(numpy.diff(buckets, prepend=-1))
+            runs = numpy.repeat(numpy.arange(len(firsts)), numpy.diff(numpy.append(firsts, len(buckets))))
+            indexes = []
+            for reduce in (numpy.minimum, numpy.maximum):
+                hits = numpy.flatnonzero(y_axis == reduce.reduceat(y_axis, firsts)[runs])
+                indexes.append(hits[numpy.searchsorted(hits, firsts)]) # first sample of each run at its min / max
+            return buckets[firsts], indexes[0], indexes[1]
+        # sorted by bucket then value, so each bucket's run starts with its min and ends with its max
+        order = numpy.lexsort((y_axis, buckets))
+        sorted_buckets = buckets[order]
+        firsts = numpy.flatnonzero(numpy.diff(sorted_buckets, prepend=-1))
+        lasts = numpy.append(firsts[1:], len(order)) - 1
+        return sorted_buckets[firsts], order[firsts], order[lasts]
+
+    def merge(self):
+        ''' doubles the bucket width, each pair of buckets becomes one in the first half '''
+        half = self.bucket_count // 2
+        first, second = self.filled[0::2], self.filled[1::2]
+        lower = second & (~first | (self.min_values[1::2] < self.min_values[0::2]))
+        higher = second & (~first | (self.max_values[1::2] > self.max_values[0::2]))
+        for choose, times, values in ((lower, self.min_times, self.min_values), (higher, self.max_times, self.max_values)):
+            times[:half] = numpy.where(choose, times[1::2], times[0::2])
+            values[:half] = numpy.where(choose, values[1::2], values[0::2])
+        self.filled[:half] = first | second
+        self.filled[half:] = False
+        self.width *= 2
+
+    def points(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        ''' the kept samples in time order, a bucket's min and max only once if they're the same sample '''
+        filled = self.filled
+        x_axis = numpy.concatenate((self.min_times[filled], self.max_times[filled]))
+        y_axis = numpy.concatenate((self.min_values[filled], self.max_values[filled]))
+        same = (self.min_times[filled] == self.max_times[filled]) & (self.min_values[filled] == self.max_values[filled])
+        keep = numpy.concatenate((numpy.ones(len(same), dtype=bool), ~same))
+        x_axis, y_axis = x_axis[keep], y_axis[keep]
+        order = numpy.argsort(x_axis, kind="stable")
+        return x_axis[order], y_axis[order]
+
+
+class TraceDecimator():
+    ''' keeps the full resolution data behind the lines of an axes, and only hands matplotlib a decimated copy,
+    about 2 points per pixel of the axes width. on zoom / pan / resize the visible x range is decimated
+    again from the full data, so zooming in shows real detail. full_resolution turns decimation off
+    '''
+    POINTS_PER_PIXEL = 2
+
+    def __init__(self, ax, full_resolution: bool = False):
+        self.ax = ax
+        self.full_resolution = full_resolution
+        self.traces = [] # (Line2D, full x, full y)
+        self.lines = {} # key (ie file path) -> Line2D, so lines can be reused between analyses
+        self.full_range_points = None # budget the lines were decimated to over their full range, None if they're zoomed / full resolution
+        ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
+        ax.figure.canvas.mpl_connect('resize_event', self.on_resize)
+
+    def set_traces(self, traces: list[tuple], decimated: list[tuple] | None = None, decimated_points: int | None = None) -> list:
+        ''' updates the plotted traces in place from (key, x, y, label) tuples. lines are reused by key,
+        only new keys get a new line and keys that are gone have their line removed. decimated is each trace already
+        cut down to decimated_points over its full range (ie on the analysis worker), used if that's still the budget.
+        returns the lines in the same order as traces (ie for the legend)
+        '''
+        budget = self.max_points()
+        if decimated is None or decimated_points != budget or self.full_resolution:
+            decimated = [self.decimate(x_axis, y_axis) for _, x_axis, y_axis, _ in traces]
+        lines = {}
+        self.traces = []
+        for (key, x_axis, y_axis, label), points in zip(traces, decimated):
+            line = self.lines.pop(key, None)
+            if line is None:
+                line, = self.ax.plot([], [])
+            line.set_label(label)
+            line.set_data(*points) # full range, the view gets refined once the limits settle
+            lines[key] = line
+            self.traces.append((line, x_axis, y_axis))
+        for line in self.lines.values():
+            line.remove()
+        self.lines = lines
+        self.full_range_points = None if self.full_resolution else budget
+        return [line for line, _, _ in self.traces]
+
+    def max_points(self) -> int:
+        ''' point budget per trace, from the current width of the axes in pixels '''
+        return self.points_for_width(self.ax.bbox.width)
+
+    @classmethod
+    def points_for_width(cls, width: float) -> int:
+        ''' point budget per trace for axes width pixels wide, ie to decimate before the axes exist '''
+        return max(int(width * cls.POINTS_PER_PIXEL), 100)
+
+    def decimate(self, x_axis: numpy.ndarray, y_axis: numpy.ndarray, x_limits=None) -> tuple[numpy.ndarray, numpy.ndarray]:
+        ''' decimates the part of the trace inside x_limits (plus one sample each side, so lines run off the edge) '''
+        if self.full_resolution:
+            return x_axis, y_axis
+        start, stop = 0, len(x_axis)
+        if x_limits is not None:
+            low, high = (x_axis.dtype.type(limit) for limit in sorted(x_limits)) # same dtype as the trace, so a float32 one isn't upcast
+            start = max(int(numpy.searchsorted(x_axis, low)) - 1, 0)
+            stop = min(int(numpy.searchsorted(x_axis, high, side='right')) + 1, len(x_axis))
+        return min_max_decimate(x_axis[start:stop], y_axis[start:stop], self.max_points())
+
+    def refresh(self):
+        ''' re-decimates every trace for the current view. skipped if the view still takes in every trace and the
+        budget hasn't changed, the lines are already that (ie autoscaling right after set_traces)
+        '''
+        x_limits = self.ax.get_xlim()
+        budget = self.max_points()
+        showing_all = all(self.covers(x_axis, x_limits) for _, x_axis, _ in self.traces)
+        if showing_all and self.full_range_points == budget and not self.full_resolution:
+            return
+        for line, x_axis, y_axis in self.traces:
+            line.set_data(*self.decimate(x_axis, y_axis, x_limits))
+        self.full_range_points = budget if showing_all and not self.full_resolution else None
+
+    @staticmethod
+    def covers(x_axis: numpy.ndarray, x_limits) -> bool:
+        ''' whether x_limits take in the whole trace, so decimating the view is decimating the full range '''
+        if not len(x_axis):
+            return True
+        low, high = (x_axis.dtype.type(limit) for limit in sorted(x_limits))
+        return low <= x_axis[0] and x_axis[-1] <= high
+
+    def set_full_resolution(self, full_resolution: bool):
+        ''' toggles decimation and redraws '''
+        self.full_resolution = full_resolution
+        self.full_range_points = None
+        self.refresh()
+        self.ax.figure.canvas.draw_idle()
+
+    def on_xlim_changed(self, _ax):
+        ''' zoom / pan callback '''
+        self.refresh()
+
+    def on_resize(self, _event):
+        ''' canvas resize callback, the point budget follows the width '''
+        self.refresh()
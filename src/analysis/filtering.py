@@ -0,0 +1,166 @@
+''' smoothing for noisy traces: every run of a lot is put on one time grid and filtered in a single batched call '''
+import threading
+from collections import OrderedDict
+import numpy
+
+from src.analysis.pipeline import StageMemo
+from src.analysis.instrumentation import Instrumentation
+
+
+class TraceFilter():
+    ''' one filter setting: the method (moving_average, median or savgol, "none" turns it off), its window in
+    seconds and, for Savitzky-Golay, the polynomial order. apply() filters the rows of a (runs, samples) matrix
+    along time in one scipy call, with the edges held at the nearest sample
+    '''
+    METHODS = ("none", "moving_average", "median", "savgol")
+
+    def __init__(self, method: str = "none", window: float = 1.0, polyorder: int = 2):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown trace filter {method}, must be one of {', '.join(self.METHODS)}")
+        self.method = method
+        self.window = window
+        self.polyorder = polyorder
+
+    @property
+    def enabled(self) -> bool:
+        ''' whether the traces get filtered at all '''
+        return self.method != "none"
+
+    def key(self) -> tuple:
+        ''' what the filtered traces depend on, ie for caching them '''
+        return (self.method, self.window, self.polyorder if self.method == "savgol" else None)
+
+    def window_samples(self, step: float) -> int:
+        ''' the window in samples of a grid with this spacing. odd for median / Savitzky-Golay so it's centred,
+        and longer than the polynomial order for Savitzky-Golay
+        '''
+        samples = max(int(round(self.window / step)), 1)
+        if self.method == "savgol":
+            samples = max(samples, self.polyorder + 1)
+        if self.method in ("median", "savgol") and samples % 2 == 0:
+            samples += 1
+        return samples
+
+    def apply(self, matrix: numpy.ndarray, step: float) -> numpy.ndarray:
+        ''' filters every row of matrix (runs on a grid with this spacing) at once '''
+        # pylint: disable=import-outside-toplevel # scipy is slow to import, and only needed once a filter is on
+        samples = self.window_samples(step)
+        if self.method == "moving_average":
+            from scipy.ndimage import uniform_filter1d
+            return uniform_filter1d(matrix, samples, axis=1, mode="nearest")
+        if self.method == "median":
+            from scipy.ndimage import median_filter
+            return median_filter(matrix, size=(1, samples), mode="nearest")
+        if self.method == "savgol":
+            from scipy.signal import savgol_filter
+            return savgol_filter(matrix, samples, self.polyorder, axis=1, mode="nearest")
+        return matrix
+
+
+class FilteredRun():
+    ''' a run on the filter grid, with the same concentration / file_path / x_axis / y_axis the analyses use '''
+    __slots__ = ("file_path", "concentration", "x_axis", "y_axis")
+
+    def __init__(self, file_path: str, concentration: str, x_axis: numpy.ndarray, y_axis: numpy.ndarray):
+        self.file_path = file_path
+        self.concentration = concentration
+        self.x_axis = x_axis
+        self.y_axis = y_axis
+
+
+class FilteredLot():
+    ''' the runs of a Data with one TraceFilter applied. looks like a Data to the analyses (analysis_type /
+    nested_data / stage_memo), and follows it as runs are added (watch mode): nested_data filters whichever runs
+    haven't been yet, all of them in one batch, and keeps them, so every run is only filtered once per setting.
+
+    the grid is every step seconds from 0 (both modifiers start a run's time at 0), step being the lot's sample
+    spacing, so all runs share it and stack into one (runs, samples) matrix. shorter runs are padded with their
+    last reading, which is what the filters' nearest edge mode would see anyway, so a run filters the same in any
+    batch and is cut back to its own length afterwards
+    '''
+    def __init__(self, data, trace_filter: TraceFilter):
+        self.data = data
+        self.trace_filter = trace_filter
+        self.stage_memo = StageMemo() # the measure / fit / qa of the filtered traces
+        self.runs = {} # file path -> FilteredRun
+        self.step = None # grid spacing (s), from the first runs filtered
+        self.times = numpy.empty(0) # the grid, every run's x_axis is a slice of it
+        self.lock = threading.Lock() # the main window and the comparison can be on the same lot
+
+    @property
+    def analysis_type(self) -> str:
+        ''' same as the lot's '''
+        return self.data.analysis_type
+
+    @property
+    def nested_data(self) -> list[FilteredRun]:
+        ''' the filtered runs, in the lot's order '''
+        return self.filter_missing()
+
+    def filter_missing(self, instrumentation: Instrumentation | None = None) -> list[FilteredRun]:
+        ''' filters whichever of the lot's runs haven't been yet (timed on the instrumentation of the analysis asking,
+        the lot is shared), returns every filtered run in the lot's order
+        '''
+        runs = self.data.nested_data
+        with self.lock:
+            missing = [run for run in runs if run.file_path not in self.runs]
+            if missing:
+                self.filter_runs(missing, instrumentation)
+            return [self.runs[run.file_path] for run in runs]
+
+    def filtered(self, run, instrumentation: Instrumentation | None = None) -> FilteredRun:
+        ''' the filtered version of one of the lot's runs '''
+        with self.lock:
+            if run.file_path not in self.runs:
+                self.filter_runs([run], instrumentation)
+            return self.runs[run.file_path]
+
+    def nbytes(self) -> int:
+        ''' memory of the filtered samples '''
+        return self.times.nbytes + sum(run.y_axis.nbytes for run in self.runs.values())
+
+    def filter_runs(self, runs, instrumentation: Instrumentation | None = None):
+        ''' resamples runs onto the grid and filters them in one go. called with the lock held '''
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+        with instrumentation.span("filter"):
+            if self.step is None:
+                self.step = float(numpy.median([numpy.median(numpy.diff(run.x_axis)) for run in runs if len(run.x_axis) > 1] or [1.0]))
+            lengths = [int((float(run.x_axis[-1]) if len(run.x_axis) else 0.0) / self.step) + 1 for run in runs]
+            if max(lengths) > len(self.times):
+                self.times = numpy.arange(max(lengths)) * self.step
+            matrix = numpy.empty((len(runs), max(lengths)))
+            for row, (run, length) in enumerate(zip(runs, lengths)):
+                matrix[row, :length] = numpy.interp(self.times[:length], run.x_axis, run.y_axis)
+                matrix[row, length:] = matrix[row, length - 1]
+            filtered = self.trace_filter.apply(matrix, self.step)
+            times = self.times.astype(self.data.dtype)
+            for row, (run, length) in enumerate(zip(runs, lengths)):
+                self.runs[run.file_path] = FilteredRun(run.file_path, run.concentration, times[:length], filtered[row, :length].astype(self.data.dtype))
+            instrumentation.count("runs_filtered", len(runs))
+
+
+class FilterCache():
+    ''' the FilteredLots of one Data, one per filter setting. the MAX_FILTERS most recently used are kept, so
+    switching between filters (or off and on again) doesn't filter the runs again
+    '''
+    MAX_FILTERS = 3
+
+    def __init__(self):
+        self.lots = OrderedDict() # TraceFilter.key() -> FilteredLot, least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, data, trace_filter: TraceFilter) -> FilteredLot:
+        ''' the filtered lot for a setting, made (empty, runs are filtered as they're asked for) if it's new '''
+        key = trace_filter.key()
+        with self.lock:
+            if key not in self.lots:
+                self.lots[key] = FilteredLot(data, trace_filter)
+            self.lots.move_to_end(key)
+            while len(self.lots) > self.MAX_FILTERS:
+                self.lots.popitem(last=False)
+            return self.lots[key]
+
+    def nbytes(self) -> int:
+        ''' memory of every filtered lot kept '''
+        with self.lock:
+            return sum(lot.nbytes() for lot in self.lots.values())
@@ -0,0 +1,83 @@
+''' lightweight timing spans / counters for the analysis hot paths, so a slow lot shows where its time went '''
+import time
+from contextlib import nullcontext
+
+NULL_SPAN = nullcontext() # handed out by disabled instrumentation, entering / exiting it does nothing
+
+
+class Span():
+    ''' times one with block and adds it to the instrumentation '''
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation():
+    ''' named timing spans and counters. spans with the same name (ie one per file) are rolled up into
+    count / total / last / max. when disabled, span() returns a shared no-op context and count() / add_time()
+    return straight away, so instrumented code costs one attribute check
+    '''
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.spans = {} # name -> [count, total seconds, last seconds, max seconds]
+        self.counters = {} # name -> int
+
+    def span(self, name: str):
+        ''' with instrumentation.span("load.parse"): ... '''
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def add_time(self, name: str, seconds: float):
+        ''' adds a span that was timed somewhere else, ie in a loading worker process '''
+        if not self.enabled:
+            return
+        stats = self.spans.get(name)
+        if stats is None:
+            self.spans[name] = [1, seconds, seconds, seconds]
+            return
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = seconds
+        stats[3] = max(stats[3], seconds)
+
+    def merge(self, other: "Instrumentation"):
+        ''' adds the spans / counters of another instrumentation, ie one a worker thread recorded into '''
+        if not self.enabled:
+            return
+        for name, (count, total, last, longest) in other.spans.items():
+            stats = self.spans.setdefault(name, [0, 0.0, last, longest])
+            stats[0] += count
+            stats[1] += total
+            stats[2] = last
+            stats[3] = max(stats[3], longest)
+        for name, amount in other.counters.items():
+            self.count(name, amount)
+
+    def count(self, name: str, amount: int = 1):
+        ''' adds to a counter, ie rows loaded '''
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self) -> dict:
+        ''' everything recorded so far, json friendly. span times are in seconds '''
+        return {
+            "enabled": self.enabled,
+            "spans": {
+                name: {"count": count, "total": total, "last": last, "max": longest, "mean": total / count}
+                for name, (count, total, last, longest) in self.spans.items()
+            },
+            "counters": dict(self.counters)
+        }
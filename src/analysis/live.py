@@ -0,0 +1,244 @@
+''' live tailing of an acquisition file that's still being written: only the bytes appended since the last poll are
+parsed, and the modifier transforms are applied to just those rows, so following a run costs the same per new row
+however long it gets
+'''
+import os
+from abc import abstractmethod
+import numpy
+
+from src.analysis.run import DataModifier, ConcentrationParser, RunFactory, LactateStoneCalibrationDataModifier
+from src.analysis.segmentation import StageWindowTracker
+from src.analysis.measurement import MeasurementEngine
+
+
+class GrowableColumns():
+    ''' preallocated columns that rows are appended to. the capacity doubles when it runs out (like RunStore),
+    so appending n rows one chunk at a time copies each row O(1) times. columns() hands out views of the rows in use
+    '''
+    def __init__(self, dtypes: tuple, capacity: int = 1 << 16):
+        self.arrays = [numpy.empty(capacity, dtype=dtype) for dtype in dtypes]
+        self.rows = 0
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def reserve(self, rows: int):
+        ''' makes room for at least rows rows in total '''
+        if rows <= len(self.arrays[0]):
+            return
+        capacity = max(rows, 2 * len(self.arrays[0]))
+        for i, array in enumerate(self.arrays):
+            grown = numpy.empty(capacity, dtype=array.dtype)
+            grown[:self.rows] = array[:self.rows]
+            self.arrays[i] = grown
+
+    def append(self, *columns: numpy.ndarray):
+        ''' appends the same number of rows to every column '''
+        rows = len(columns[0])
+        self.reserve(self.rows + rows)
+        for array, column in zip(self.arrays, columns):
+            array[self.rows:self.rows + rows] = column
+        self.rows += rows
+
+    def columns(self, start: int = 0) -> tuple[numpy.ndarray, ...]:
+        ''' views of every column from row start to the last row in use '''
+        return tuple(array[start:self.rows] for array in self.arrays)
+
+    def clear(self):
+        ''' drops every row, keeps the capacity '''
+        self.rows = 0
+
+
+class LiveDataModifier(DataModifier):
+    ''' a DataModifier that's fed a run a chunk of rows at a time, and keeps the modified run so far (x_axis / y_axis).
+    at any point that's what the normal modifier gives for the rows fed so far. modify_data feeds a whole run at once
+    '''
+    def __init__(self, dtype=numpy.float64):
+        self.dtype = numpy.dtype(dtype)
+        self.reset()
+
+    @abstractmethod
+    def reset(self):
+        ''' forgets every row, ie the file was restarted '''
+
+    @abstractmethod
+    def add_rows(self, loaded_data_tuple):
+        ''' modifies newly loaded rows and adds them to the run '''
+
+    @property
+    @abstractmethod
+    def x_axis(self) -> numpy.ndarray:
+        ''' modified time so far '''
+
+    @property
+    @abstractmethod
+    def y_axis(self) -> numpy.ndarray:
+        ''' modified current / counts so far '''
+
+    def modify_data(self, loaded_data_tuple):
+        self.reset()
+        self.add_rows(loaded_data_tuple)
+        return self.x_axis, self.y_axis
+
+
+class LiveVSPModifier(LiveDataModifier):
+    ''' incremental LactateVSPCalibrationDataModifier: time relative to the first row, current in nA '''
+    def reset(self):
+        self.flags = ()
+        self.output = GrowableColumns((numpy.float64, self.dtype))
+        self.time_origin = None
+
+    def add_rows(self, loaded_data_tuple):
+        time_array, current_array = loaded_data_tuple
+        if not len(time_array):
+            return
+        if self.time_origin is None:
+            self.time_origin = time_array[0]
+        time_array = self.writable(time_array)
+        time_array -= self.time_origin
+        self.output.append(time_array, self.scale_current(current_array))
+
+    @property
+    def x_axis(self) -> numpy.ndarray:
+        return self.output.columns()[0]
+
+    @property
+    def y_axis(self) -> numpy.ndarray:
+        return self.output.columns()[1]
+
+
+class LiveStoneModifier(LiveDataModifier):
+    ''' incremental LactateStoneCalibrationDataModifier. the raw rows are kept, since the window (first stage 2 sample
+    to the end) and the channel (whichever is higher inside the window) can only be settled as rows come in: until
+    stage 2 shows up the whole run is used and flagged, like the normal modifier. once it does the time column is
+    redone from the window start, once, and after that every chunk only touches its own rows
+    '''
+    MEASUREMENT_STAGE = LactateStoneCalibrationDataModifier.MEASUREMENT_STAGE
+
+    def reset(self):
+        self.raw = GrowableColumns((numpy.float64, self.dtype, self.dtype, self.dtype)) # time, count2, stage2, count3
+        self.time = GrowableColumns((numpy.float64,)) # s from the window start
+        self.windows = StageWindowTracker(self.MEASUREMENT_STAGE)
+        self.max2 = -numpy.inf # channel maxima inside the window
+        self.max3 = -numpy.inf
+        self.flags = self.windows.flags()
+
+    def add_rows(self, loaded_data_tuple):
+        time_array, count2_array, stage2_array, count3_array = loaded_data_tuple
+        if not len(time_array):
+            return
+        first_row = len(self.raw)
+        self.raw.append(time_array, count2_array, stage2_array, count3_array)
+        if self.windows.add(stage2_array) is not None:
+            # the window moves from the whole run to the first stage 2 sample, so what's there is redone once
+            self.time.clear()
+            self.max2 = self.max3 = -numpy.inf
+            first_row = self.windows.window_start
+        start = self.window_start()
+        raw_time, count2, _, count3 = self.raw.columns(first_row)
+        new_time = raw_time - self.raw.arrays[0][start] # a new array, the raw time stays as it was
+        new_time /= 1000
+        self.time.append(new_time)
+        self.max2 = max(self.max2, count2.max())
+        self.max3 = max(self.max3, count3.max())
+        self.flags = self.windows.flags()
+
+    def window_start(self) -> int:
+        ''' row the window starts at, the first stage 2 sample or the first row until there is one '''
+        return self.windows.window_start or 0
+
+    @property
+    def x_axis(self) -> numpy.ndarray:
+        return self.time.columns()[0]
+
+    @property
+    def y_axis(self) -> numpy.ndarray:
+        _, count2, _, count3 = self.raw.columns(self.window_start())
+        return count2 if self.max2 > self.max3 else count3
+
+
+LIVE_MODIFIERS = {
+    "LactateVSPCalibration": LiveVSPModifier,
+    "LactateStoneCalibration": LiveStoneModifier,
+}
+
+
+class LiveTail():
+    ''' follows one acquisition file while the instrument writes it. poll() reads the bytes appended since the last
+    poll, parses the complete lines (a half written last line waits for the next poll) with the analysis type's text
+    loader and feeds them to a LiveDataModifier. looks like a one run lot to the plotting (analysis_type / nested_data)
+    and like a run to the measurement (concentration / file_path / x_axis / y_axis)
+    '''
+    def __init__(self, file_path: str, analysis_type: str, axis_order_in_file: tuple[str, str] = ('current', 'time'),
+                 time_point: float = 10, interpolate: bool = False, dtype=numpy.float64, window: float = 0.0):
+        if analysis_type not in LIVE_MODIFIERS:
+            raise ValueError(f"Unknown run type: {analysis_type}")
+        self.file_path = file_path
+        self.analysis_type = analysis_type
+        self.concentration = ConcentrationParser().extract_concentration_from_filename(file_path)
+        self.text_loader, _ = RunFactory().return_components(analysis_type, axis_order_in_file, dtype)
+        self.data_modifier = LIVE_MODIFIERS[analysis_type](dtype)
+        self.measurement_engine = MeasurementEngine(time_point, interpolate, window)
+        self.position = 0 # bytes of the file read so far
+        self.partial_line = b"" # the end of the last read, after the last newline
+        self.header_lines = self.text_loader.parser.skiprows # header lines still to skip
+
+    @property
+    def nested_data(self) -> list:
+        ''' the run, for SubplotAnalysis '''
+        return [self]
+
+    @property
+    def x_axis(self) -> numpy.ndarray:
+        ''' time so far '''
+        return self.data_modifier.x_axis
+
+    @property
+    def y_axis(self) -> numpy.ndarray:
+        ''' current / counts so far '''
+        return self.data_modifier.y_axis
+
+    @property
+    def flags(self) -> list[str]:
+        ''' problems with the run so far (ie no stage 2 yet) '''
+        return list(self.data_modifier.flags)
+
+    def reset(self):
+        ''' starts over from the beginning of the file '''
+        self.data_modifier.reset()
+        self.position = 0
+        self.partial_line = b""
+        self.header_lines = self.text_loader.parser.skiprows
+
+    def poll(self) -> int:
+        ''' reads what was appended since the last poll, returns the number of new rows. a file that got shorter
+        was restarted (ie a new run with the same name), so it's read again from the start
+        '''
+        size = os.path.getsize(self.file_path)
+        if size < self.position:
+            self.reset()
+        if size == self.position:
+            return 0
+        with open(self.file_path, "rb") as f:
+            f.seek(self.position)
+            appended = f.read(size - self.position)
+        self.position += len(appended)
+        data = self.partial_line + appended
+        end = data.rfind(b"\n") + 1
+        self.partial_line = data[end:]
+        lines = data[:end]
+        while self.header_lines and lines:
+            lines = lines[lines.find(b"\n") + 1:]
+            self.header_lines -= 1
+        if not lines.strip():
+            return 0
+        loaded = self.text_loader.load_text(lines.decode("utf-8", errors="replace"))
+        self.data_modifier.add_rows(loaded)
+        return len(loaded[0])
+
+    def reading(self) -> float | None:
+        ''' the reading at the measurement time, None until the run gets there (past the end of the window, if readings are averaged) '''
+        x_axis = self.x_axis
+        if not len(x_axis) or x_axis[-1] < self.measurement_engine.time_point + self.measurement_engine.window / 2:
+            return None
+        return self.measurement_engine.measure(x_axis, self.y_axis)
@@ -0,0 +1,48 @@
+''' pulls the single reading used for linearity (ie the current at 10 s) out of every run, and groups them by concentration '''
+import numpy
+
+
+class MeasurementEngine():
+    ''' finds the reading at the measurement time with a binary search on each (monotonic) time array,
+    instead of scanning / copying the whole array. either takes the nearest sample, same as the old
+    argmin(abs(time - time_point)), or interpolates linearly to the exact time point. with a window (s) the reading
+    is the mean of every sample within window / 2 of the time point instead, which takes out most of the noise
+    of a single sample
+    '''
+    def __init__(self, time_point: float = 10, interpolate: bool = False, window: float = 0.0):
+        self.time_point = time_point
+        self.interpolate = interpolate
+        self.window = window
+
+    def measure(self, x_axis: numpy.ndarray, y_axis: numpy.ndarray) -> float:
+        ''' the reading of one run at the measurement time '''
+        if self.window > 0:
+            start = numpy.searchsorted(x_axis, x_axis.dtype.type(self.time_point - self.window / 2), side="left")
+            stop = numpy.searchsorted(x_axis, x_axis.dtype.type(self.time_point + self.window / 2), side="right")
+            if stop > start:
+                return float(y_axis[start:stop].mean(dtype=numpy.float64))
+            # no sample inside the window (sparse run), falls back to the single reading
+        if self.interpolate:
+            return float(numpy.interp(self.time_point, x_axis, y_axis))
+        # searched as the array's own dtype, a python float would make numpy upcast (copy) a float32 array first
+        index = numpy.searchsorted(x_axis, x_axis.dtype.type(self.time_point))
+        if index >= len(x_axis):
+            index = len(x_axis) - 1
+        elif index > 0 and self.time_point - x_axis[index - 1] <= x_axis[index] - self.time_point:
+            index -= 1 # the sample before is at least as close, argmin would have picked it first
+        index = numpy.searchsorted(x_axis, x_axis[index]) # first of any repeated time stamps, also like argmin
+        return float(y_axis[index])
+
+    def measure_runs(self, runs) -> numpy.ndarray:
+        ''' the reading of every run, in order '''
+        return numpy.fromiter((self.measure(run.x_axis, run.y_axis) for run in runs), dtype=numpy.float64, count=len(runs))
+
+    def group(self, concentrations: numpy.ndarray, values: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        ''' one grouped pass over all readings. returns the sorted unique concentrations and,
+        per concentration, the mean, standard deviation (ddof=1, 0 for a single replicate) and replicate count
+        '''
+        unique_concentrations, inverse, counts = numpy.unique(concentrations, return_inverse=True, return_counts=True)
+        means = numpy.bincount(inverse, weights=values) / counts
+        squared_deviations = numpy.bincount(inverse, weights=(values - means[inverse]) ** 2)
+        stds = numpy.sqrt(squared_deviations / numpy.maximum(counts - 1, 1))
+        return unique_concentrations, means, stds, counts
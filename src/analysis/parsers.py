@@ -0,0 +1,50 @@
+''' fast text parsing for the instrument exports, used by the TextLoaders '''
+import io
+import numpy
+
+
+class ColumnParser():
+    ''' parses whitespace separated numeric columns from a text file, keeping only the columns asked for.
+    tokenizing is done by numpy's C reader with usecols, so the columns we throw away are never converted
+    to floats at all. (numpy.fromstring / split + astype based parsers were both slower than this.)
+    the columns are views into the one array numpy parsed into (strided, not copied out again), writable so the
+    modifiers can work on them in place. dtype is one dtype for every column, or one per column (ie float64 time
+    next to float32 signals), which numpy parses straight into a record array, no float64 pass in between
+    '''
+
+    def __init__(self, usecols: tuple[int, ...], skiprows: int = 0, dtype=numpy.float64):
+        self.usecols = usecols
+        self.skiprows = skiprows
+        if isinstance(dtype, (tuple, list)):
+            self.dtypes = tuple(numpy.dtype(column_dtype) for column_dtype in dtype)
+        else:
+            self.dtypes = (numpy.dtype(dtype),) * len(usecols)
+
+    def max_rows(self, n_bytes: int) -> int:
+        ''' upper bound on the rows n_bytes of text can hold, ie to size a buffer before parsing. a row needs at least
+        a character and a separator for every column up to the last one used (the last line may have no newline),
+        headers / blank lines / longer numbers only make the bound bigger
+        '''
+        return (n_bytes + 1) // (2 * (max(self.usecols) + 1))
+
+    def parse(self, file_path: str) -> tuple[numpy.ndarray, ...]:
+        ''' parse a file, returns one array per selected column (in usecols order) '''
+        return self.parse_source(file_path, self.skiprows, file_path)
+
+    def parse_text(self, text: str) -> tuple[numpy.ndarray, ...]:
+        ''' parse rows that were already read (ie the lines appended to a file since the last read), no header skipped '''
+        return self.parse_source(io.StringIO(text), 0, "appended rows")
+
+    def parse_source(self, source, skiprows: int, name: str) -> tuple[numpy.ndarray, ...]:
+        ''' parse a file path / file like object, name is only for the error '''
+        try:
+            if len(set(self.dtypes)) == 1:
+                parsed = numpy.loadtxt(source, dtype=self.dtypes[0], skiprows=skiprows, usecols=self.usecols, ndmin=2)
+            else:
+                record_dtype = numpy.dtype([(f"column{i}", column_dtype) for i, column_dtype in enumerate(self.dtypes)])
+                parsed = numpy.loadtxt(source, dtype=record_dtype, skiprows=skiprows, usecols=self.usecols, ndmin=1)
+        except ValueError as e:
+            raise ValueError(f"Could not parse {name}: {e}") from e
+        if parsed.dtype.names is not None:
+            return tuple(parsed[name] for name in parsed.dtype.names)
+        return tuple(parsed.T)
@@ -0,0 +1,38 @@
+''' the analysis as explicit stages, each one memoized on its own inputs, so a changed setting only redoes what's downstream of it '''
+from collections.abc import Callable
+
+from src.analysis.instrumentation import Instrumentation
+
+
+class StageMemo():
+    ''' last output of each analysis stage, kept with the inputs it was made from. the stages are
+
+        scan -> parse -> modify -> measure -> fit -> qa -> render
+
+    scan / parse / modify are the loading: the LotCache keeps a lot's Data keyed on its files (the scan) and load
+    settings, and the RunCache keeps the parsed runs, so those are skipped whenever the lot hasn't changed. measure
+    onwards go through run(): a stage whose inputs are the same as last time hands back its last output, so ie
+    changing a QA threshold redoes the QA, and changing the measurement time redoes measure / fit / qa, neither
+    touches the samples. inputs are tuples compared with ==, so they have to be small (settings, counts, the group
+    means), not sample arrays. one memo lives with each Data, so every AnalysisCore on the same lot shares it
+    '''
+    STAGES = ("scan", "parse", "modify", "measure", "fit", "qa", "render")
+
+    def __init__(self):
+        self.entries = {} # stage -> (inputs, output)
+
+    def run(self, stage: str, inputs: tuple, compute: Callable, instrumentation: Instrumentation | None = None):
+        ''' the stage's output for these inputs, computed only if they changed since the last time '''
+        entry = self.entries.get(stage)
+        if entry is not None and entry[0] == inputs:
+            if instrumentation is not None:
+                instrumentation.count(f"{stage}_reused")
+            return entry[1]
+        output = compute()
+        self.entries[stage] = (inputs, output)
+        return output
+
+    def invalidate(self, stage: str):
+        ''' forgets a stage and everything downstream of it '''
+        for later_stage in self.STAGES[self.STAGES.index(stage):]:
+            self.entries.pop(later_stage, None)
@@ -0,0 +1,143 @@
+''' local sqlite database of every analysis result, for lot history and trend queries (slope drift, failure rates) '''
+import json
+import os
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lots (
+    id INTEGER PRIMARY KEY,
+    lot TEXT NOT NULL,
+    analysis_type TEXT NOT NULL,
+    analyzed_at REAL NOT NULL,
+    provisional INTEGER NOT NULL,
+    runs INTEGER NOT NULL,
+    concentrations INTEGER NOT NULL,
+    slope REAL,
+    y_intercept REAL,
+    r_squared REAL,
+    slope_rpd REAL,
+    y_intercept_rpd REAL,
+    slope_passed INTEGER NOT NULL,
+    y_intercept_passed INTEGER NOT NULL,
+    r_squared_passed INTEGER NOT NULL,
+    passed INTEGER NOT NULL,
+    flagged_runs INTEGER NOT NULL,
+    timings TEXT,
+    confidence TEXT
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    lot_id INTEGER NOT NULL REFERENCES lots(id) ON DELETE CASCADE,
+    concentration REAL NOT NULL,
+    mean REAL NOT NULL,
+    std REAL NOT NULL,
+    replicates INTEGER NOT NULL,
+    PRIMARY KEY (lot_id, concentration)
+) WITHOUT ROWID;
+-- trend queries scan one analysis type over a time range, the extra columns make the index covering
+CREATE INDEX IF NOT EXISTS lots_by_type_time ON lots (analysis_type, provisional, analyzed_at, passed, slope);
+CREATE INDEX IF NOT EXISTS lots_by_lot_time ON lots (lot, analyzed_at);
+CREATE INDEX IF NOT EXISTS lots_by_time ON lots (analyzed_at);
+"""
+WEEK = 7 * 24 * 3600
+WEEK_OFFSET = 4 * 24 * 3600 # the unix epoch was a thursday, this makes the weeks start on monday
+
+
+class ResultsDatabase():
+    ''' one row per analysis in lots, plus the per concentration means in measurements. a connection is opened per
+    call, so the database can be written from the analysis worker thread / batch processes and read from the GUI.
+    WAL mode lets the history view read while a batch is writing
+    '''
+    def __init__(self, path: str = os.path.join("results", "history.sqlite3")):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self.connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            connection.execute("PRAGMA optimize") # keeps the planner's statistics fresh, so it picks the covering indexes
+        finally:
+            connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        ''' a new connection. used as a context manager it commits (or rolls back) but doesn't close, so callers close it '''
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    def record(self, result: dict, measurements: list[tuple[float, float, float, int]], timings: dict | None = None,
+               confidence: dict | None = None) -> int:
+        ''' saves one analysis. result has the lot / line / RPD / QA fields (see AnalysisCore.record_results), measurements
+        is (concentration, mean, std, replicates) for every concentration. returns the new row id
+        '''
+        row = dict(result)
+        row.setdefault("analyzed_at", time.time())
+        row["timings"] = json.dumps(timings) if timings is not None else None
+        row["confidence"] = json.dumps(confidence) if confidence is not None else None
+        columns = ", ".join(row)
+        placeholders = ", ".join(f":{column}" for column in row)
+        connection = self.connect()
+        try:
+            with connection:
+                lot_id = connection.execute(f"INSERT INTO lots ({columns}) VALUES ({placeholders})", row).lastrowid
+                connection.executemany(
+                    "INSERT INTO measurements (lot_id, concentration, mean, std, replicates) VALUES (?, ?, ?, ?, ?)",
+                    [(lot_id, *measurement) for measurement in measurements]
+                )
+        finally:
+            connection.close()
+        return lot_id
+
+    def query(self, sql: str, parameters=()) -> list[dict]:
+        ''' runs a read query, returns the rows as dicts '''
+        connection = self.connect()
+        try:
+            return [dict(row) for row in connection.execute(sql, parameters)]
+        finally:
+            connection.close()
+
+    def recent(self, limit: int = 200, analysis_type: str | None = None, lot: str | None = None, include_provisional: bool = False) -> list[dict]:
+        ''' the latest results, newest first '''
+        conditions, parameters = [], []
+        if analysis_type is not None:
+            conditions.append("analysis_type = ?")
+            parameters.append(analysis_type)
+        if lot is not None:
+            conditions.append("lot = ?")
+            parameters.append(lot)
+        if not include_provisional:
+            conditions.append("provisional = 0")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.query(
+            f"SELECT id, lot, analysis_type, analyzed_at, runs, concentrations, slope, y_intercept, r_squared, slope_rpd, "
+            f"y_intercept_rpd, slope_passed, y_intercept_passed, r_squared_passed, passed, flagged_runs "
+            f"FROM lots {where} ORDER BY analyzed_at DESC LIMIT ?", (*parameters, limit)
+        )
+
+    def measurements(self, lot_id: int) -> list[dict]:
+        ''' the per concentration means of one result '''
+        return self.query("SELECT concentration, mean, std, replicates FROM measurements WHERE lot_id = ? ORDER BY concentration", (lot_id,))
+
+    def weekly_trend(self, analysis_type: str, since: float = 0.0) -> list[dict]:
+        ''' per week (starting monday, utc): lots, mean / min / max slope and failure rate, oldest first '''
+        return self.query(
+            "SELECT CAST((analyzed_at - ?) / ? AS INTEGER) * ? + ? AS week_start, COUNT(*) AS lots, "
+            "AVG(slope) AS mean_slope, MIN(slope) AS min_slope, MAX(slope) AS max_slope, 1.0 - AVG(passed) AS failure_rate "
+            "FROM lots WHERE analysis_type = ? AND provisional = 0 AND analyzed_at >= ? GROUP BY week_start ORDER BY week_start",
+            (WEEK_OFFSET, WEEK, WEEK, WEEK_OFFSET, analysis_type, since)
+        )
+
+    def failure_rates(self, since: float = 0.0) -> list[dict]:
+        ''' per analysis type: lots and the fraction that failed QA '''
+        return self.query(
+            "SELECT analysis_type, COUNT(*) AS lots, 1.0 - AVG(passed) AS failure_rate "
+            "FROM lots WHERE provisional = 0 AND analyzed_at >= ? GROUP BY analysis_type ORDER BY analysis_type",
+            (since,)
+        )
+
+    def analysis_types(self) -> list[str]:
+        ''' every analysis type with results '''
+        return [row["analysis_type"] for row in self.query("SELECT DISTINCT analysis_type FROM lots ORDER BY analysis_type")]
@@ -3,6 +3,8 @@
 import os
 from abc import ABC, abstractmethod
 import numpy
+from src.analysis.parsers import ColumnParser
+from src.analysis.segmentation import StageSegments, window_flags
 
 
 class ConcentrationParser():
@@ -23,14 +25,25 @@ class DataModifier(ABC):
     abstract class for modifying the data,
     such as scaling the current, adjusting the time, etc.
     '''
+    flags = () # problems found in the last run modified (ie a missing stage). modifiers that check for any reset it in every modify_data
 
     @abstractmethod
     def modify_data(self, loaded_data_tuple):
         ''' change the data here. can call things like "scale", etc.'''
 
     def scale_current(self, current_array):
-        ''' scales the current from mA to nA'''
-        return current_array * 1E6
+        ''' scales the current from mA to nA, in place '''
+        current_array = self.writable(current_array)
+        current_array *= 1E6
+        return current_array
+
+    def writable(self, array: numpy.ndarray) -> numpy.ndarray:
+        ''' the array itself if it can be changed in place, otherwise a copy. the loaders hand over arrays nothing
+        else holds on to, except the archive loader, whose columns are read only views of a memory map
+        '''
+        if array.flags.writeable:
+            return array
+        return array.copy()
 
 class TextLoader(ABC):
     ''' base class for loading data from a text file '''
@@ -38,16 +51,30 @@ class TextLoader(ABC):
     def load_data(self, file_path: str) -> tuple[numpy.ndarray, numpy.ndarray]:
         ''' load a single text file into a numpy array ''' 
 
+    @abstractmethod
+    def load_text(self, text: str) -> tuple[numpy.ndarray, ...]:
+        ''' same columns as load_data, from rows of the file that were already read (no header), ie for live tailing '''
+
 class LactateVSPCalibrationTextLoader(TextLoader):
-    ''' loads the text file data into numpy arrays '''
-    def __init__(self, axis_order_in_file: tuple[str, str]):
+    ''' loads the text file data into numpy arrays. the current is parsed as dtype, time always as float64
+    (absolute time stamps don't fit in a float32, the modifier makes them relative first)
+    '''
+    def __init__(self, axis_order_in_file: tuple[str, str], dtype=numpy.float64):
         self.axis_order_in_file = axis_order_in_file #dependency injection of the axes order from the UI
+        column_dtypes = (numpy.float64, dtype) if axis_order_in_file == ('time', 'current') else (dtype, numpy.float64)
+        self.parser = ColumnParser(usecols=(0, 1), skiprows=1, dtype=column_dtypes)
 
     def load_data(self, file_path: str) -> tuple[numpy.ndarray, numpy.ndarray]:
         ''' load a single text file into a numpy array based on the axis order specified '''
         # Load the data from the file
-        loaded_data = numpy.loadtxt(file_path, skiprows=1, unpack=True)
-        
+        return self.order_columns(self.parser.parse(file_path))
+
+    def load_text(self, text: str) -> tuple[numpy.ndarray, numpy.ndarray]:
+        ''' rows appended to a file, ordered like load_data '''
+        return self.order_columns(self.parser.parse_text(text))
+
+    def order_columns(self, loaded_data: tuple[numpy.ndarray, numpy.ndarray]) -> tuple[numpy.ndarray, numpy.ndarray]:
+        ''' time, current from the columns in file order '''
         # Dynamically unpack the loaded data based on the axis_order_in_file
         if self.axis_order_in_file == ('time', 'current'):
             time_array, current_array = loaded_data
@@ -72,66 +99,85 @@ class LactateVSPCalibrationDataModifier(DataModifier):
         return super().scale_current(current_array)
     
     def __adjust_time(self, time_array):
-        '''adjusts time array so that the first time is set as 0'''
-        first_time = time_array[0]
-        return time_array - first_time
+        '''adjusts time array so that the first time is set as 0, in place'''
+        time_array = self.writable(time_array)
+        if len(time_array):
+            time_array -= time_array[0]
+        return time_array
     
 
 
 class LactateStoneCalibrationTextLoader(TextLoader):
     ''' concrete implementation of TextLoader for the calibration stone setup,
-    which will take / plot graphs of count vs. concentration
+    which will take / plot graphs of count vs. concentration. counts / stage are parsed as dtype, time (ms since
+    the instrument started) always as float64
     '''
 
+    def __init__(self, dtype=numpy.float64):
+        #we only want the following: time, count2, stage2, count3 (although thats if we dont use peak detection, whcih we may want to)
+        column_dtypes = (numpy.float64, dtype, dtype, dtype)
+        self.parser = ColumnParser(usecols=(0, 3, 4, 5), skiprows=4, dtype=column_dtypes) #this may change, given that we should be able to select from the menu
+
     def load_data(self, file_path: str):
         ''' load a single text file into a numpy array '''
-
-        #from this unpack, we only want the following: time, count2, count3, stage2 (although thats if we dont use peak detection, whcih we may want to)
         #remember that time now is in ms, need to convert / adjust
-        time_array, _, _, count2_array, stage2_array, count3_array, _, _, _, _   = numpy.loadtxt(file_path, skiprows=4, unpack=True) #this line may change, given that we should be able to select from the menu
-        
+        time_array, count2_array, stage2_array, count3_array = self.parser.parse(file_path)
         return time_array, count2_array, stage2_array, count3_array
 
+    def load_text(self, text: str):
+        ''' rows appended to a file, same columns as load_data '''
+        return self.parser.parse_text(text)
+
 
 
 class LactateStoneCalibrationDataModifier(DataModifier):
-    ''' concrtete implementation of data modifier for the lactate stone, which has to find the 3rd stage from the count vs time data '''
+    ''' concrtete implementation of data modifier for the lactate stone, which has to find the 3rd stage from the count vs time data.
+    the window is a slice (a view) and the time transforms run in place on it, so no full length temporaries
+    '''
+    MEASUREMENT_STAGE = 2
 
     def modify_data(self, loaded_data_tuple):
         time_array, count2_array, stage2_array, count3_array = loaded_data_tuple
-        count_array = self.__select_highest_channel(count2_array, count3_array)
-        adjusted_time_array, adjusted_count_array = self.__adjust_analysis_window(time_array, count_array, stage2_array)
+        self.flags = []
+        start = self.__find_analysis_window(stage2_array)
+        adjusted_time_array = time_array[start:]
+        adjusted_count_array = self.__select_highest_channel(count2_array[start:], count3_array[start:])
         readjusted_time_array = self.__adjust_time(adjusted_time_array)
         scaled_time_array = self.__scale_time(readjusted_time_array)
         return scaled_time_array, adjusted_count_array
 
     def __scale_time(self, time_array: numpy.ndarray) -> numpy.ndarray:
-        ''' scales time from ms to s '''
-        return time_array / 1000
+        ''' scales time from ms to s, in place '''
+        time_array /= 1000
+        return time_array
     
     def __select_highest_channel(self, count2_array: numpy.ndarray, count3_array: numpy.ndarray):
-        ''' this finds the max of each, so that u can see which graph is higher. thats the one we choose to continue'''
+        ''' this finds the max of each (inside the analysis window, so stage 1 spikes don't count), so that u can see which graph is higher. thats the one we choose to continue'''
+        if len(count2_array) == 0:
+            return count2_array
         max2 = count2_array.max()
         max3 = count3_array.max()
         if max2 > max3:
             return count2_array
         return count3_array
-        
-    def __adjust_analysis_window(self, time_array: numpy.ndarray, count_array: numpy.ndarray, stage2_array: numpy.ndarray):
-        ''' adjust the window by finding where the actual curve starts (stage 3) '''
-        measurement_stage_index = 0
-        for i, stage in enumerate(stage2_array):
-            if stage == 2:
-                measurement_stage_index = i
-                break
-        adjusted_time_array = time_array[measurement_stage_index:]
-        adjusted_count_array = count_array[measurement_stage_index:]
-        return adjusted_time_array, adjusted_count_array
+
+    def __find_analysis_window(self, stage2_array: numpy.ndarray) -> int:
+        ''' finds where the actual curve starts (the first sample of stage 2), the window runs from there to the end.
+        every stage transition is found in one pass. flags runs where stage 2 never shows up (the whole run is used,
+        like before) or shows up more than once (the first one is used)
+        '''
+        measurement_windows = StageSegments(stage2_array).windows(self.MEASUREMENT_STAGE)
+        self.flags.extend(window_flags(self.MEASUREMENT_STAGE, len(measurement_windows)))
+        if not measurement_windows:
+            return 0
+        return measurement_windows[0][0]
 
     def __adjust_time(self, time_array: numpy.ndarray) -> numpy.ndarray:
-        '''adjusts time array so that the first time is set as 0'''
-        first_time = time_array[0]
-        return time_array - first_time
+        '''adjusts time array so that the first time is set as 0, in place (on a copy if it's read only)'''
+        time_array = self.writable(time_array)
+        if len(time_array):
+            time_array -= time_array[0]
+        return time_array
 
 
 class Run():
@@ -164,14 +210,15 @@ class RunFactory():
         run = Run(file_path, text_loader, data_modifier)
         return run
 
-    def return_run(self, analysis_type: str, file_path: str, axis_order_in_file: tuple[str, str] = ('current', 'time')):
-        ''' creates all experiment classes for a given analysis type '''
+    def return_components(self, analysis_type: str, axis_order_in_file: tuple[str, str] = ('current', 'time'), dtype=numpy.float64) -> tuple[TextLoader, DataModifier]:
+        ''' creates the loader / modifier pair for a given analysis type. dtype is what the signal columns are parsed as '''
         if analysis_type == "LactateVSPCalibration":
-            text_loader = LactateVSPCalibrationTextLoader(axis_order_in_file)
-            data_modifier = LactateVSPCalibrationDataModifier()
-            return self.create_run(file_path, text_loader, data_modifier)
+            return LactateVSPCalibrationTextLoader(axis_order_in_file, dtype), LactateVSPCalibrationDataModifier()
         if analysis_type == "LactateStoneCalibration":
-            text_loader = LactateStoneCalibrationTextLoader()
-            data_modifier = LactateStoneCalibrationDataModifier()
-            return self.create_run(file_path, text_loader, data_modifier)
-        raise ValueError(f"Unknown run type: {analysis_type}")
\ No newline at end of file
+            return LactateStoneCalibrationTextLoader(dtype), LactateStoneCalibrationDataModifier()
+        raise ValueError(f"Unknown run type: {analysis_type}")
+
+    def return_run(self, analysis_type: str, file_path: str, axis_order_in_file: tuple[str, str] = ('current', 'time')):
+        ''' creates all experiment classes for a given analysis type '''
+        text_loader, data_modifier = self.return_components(analysis_type, axis_order_in_file)
+        return self.create_run(file_path, text_loader, data_modifier)
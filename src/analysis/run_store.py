@@ -0,0 +1,162 @@
+''' columnar storage for all the runs of a lot '''
+import numpy
+
+
+class RunView():
+    ''' thin stand in for a Run, backed by a RunStore. has the same concentration / file_path / x_axis / y_axis
+    that the analyses use, but the arrays are slices of the store instead of arrays of its own
+    '''
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index: int):
+        self.store = store
+        self.index = index # storage index in the store, not the sorted position
+
+    @property
+    def concentration(self) -> str:
+        ''' concentration as it was written in the file name, ie "4.15" '''
+        return self.store.concentration_labels[self.index]
+
+    @property
+    def file_path(self) -> str:
+        ''' the file the run came from '''
+        return self.store.file_paths[self.index]
+
+    @property
+    def x_axis(self) -> numpy.ndarray:
+        ''' time '''
+        return self.store.x_values[self.store.offset_buffer[self.index]:self.store.offset_buffer[self.index + 1]]
+
+    @property
+    def y_axis(self) -> numpy.ndarray:
+        ''' current / counts '''
+        return self.store.y_values[self.store.offset_buffer[self.index]:self.store.offset_buffer[self.index + 1]]
+
+
+class RunStore():
+    ''' every run's samples concatenated into one x and one y array, with an offsets index
+    (run i is offsets[i]:offsets[i + 1]), a float concentration array and a file path table.
+    runs are kept in the order they were added, and order holds the storage indexes sorted by concentration.
+    the sample arrays and the per run index arrays (offsets / concentrations / order) grow by doubling, so adding runs
+    one at a time (loading a lot, watch mode) stays linear
+    '''
+    def __init__(self, dtype=numpy.float64):
+        self.dtype = numpy.dtype(dtype)
+        self.x_values = numpy.empty(0, dtype=self.dtype)
+        self.y_values = numpy.empty(0, dtype=self.dtype)
+        self.sample_count = 0 # samples in use, the arrays can be bigger
+        # the index arrays with room to grow, offsets / concentrations / order are the parts in use
+        self.offset_buffer = numpy.zeros(1, dtype=numpy.int64)
+        self.concentration_buffer = numpy.empty(0, dtype=numpy.float64)
+        self.order_buffer = numpy.empty(0, dtype=numpy.int64)
+        self.concentration_labels = []
+        self.file_paths = []
+
+    def __len__(self) -> int:
+        return len(self.file_paths)
+
+    @property
+    def offsets(self) -> numpy.ndarray:
+        ''' run i is offsets[i]:offsets[i + 1] of the sample arrays '''
+        return self.offset_buffer[:len(self) + 1]
+
+    @property
+    def concentrations(self) -> numpy.ndarray:
+        ''' concentration of every run, in storage order '''
+        return self.concentration_buffer[:len(self)]
+
+    @property
+    def order(self) -> numpy.ndarray:
+        ''' storage indexes sorted by concentration '''
+        return self.order_buffer[:len(self)]
+
+    @order.setter
+    def order(self, order: numpy.ndarray):
+        self.order_buffer[:len(self)] = order
+
+    def reserve(self, sample_count: int):
+        ''' makes room for at least sample_count samples in total '''
+        if sample_count <= len(self.x_values):
+            return
+        capacity = max(sample_count, 2 * len(self.x_values))
+        for name in ("x_values", "y_values"):
+            grown = numpy.empty(capacity, dtype=self.dtype)
+            grown[:self.sample_count] = getattr(self, name)[:self.sample_count]
+            setattr(self, name, grown)
+
+    def reserve_runs(self, run_count: int):
+        ''' makes room in the index arrays for at least run_count runs in total '''
+        if run_count <= len(self.concentration_buffer):
+            return
+        capacity = max(run_count, 2 * len(self.concentration_buffer))
+        for name, size in (("offset_buffer", capacity + 1), ("concentration_buffer", capacity), ("order_buffer", capacity)):
+            current = getattr(self, name)
+            grown = numpy.empty(size, dtype=current.dtype)
+            grown[:len(current)] = current
+            setattr(self, name, grown)
+
+    def copy(self) -> "RunStore":
+        ''' a copy of the runs (without the spare capacity) that can be added to on its own '''
+        store = RunStore(self.dtype)
+        store.x_values = self.x_values[:self.sample_count].copy()
+        store.y_values = self.y_values[:self.sample_count].copy()
+        store.sample_count = self.sample_count
+        store.offset_buffer = self.offsets.copy()
+        store.concentration_buffer = self.concentrations.copy()
+        store.order_buffer = self.order.copy()
+        store.concentration_labels = list(self.concentration_labels)
+        store.file_paths = list(self.file_paths)
+        return store
+
+    def shrink_to_fit(self):
+        ''' drops the spare capacity left over from growing, ie once a lot is fully loaded '''
+        if len(self.x_values) > self.sample_count:
+            self.x_values = self.x_values[:self.sample_count].copy()
+            self.y_values = self.y_values[:self.sample_count].copy()
+
+    def append(self, file_path: str, concentration_label: str, x_axis: numpy.ndarray, y_axis: numpy.ndarray) -> int:
+        ''' adds one run at the end of the sorted order, returns its storage index '''
+        return self.append_many([file_path], [concentration_label], x_axis, y_axis, [len(x_axis)])
+
+    def append_many(self, file_paths: list[str], concentration_labels: list[str], x_values: numpy.ndarray, y_values: numpy.ndarray, lengths) -> int:
+        ''' adds many runs whose samples are already concatenated (ie from the parallel loader), returns the first storage index '''
+        first_index = len(self)
+        last_index = first_index + len(file_paths)
+        total = int(numpy.sum(lengths))
+        self.reserve(self.sample_count + total)
+        self.reserve_runs(last_index)
+        self.x_values[self.sample_count:self.sample_count + total] = x_values[:total]
+        self.y_values[self.sample_count:self.sample_count + total] = y_values[:total]
+        self.offset_buffer[first_index + 1:last_index + 1] = self.sample_count + numpy.cumsum(lengths, dtype=numpy.int64)
+        self.sample_count += total
+        self.concentration_buffer[first_index:last_index] = [float(label) for label in concentration_labels]
+        self.order_buffer[first_index:last_index] = numpy.arange(first_index, last_index)
+        self.concentration_labels.extend(concentration_labels)
+        self.file_paths.extend(file_paths)
+        return first_index
+
+    def sort_by_concentration(self):
+        ''' sorts the order by concentration, lowest to highest. stable, so equal concentrations keep their load order '''
+        self.order = numpy.argsort(self.concentrations, kind="stable")
+
+    def insert_sorted(self, index: int):
+        ''' moves a run (ie one that was just appended) to its sorted position, after any equal concentrations '''
+        order = self.order[self.order != index]
+        position = numpy.searchsorted(self.concentrations[order], self.concentrations[index], side="right")
+        self.order = numpy.insert(order, position, index)
+
+    def views(self) -> list[RunView]:
+        ''' Run-like views of every run, in sorted order '''
+        return [RunView(self, int(index)) for index in self.order]
+
+    def lengths(self) -> numpy.ndarray:
+        ''' samples per run, in storage order '''
+        return numpy.diff(self.offsets)
+
+    def run_ids(self) -> numpy.ndarray:
+        ''' storage index of every sample, for grouped / segmented numpy operations across runs '''
+        return numpy.repeat(numpy.arange(len(self)), self.lengths())
+
+    def nbytes(self) -> int:
+        ''' memory held by the sample arrays '''
+        return self.x_values.nbytes + self.y_values.nbytes
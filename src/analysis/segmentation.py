@@ -0,0 +1,73 @@
+''' splits a stage column (ie the stone's stage2 column) into the windows where each stage runs '''
+import numpy
+
+
+class StageSegments():
+    ''' every run of consecutive samples with the same stage value, found in one vectorized pass
+    (compare each sample with the one before it). segment i is stages[i] over samples starts[i]:stops[i]
+    '''
+    def __init__(self, stage_array: numpy.ndarray):
+        stage_array = numpy.asarray(stage_array)
+        transitions = numpy.flatnonzero(stage_array[1:] != stage_array[:-1]) + 1
+        if len(stage_array) == 0:
+            self.starts = numpy.empty(0, dtype=numpy.int64)
+            self.stops = numpy.empty(0, dtype=numpy.int64)
+        else:
+            self.starts = numpy.concatenate(([0], transitions)).astype(numpy.int64)
+            self.stops = numpy.concatenate((transitions, [len(stage_array)])).astype(numpy.int64)
+        self.stages = stage_array[self.starts]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def windows(self, stage: float) -> list[tuple[int, int]]:
+        ''' (start, stop) sample indexes of every window of one stage, in order. more than one means the stage repeats '''
+        matches = numpy.flatnonzero(self.stages == stage)
+        return [(int(self.starts[i]), int(self.stops[i])) for i in matches]
+
+    def all_windows(self) -> dict[float, list[tuple[int, int]]]:
+        ''' windows of every stage that shows up, keyed by stage value '''
+        return {float(stage): self.windows(stage) for stage in numpy.unique(self.stages)}
+
+
+def window_flags(stage: float, window_count: int) -> list[str]:
+    ''' the flags of a run whose stage started window_count times, when the first window (or the whole run) is used '''
+    if window_count == 0:
+        return [f"no stage {stage}, used the whole run"]
+    if window_count > 1:
+        return [f"stage {stage} starts {window_count} times, used the first"]
+    return []
+
+
+class StageWindowTracker():
+    ''' the windows of one stage of a stage column that comes a chunk at a time (live tailing, streaming): where the
+    first one starts and how many there are, the same as StageSegments.windows over every chunk fed so far.
+    a window carrying on from the end of the last chunk isn't counted again
+    '''
+    def __init__(self, stage: float):
+        self.stage = stage
+        self.rows = 0 # rows fed so far
+        self.window_start = None # row of the first sample of the first window, None until the stage shows up
+        self.window_count = 0
+        self.last_stage = None
+
+    def add(self, stage_array: numpy.ndarray) -> int | None:
+        ''' feeds the next chunk. returns the row of this chunk the first window starts at, if it's the chunk where
+        the stage first showed up (ie to move the run's window there), otherwise None
+        '''
+        windows = StageSegments(stage_array).windows(self.stage)
+        if windows and windows[0][0] == 0 and self.last_stage == self.stage:
+            windows = windows[1:] # carries on the window from the last chunk
+        self.window_count += len(windows)
+        if len(stage_array):
+            self.last_stage = stage_array[-1]
+        started = None
+        if self.window_start is None and windows:
+            started = windows[0][0]
+            self.window_start = self.rows + started
+        self.rows += len(stage_array)
+        return started
+
+    def flags(self) -> list[str]:
+        ''' the flags the whole run modifier would give the rows so far '''
+        return window_flags(self.stage, self.window_count)
@@ -0,0 +1,255 @@
+''' bounded memory reading of very long acquisition files: the file is parsed a fixed size block at a time and only
+what the analysis needs is kept, the samples around the measurement time at full resolution and a decimated trace for
+the plot. the peak memory depends on the block size / point budget / measurement window, not on how long the file is
+'''
+import os
+from abc import abstractmethod
+import numpy
+
+from src.analysis.run import DataModifier, RunFactory, LactateStoneCalibrationDataModifier
+from src.analysis.segmentation import StageWindowTracker
+from src.analysis.decimation import BucketDecimator
+from src.analysis.live import GrowableColumns
+
+
+class StreamedChannel():
+    ''' what's kept of one channel of a streamed run: every sample from keep_from to keep_to (s) as it was, the
+    nearest sample either side of that (so the nearest / interpolated reading is the same as on the whole run even
+    if the run has a gap there), and a BucketDecimator of the whole trace for the plot
+    '''
+    def __init__(self, keep_from: float, keep_to: float, max_points: int, dtype):
+        self.keep_from = keep_from
+        self.keep_to = keep_to
+        self.kept = GrowableColumns((numpy.float64, dtype), capacity=1024)
+        self.before = None # (time, value) of the last sample before keep_from
+        self.after = None # (time, value) of the first sample after keep_to
+        self.decimator = BucketDecimator(max_points)
+        self.maximum = -numpy.inf
+
+    def add(self, time_array: numpy.ndarray, value_array: numpy.ndarray):
+        ''' takes what it needs out of a block of modified samples '''
+        if not len(time_array):
+            return
+        inside = (time_array >= self.keep_from) & (time_array <= self.keep_to)
+        self.kept.append(time_array[inside], value_array[inside])
+        earlier = numpy.flatnonzero(time_array < self.keep_from)
+        if len(earlier):
+            self.before = (time_array[earlier[-1]], value_array[earlier[-1]])
+        if self.after is None:
+            later = numpy.flatnonzero(time_array > self.keep_to)
+            if len(later):
+                self.after = (time_array[later[0]], value_array[later[0]])
+        self.decimator.add(time_array, value_array)
+        self.maximum = max(self.maximum, value_array.max())
+
+    def samples(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        ''' the decimated trace with the kept samples in place of its points around the measurement time '''
+        kept_time, kept_values = self.kept.columns()
+        decimated_time, decimated_values = self.decimator.points()
+        # the neighbours are real samples, the decimator may have them too
+        first = self.keep_from if self.before is None else self.before[0]
+        last = self.keep_to if self.after is None else self.after[0]
+        outside = (decimated_time < first) | (decimated_time > last)
+        neighbours = [sample for sample in (self.before, self.after) if sample is not None]
+        time_array = numpy.concatenate((decimated_time[outside], [time for time, _ in neighbours], kept_time))
+        value_array = numpy.concatenate((decimated_values[outside], [value for _, value in neighbours], kept_values))
+        order = numpy.argsort(time_array, kind="stable")
+        return time_array[order], value_array[order].astype(kept_values.dtype)
+
+    def nbytes(self) -> int:
+        ''' memory held for this channel '''
+        return sum(array.nbytes for array in self.kept.arrays) + self.decimator.nbytes()
+
+
+class StreamedRun(DataModifier):
+    ''' the modifier of an analysis type, fed a run a block of rows at a time (like LiveDataModifier) but only keeping
+    a StreamedChannel of it. modify_data feeds a whole run at once, to a new StreamedRun
+    '''
+    def __init__(self, keep_from: float, keep_to: float, max_points: int, dtype=numpy.float64):
+        self.keep_from = keep_from
+        self.keep_to = keep_to
+        self.max_points = max_points
+        self.dtype = numpy.dtype(dtype)
+        self.flags = []
+        self.rows = 0 # rows read so far
+
+    def new_channel(self) -> StreamedChannel:
+        ''' an empty channel with this run's settings '''
+        return StreamedChannel(self.keep_from, self.keep_to, self.max_points, self.dtype)
+
+    @abstractmethod
+    def add_rows(self, loaded_data_tuple):
+        ''' modifies a block of loaded rows and keeps what's needed of it '''
+
+    @abstractmethod
+    def samples(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        ''' modified time / current (or counts) kept of the rows fed so far '''
+
+    @abstractmethod
+    def nbytes(self) -> int:
+        ''' memory held for the run '''
+
+    def modify_data(self, loaded_data_tuple):
+        self.add_rows(loaded_data_tuple)
+        return self.samples()
+
+
+class StreamedVSPRun(StreamedRun):
+    ''' streamed LactateVSPCalibrationDataModifier: time relative to the first row, current in nA '''
+    def __init__(self, keep_from: float, keep_to: float, max_points: int, dtype=numpy.float64):
+        super().__init__(keep_from, keep_to, max_points, dtype)
+        self.time_origin = None
+        self.channel = self.new_channel()
+
+    def add_rows(self, loaded_data_tuple):
+        time_array, current_array = loaded_data_tuple
+        if not len(time_array):
+            return
+        self.rows += len(time_array)
+        if self.time_origin is None:
+            self.time_origin = time_array[0]
+        time_array = self.writable(time_array)
+        time_array -= self.time_origin
+        self.channel.add(time_array, self.scale_current(current_array))
+
+    def samples(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        return self.channel.samples()
+
+    def nbytes(self) -> int:
+        return self.channel.nbytes()
+
+
+class StreamedStoneRun(StreamedRun):
+    ''' streamed LactateStoneCalibrationDataModifier. both channels are kept until the end, since the one used is
+    whichever is higher inside the window. until stage 2 shows up the whole run is kept from its first row (what the
+    normal modifier falls back to), once it does that's dropped and the window starts from its first sample. the same
+    flags as the normal modifier
+    '''
+    MEASUREMENT_STAGE = LactateStoneCalibrationDataModifier.MEASUREMENT_STAGE
+
+    def __init__(self, keep_from: float, keep_to: float, max_points: int, dtype=numpy.float64):
+        super().__init__(keep_from, keep_to, max_points, dtype)
+        self.time_origin = None # ms, the first row until stage 2 shows up, then the first stage 2 sample
+        self.windows = StageWindowTracker(self.MEASUREMENT_STAGE)
+        self.channels = (self.new_channel(), self.new_channel()) # count2, count3
+        self.flags = self.windows.flags()
+
+    def add_rows(self, loaded_data_tuple):
+        time_array, count2_array, stage2_array, count3_array = loaded_data_tuple
+        if not len(time_array):
+            return
+        self.rows += len(time_array)
+        if self.time_origin is None:
+            self.time_origin = time_array[0]
+        start = self.windows.add(stage2_array)
+        if start is not None:
+            # the whole run fallback isn't needed any more, the window starts here
+            self.time_origin = time_array[start]
+            self.channels = (self.new_channel(), self.new_channel())
+        else:
+            start = 0
+        new_time = time_array[start:] - self.time_origin
+        new_time /= 1000
+        self.channels[0].add(new_time, count2_array[start:])
+        self.channels[1].add(new_time, count3_array[start:])
+        self.flags = self.windows.flags()
+
+    def samples(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        count2, count3 = self.channels
+        return (count2 if count2.maximum > count3.maximum else count3).samples()
+
+    def nbytes(self) -> int:
+        return sum(channel.nbytes() for channel in self.channels)
+
+
+STREAMED_RUNS = {
+    "LactateVSPCalibration": StreamedVSPRun,
+    "LactateStoneCalibration": StreamedStoneRun,
+}
+
+
+class StreamingReader():
+    ''' reads files of min_bytes or more (0 turns it off) a BLOCK_BYTES block at a time, with the analysis type's
+    text loader (complete lines only, a line cut by the block end goes with the next one) and a StreamedRun.
+    what's kept of a run is
+
+        - every sample within KEEP_SECONDS plus half the measurement window of the time point, so the nearest /
+          interpolated / window averaged reading is exactly the one the whole run would give (the margin past the
+          window keeps it that way once the times are rounded to float32)
+        - a min / max decimated trace of about max_points, for the plot
+
+    the peak memory while reading a file is at most (see peak_bytes)
+
+        6 x BLOCK_BYTES                                the block as bytes, as text and in loadtxt's text buffer
+        + 2 x block rows x parsed columns x 8 bytes    the parsed block and the modified one
+        + channels x (40 x max_points / 2              the decimator buckets
+                      + 2 x kept rows x 16 bytes)      the samples around the time point, with room to grow
+
+    block rows being at most ColumnParser.max_rows(BLOCK_BYTES), and kept rows the keep span / the sample period. none
+    of that grows with the file, with the defaults it comes to under 40 MB for any length of file. the sweep and the
+    trace filters only see the decimated trace of a streamed run away from the time point
+    '''
+    BLOCK_BYTES = 2 * 1024 * 1024
+    KEEP_SECONDS = 1.0
+
+    def __init__(self, analysis_type: str, axis_order_in_file: tuple[str, str] = ('current', 'time'), time_point: float = 10,
+                 window: float = 0.0, min_bytes: int = 256 * 1024 * 1024, max_points: int = 4000, dtype=numpy.float64):
+        if analysis_type not in STREAMED_RUNS:
+            raise ValueError(f"Unknown run type: {analysis_type}")
+        self.analysis_type = analysis_type
+        self.time_point = time_point
+        self.window = window
+        self.min_bytes = min_bytes
+        self.max_points = max_points
+        self.dtype = numpy.dtype(dtype)
+        self.text_loader, _ = RunFactory().return_components(analysis_type, axis_order_in_file, self.dtype)
+        keep = self.KEEP_SECONDS + window / 2
+        self.keep_from = time_point - keep
+        self.keep_to = time_point + keep
+
+    def key(self) -> tuple:
+        ''' what a streamed run depends on besides the file, ie for the lot cache '''
+        return (self.min_bytes, self.time_point, self.window, self.max_points)
+
+    def should_stream(self, file_path: str) -> bool:
+        ''' whether a file is big enough to be streamed '''
+        return self.min_bytes > 0 and os.path.getsize(file_path) >= self.min_bytes
+
+    def blocks(self, file_path: str):
+        ''' the loaded columns of the file, a block of complete lines at a time, header skipped '''
+        header_lines = self.text_loader.parser.skiprows
+        partial_line = b""
+        with open(file_path, "rb") as f:
+            while True:
+                block = f.read(self.BLOCK_BYTES)
+                data = partial_line + block
+                end = len(data) if not block else data.rfind(b"\n") + 1 # the last line doesn't need a newline
+                partial_line = data[end:]
+                lines = data[:end]
+                del data
+                while header_lines and lines:
+                    lines = lines[lines.find(b"\n") + 1:] if b"\n" in lines else b""
+                    header_lines -= 1
+                if lines.strip():
+                    yield self.text_loader.load_text(lines.decode("utf-8", errors="replace"))
+                if not block:
+                    return
+
+    def read(self, file_path: str) -> tuple[numpy.ndarray, numpy.ndarray, list[str], int]:
+        ''' streams one file, returns the kept time / current (or counts), the modifier flags and the rows read '''
+        run = STREAMED_RUNS[self.analysis_type](self.keep_from, self.keep_to, self.max_points, self.dtype)
+        for loaded_data_tuple in self.blocks(file_path):
+            run.add_rows(loaded_data_tuple)
+        x_axis, y_axis = run.samples()
+        return x_axis, y_axis, list(run.flags), run.rows
+
+    def peak_bytes(self, sample_period: float) -> int:
+        ''' the bound on the memory streaming a file takes (see the class docstring), for a run sampled every
+        sample_period s. the block rows are the parser's bound, from lines shorter than any real file's
+        '''
+        parser = self.text_loader.parser
+        block_rows = parser.max_rows(self.BLOCK_BYTES)
+        channels = 2 if self.analysis_type == "LactateStoneCalibration" else 1
+        kept_rows = int((self.keep_to - self.keep_from) / sample_period) + 3
+        decimator_bytes = BucketDecimator(self.max_points).nbytes()
+        return 6 * self.BLOCK_BYTES + 2 * block_rows * len(parser.usecols) * 8 + channels * (decimator_bytes + 2 * kept_rows * 16)
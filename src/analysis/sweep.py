@@ -0,0 +1,136 @@
+''' time resolved linearity: the calibration line fitted at every time of a grid at once, to find the best read time '''
+import numpy
+
+
+class SweepRun():
+    ''' the concentration / x_axis / y_axis of one run when a sweep was asked for. the arrays are the run's own (a
+    store that grows reallocates rather than changing them), so a sweep on another thread keeps working on the runs
+    it was given while more are added to the lot
+    '''
+    __slots__ = ("concentration", "x_axis", "y_axis")
+
+    def __init__(self, concentration: str, x_axis: numpy.ndarray, y_axis: numpy.ndarray):
+        self.concentration = concentration
+        self.x_axis = x_axis
+        self.y_axis = y_axis
+
+
+class LinearitySweep():
+    ''' puts every run on a common time grid (the time range all runs cover), averages the replicates of each
+    concentration and fits the line at every grid time at once. the grouping is one (runs, concentrations) matrix
+    product and the fit is the closed form least squares over the columns, so the cost is a few array passes over a
+    (runs, grid points) matrix, no per time point fit. readings are taken the same way MeasurementEngine does (nearest
+    sample, interpolated, or the window average, from a running sum), and the measurement time itself is always on the grid, so the sweep at that time is the
+    same line LinearityAnalysis fits
+    '''
+    R_SQUARED_TOLERANCE = 0.001 # times within this of the best R^2 all count as "as linear", the most sensitive one wins
+
+    def __init__(self, runs, points: int = 1000, interpolate: bool = False, time_point: float | None = None, window: float = 0.0):
+        if len(runs) < 2:
+            raise ValueError("Need at least 2 runs for a linearity sweep")
+        self.interpolate = interpolate
+        self.window = window
+        self.times = self.time_grid(runs, points, time_point)
+        readings = self.resample(runs, self.times)
+        self.concentrations, means = self.group_means(numpy.array([float(run.concentration) for run in runs]), readings)
+        if len(self.concentrations) < 2:
+            raise ValueError("Need at least 2 concentrations for a linearity sweep")
+        # current / counts per mg/dL, like LinearityAnalysis.fit
+        self.sensitivities, self.intercepts, r_values = self.fit_all(means)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            # the measured line (concentration vs current), like LinearityAnalysis.make_measured_line
+            self.slopes = 1 / self.sensitivities
+            self.y_intercepts = -self.intercepts / self.sensitivities
+        self.r_squared = r_values ** 2
+
+    @staticmethod
+    def time_grid(runs, points: int, time_point: float | None = None) -> numpy.ndarray:
+        ''' points evenly spaced times over the range every run covers, plus time_point if it's inside it '''
+        start = max(float(run.x_axis[0]) for run in runs)
+        stop = min(float(run.x_axis[-1]) for run in runs)
+        if stop <= start:
+            raise ValueError("The runs don't cover a common time range")
+        grid = numpy.linspace(start, stop, max(points, 2))
+        if time_point is not None and start <= time_point <= stop:
+            grid = numpy.union1d(grid, [time_point])
+        return grid
+
+    def resample(self, runs, times: numpy.ndarray) -> numpy.ndarray:
+        ''' (runs, times) readings of every run at every grid time '''
+        readings = numpy.empty((len(runs), len(times)))
+        for row, run in enumerate(runs):
+            x_axis, y_axis = run.x_axis, run.y_axis
+            if self.interpolate:
+                readings[row] = numpy.interp(times, x_axis, y_axis)
+            else:
+                readings[row] = self.nearest(x_axis, y_axis, times)
+            if self.window > 0:
+                self.window_means(x_axis, y_axis, times, readings[row])
+        return readings
+
+    @staticmethod
+    def nearest(x_axis: numpy.ndarray, y_axis: numpy.ndarray, times: numpy.ndarray) -> numpy.ndarray:
+        ''' the nearest sample of one run at every time '''
+        # ties and repeated time stamps go to the first one (same as MeasurementEngine.measure)
+        grid = times.astype(x_axis.dtype) # searched as the array's own dtype, so a float32 run isn't copied up
+        indexes = numpy.minimum(numpy.searchsorted(x_axis, grid), len(x_axis) - 1)
+        before = numpy.maximum(indexes - 1, 0)
+        earlier = (indexes > 0) & (times - x_axis[before] <= x_axis[indexes] - times)
+        indexes = numpy.where(earlier, before, indexes)
+        repeated = (indexes > 0) & (x_axis[indexes - 1] == x_axis[indexes])
+        if repeated.any(): # rare, so the second search is only done for those
+            indexes[repeated] = numpy.searchsorted(x_axis, x_axis[indexes[repeated]])
+        return y_axis[indexes]
+
+    def window_means(self, x_axis: numpy.ndarray, y_axis: numpy.ndarray, times: numpy.ndarray, readings: numpy.ndarray):
+        ''' replaces readings with the mean of the samples within window / 2 of each time, where there are any '''
+        starts = numpy.searchsorted(x_axis, (times - self.window / 2).astype(x_axis.dtype), side="left")
+        stops = numpy.searchsorted(x_axis, (times + self.window / 2).astype(x_axis.dtype), side="right")
+        running_sum = numpy.concatenate(([0.0], numpy.cumsum(y_axis, dtype=numpy.float64)))
+        counts = stops - starts
+        inside = counts > 0
+        readings[inside] = (running_sum[stops[inside]] - running_sum[starts[inside]]) / counts[inside]
+
+    @staticmethod
+    def group_means(concentrations: numpy.ndarray, readings: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        ''' sorted unique concentrations and the (concentrations, times) replicate means '''
+        unique_concentrations, group_of_run, counts = numpy.unique(concentrations, return_inverse=True, return_counts=True)
+        averaging = numpy.zeros((len(unique_concentrations), len(concentrations)))
+        averaging[group_of_run, numpy.arange(len(concentrations))] = 1 / counts[group_of_run]
+        return unique_concentrations, averaging @ readings
+
+    def fit_all(self, means: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        ''' least squares of every column of means against the concentrations, returns slopes, intercepts, r values '''
+        x_deviations = self.concentrations - self.concentrations.mean()
+        mean_of_means = means.mean(axis=0)
+        y_deviations = means - mean_of_means
+        sxx = x_deviations @ x_deviations
+        sxy = x_deviations @ y_deviations
+        syy = numpy.einsum("ij,ij->j", y_deviations, y_deviations)
+        slopes = sxy / sxx
+        intercepts = mean_of_means - slopes * self.concentrations.mean()
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            r_values = numpy.clip(sxy / numpy.sqrt(sxx * syy), -1.0, 1.0)
+        return slopes, intercepts, r_values
+
+    def nearest_index(self, time: float) -> int:
+        ''' grid index closest to a time '''
+        return int(numpy.argmin(numpy.abs(self.times - time)))
+
+    def best_index(self) -> int:
+        ''' grid index of the suggested read time: the most sensitive time (steepest current vs concentration)
+        out of the ones whose R^2 is within R_SQUARED_TOLERANCE of the best
+        '''
+        r_squared = numpy.nan_to_num(self.r_squared, nan=-1.0)
+        candidates = numpy.flatnonzero(r_squared >= r_squared.max() - self.R_SQUARED_TOLERANCE)
+        return int(candidates[numpy.argmax(numpy.abs(self.sensitivities[candidates]))])
+
+    def point(self, index: int) -> dict[str, float]:
+        ''' the line at one grid time '''
+        return {
+            "time": float(self.times[index]),
+            "slope": float(self.slopes[index]),
+            "y_intercept": float(self.y_intercepts[index]),
+            "r_squared": float(self.r_squared[index]),
+            "sensitivity": float(self.sensitivities[index])
+        }
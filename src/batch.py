@@ -0,0 +1,185 @@
+''' headless batch QA, checks many lot folders in parallel without the GUI (no Qt objects are made).
+prints one result line per lot as soon as it's done, as json lines (default) or csv.
+
+run from the repo root (preferences are read from config/preferences.json like the app):
+    python -m src.batch LactateVSPCalibration lots/lot_001 lots/lot_002 ...
+    python -m src.batch LactateStoneCalibration lots/* --format csv --output results.csv
+    python -m src.batch LactateVSPCalibration lots/* --master-slope 0.07 --master-intercept -85 --render plots
+    python -m src.batch LactateVSPCalibration lots/* --bootstrap 5000 --confidence 95
+
+exit code is 0 if every lot passed, 1 if any failed QA and 2 if any couldn't be analyzed
+'''
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import freeze_support
+
+from src.analysis.analysis import AnalysisCore, Line
+
+ANALYSIS_TYPES = ("LactateVSPCalibration", "LactateStoneCalibration")
+INTERVAL_NAMES = ("slope", "y_intercept", "r_squared", "slope_rpd", "y_intercept_rpd")
+BOOTSTRAP_FIELDS = (
+    ("bootstrap_resamples",)
+    + tuple(f"{name}_{bound}" for name in INTERVAL_NAMES for bound in ("low", "high"))
+    + ("slope_pass_rate", "y_intercept_pass_rate", "r_squared_pass_rate")
+) # left empty when the bootstrap is off
+RESULT_FIELDS = (
+    "lot", "analysis_type", "status", "passed", "runs", "concentrations",
+    "slope", "y_intercept", "r_squared", "slope_rpd", "y_intercept_rpd",
+    "slope_passed", "y_intercept_passed", "r_squared_passed", *BOOTSTRAP_FIELDS, "flagged_runs", "flags", "seconds", "error"
+)
+
+
+def check_lot(directory: str, analysis_type: str, axis_order_in_file: tuple[str, str],
+              master_values: tuple[float | None, float | None, float | None], render_directory: str | None = None,
+              bootstrap_settings: tuple[int | None, float | None] = (None, None), record: bool = True) -> dict:
+    ''' loads and QA checks one lot, runs in a pool worker. each lot is loaded serially and uncached,
+    the pool already keeps every core busy. master_values (slope, intercept, r squared) and bootstrap_settings
+    (resamples, confidence) override the preferences where not None. record saves the result to the results
+    database like the app does (if it's on in the preferences)
+    '''
+    started = time.perf_counter()
+    core = AnalysisCore(directory, analysis_type, axis_order_in_file, load_workers=1, use_cache=False, record_results=record)
+    master_line = Line()
+    master_line.get_values_from_preferences()
+    slope, y_intercept, r_squared = (
+        master if master is not None else default
+        for master, default in zip(master_values, (master_line.slope, master_line.y_intercept, master_line.r_squared))
+    )
+    master_line.set_values(slope, y_intercept, r_squared)
+    measured_line, qa_checks, rpds = core.check(master_line)
+    confidence = core.bootstrap(master_line, *bootstrap_settings)
+    core.record_results(measured_line, qa_checks, rpds)
+    if render_directory is not None:
+        render_lot(core, render_directory)
+    return {
+        "lot": directory,
+        "analysis_type": analysis_type,
+        "status": "ok",
+        "passed": all(qa_checks.values()),
+        "runs": len(core.data.nested_data),
+        "concentrations": len(core.la.concentrations),
+        "slope": measured_line.slope,
+        "y_intercept": measured_line.y_intercept,
+        "r_squared": measured_line.r_squared,
+        "slope_rpd": rpds["slope"],
+        "y_intercept_rpd": rpds["y_intercept"],
+        "slope_passed": qa_checks["slope"],
+        "y_intercept_passed": qa_checks["y_intercept"],
+        "r_squared_passed": qa_checks["r_squared"],
+        **bootstrap_result(confidence),
+        "flagged_runs": len(core.data.flags),
+        "flags": "; ".join(f"{os.path.basename(file_path)}: {', '.join(messages)}" for file_path, messages in sorted(core.data.flags.items())),
+        "seconds": time.perf_counter() - started,
+        "error": ""
+    }
+
+def bootstrap_result(confidence: dict | None) -> dict:
+    ''' the bootstrap fields of a result line, from AnalysisCore.bootstrap (empty if it didn't run) '''
+    if confidence is None:
+        return {field: "" for field in BOOTSTRAP_FIELDS}
+    result = {"bootstrap_resamples": confidence["resamples"]}
+    for name in INTERVAL_NAMES:
+        interval = confidence["intervals"][name]
+        result[f"{name}_low"], result[f"{name}_high"] = interval if interval is not None else ("", "")
+    for check, rate in confidence["pass_rates"].items():
+        result[f"{check}_pass_rate"] = rate
+    return result
+
+def render_lot(core: AnalysisCore, render_directory: str):
+    ''' saves the trace / linearity plots of a lot as <lot name>_traces.png and <lot name>_linearity.png. the result
+    was recorded by check_lot already (against the master line it was checked with), so this doesn't record it again
+    '''
+    os.makedirs(render_directory, exist_ok=True)
+    name = os.path.basename(os.path.normpath(core.data.directory))
+    fig1, _, fig2, _, _, _, _ = core.run(record=False)
+    fig1.savefig(os.path.join(render_directory, f"{name}_traces.png"))
+    fig2.savefig(os.path.join(render_directory, f"{name}_linearity.png"))
+
+def error_result(directory: str, analysis_type: str, error: Exception) -> dict:
+    ''' result line for a lot that couldn't be analyzed '''
+    result = {field: "" for field in RESULT_FIELDS}
+    result.update({"lot": directory, "analysis_type": analysis_type, "status": "error", "passed": False, "error": f"{type(error).__name__}: {error}"})
+    return result
+
+class ResultWriter():
+    ''' streams result lines to a file as json lines or csv, flushing after each so partial results survive a long run '''
+    def __init__(self, stream, output_format: str = "json"):
+        self.stream = stream
+        self.output_format = output_format
+        self.csv_writer = None
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(stream, fieldnames=RESULT_FIELDS)
+            self.csv_writer.writeheader()
+
+    def write(self, result: dict):
+        ''' writes one result line '''
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(result)
+        else:
+            self.stream.write(json.dumps(result) + "\n")
+        self.stream.flush()
+
+def run_batch(directories: list[str], analysis_type: str, axis_order_in_file: tuple[str, str], writer: ResultWriter,
+              workers: int | None = None, master_values=(None, None, None), render_directory: str | None = None,
+              bootstrap_settings=(None, None), record: bool = True) -> int:
+    ''' checks every lot across a process pool, writing each result as it finishes (so not in input order).
+    returns the exit code
+    '''
+    exit_code = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(check_lot, directory, analysis_type, axis_order_in_file, master_values, render_directory, bootstrap_settings, record): directory
+            for directory in directories
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e: # pylint: disable=broad-except # one bad lot shouldn't stop the rest
+                result = error_result(futures[future], analysis_type, e)
+            writer.write(result)
+            if result["status"] != "ok":
+                exit_code = 2
+            elif not result["passed"]:
+                exit_code = max(exit_code, 1)
+    return exit_code
+
+def parse_args(argv=None) -> argparse.Namespace:
+    ''' command line arguments '''
+    parser = argparse.ArgumentParser(description="QA check lot folders without the GUI")
+    parser.add_argument("analysis_type", choices=ANALYSIS_TYPES)
+    parser.add_argument("directories", nargs="+", help="lot folders, one per lot")
+    parser.add_argument("--axis-order", nargs=2, default=("current", "time"), metavar=("FIRST", "SECOND"),
+                        help="column order in the VSP files (default: current time)")
+    parser.add_argument("--format", choices=("json", "csv"), default="json", dest="output_format")
+    parser.add_argument("--output", help="file to write results to (default: stdout)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: every core)")
+    parser.add_argument("--master-slope", type=float, default=None, help="master line slope (default: from the preferences)")
+    parser.add_argument("--master-intercept", type=float, default=None, help="master line y intercept (default: from the preferences)")
+    parser.add_argument("--master-r-squared", type=float, default=None, help="minimum R^2 (default: from the preferences)")
+    parser.add_argument("--bootstrap", type=int, default=None, metavar="RESAMPLES",
+                        help="bootstrap confidence intervals with this many resamples, 0 for none (default: from the preferences)")
+    parser.add_argument("--confidence", type=float, default=None, help="confidence level in %% (default: from the preferences)")
+    parser.add_argument("--no-record", action="store_false", dest="record", help="don't save the results to the results database")
+    parser.add_argument("--render", metavar="DIRECTORY", default=None, help="also save the plots of each lot here (off by default)")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    ''' runs the batch from the command line '''
+    args = parse_args(argv)
+    master_values = (args.master_slope, args.master_intercept, args.master_r_squared)
+    bootstrap_settings = (args.bootstrap, args.confidence)
+    if args.output is None:
+        writer = ResultWriter(sys.stdout, args.output_format)
+        return run_batch(args.directories, args.analysis_type, tuple(args.axis_order), writer, args.workers, master_values, args.render, bootstrap_settings, args.record)
+    with open(args.output, "w", encoding="utf-8", newline="") as f:
+        writer = ResultWriter(f, args.output_format)
+        return run_batch(args.directories, args.analysis_type, tuple(args.axis_order), writer, args.workers, master_values, args.render, bootstrap_settings, args.record)
+
+if __name__ == "__main__":
+    freeze_support()
+    sys.exit(main())
@@ -1,16 +1,15 @@
 ''' layout handler for the app, handles all layout '''
-from PyQt6.QtCore import QSize
+import os
+from typing import TYPE_CHECKING
+from PyQt6.QtCore import QSize, QTimer
 from PyQt6.QtWidgets import (
+    QFileDialog,
     QMainWindow,
     QVBoxLayout,
     QWidget,
     QHBoxLayout,
 )
 
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
-
-from src.analysis.analysis import AnalysisCore, Line
 from src.menu.ui import (
     FileUploadButton,
     AxisSelectDropdown,
@@ -20,10 +19,32 @@ from src.menu.ui import (
     LCD, 
     SelectedFileText,
     StartAnalysisButton,
+    CancelAnalysisButton,
+    AnalysisProgressBar,
+    WatchFolderButton,
+    WatchStatusText,
+    ConfidenceText,
+    FullResolutionCheckBox,
+    TraceFilterDropdown,
+    TimingPanel,
+    HistoryPanel,
+    SweepPanel,
+    ComparisonPanel,
     Alert,
+    ErrorAlert,
+    RunFlagsAlert,
     SaveDialog
 )
-from src.menu.preferences_dialog import PreferencesDialog
+from src.menu.workers import AnalysisWorker, ExportWorker, SweepWorker, ComparisonWorker, WarmUpWorker, WatchWorker
+from src.menu.watcher import FolderWatcher, LiveTailWatcher
+from src.menu.preferences import Preferences
+from src.analysis.results_db import ResultsDatabase # sqlite only, cheap to import
+from src.startup import StartupTimer
+
+# matplotlib, scipy and the analysis modules are slow to import, so they're only imported once the
+# window is up (the graphs and the background warm up) or when they're first used
+if TYPE_CHECKING:
+    from src.analysis.analysis import Line, AnalysisResult
 
 # Subclass QMainWindow to customize your application's main window
 class MainWindow(QMainWindow):
@@ -36,15 +57,69 @@ class MainWindow(QMainWindow):
         self.analysis_type_label = AnalysisTypeLabel()
         self.analysis_type_dropdown = AnalysisTypeDropdown()
         self.start_analysis_button = StartAnalysisButton()
+        self.cancel_analysis_button = CancelAnalysisButton()
+        self.progress_bar = AnalysisProgressBar()
+        self.analysis_worker = None # the AnalysisWorker while one is running
+        self.watch_folder_button = WatchFolderButton()
+        self.watch_status_text = WatchStatusText()
+        self.full_resolution_checkbox = FullResolutionCheckBox()
+        self.trace_filter_dropdown = TraceFilterDropdown()
+        self.analysis_core = None # the last finished AnalysisCore, new files get added to it in watch mode
+        self.folder_watcher = None # the FolderWatcher while watching
+        self.watch_worker = None # the WatchWorker while new files of the watched folder are read
+        self.watched_files = [] # new files that showed up while the watch worker was busy, read once it's done
+        self.live_tail_watcher = None # the LiveTailWatcher while following a file that's being written
         self.selected_folder_text = SelectedFileText()
-        self.preferences_dialog = PreferencesDialog()
-        self.save_dialog = SaveDialog()
+        self.preferences_dialog = None # dialogs are made the first time they're opened
+        self.save_dialog = None
+        self.export_worker = None # the ExportWorker while an export is running
+        self.warm_up_worker = None
+        self.figure1 = None # figures / canvases are made right after the window shows, see add_graphs
+        self.canvas1 = None
+        self.figure2 = None
+        self.canvas2 = None
         self.slope_lcd = LCD()
         self.int_lcd = LCD()
         self.r_squared_lcd = LCD()
+        self.confidence_text = ConfidenceText()
+        self.timing_panel = TimingPanel()
+        self.history_panel = HistoryPanel()
+        self.history_panel.refresh_requested.connect(self.refresh_history)
+        self.results_database = None # opened the first time the history is shown, reused while its path stays the same
+        self.sweep_panel = SweepPanel()
+        self.sweep_panel.refresh_requested.connect(self.refresh_sweep)
+        self.sweep_worker = None # the SweepWorker while a sweep is running
+        self.sweep = None # the LinearitySweep on screen
+        self.sweep_figure = None # made the first time the sweep panel opens
+        self.comparison_panel = ComparisonPanel()
+        self.comparison_panel.compare_requested.connect(self.start_comparison)
+        self.comparison_worker = None # the ComparisonWorker while lots are loading
+        self.comparison_figure = None # made the first time lots are compared
         self.create_ui_layout() # this actually makes all the UI
         self.add_graph_layout()  # Call a new method to add the graph layout
         self.create_menu_bar() #creates the menu bar
+        QTimer.singleShot(0, self.finish_startup) # runs once the event loop is going, ie the window is on screen
+
+    def finish_startup(self):
+        ''' the slow parts of startup, after the window is already showing: the matplotlib graphs,
+        then importing the analysis modules in the background
+        '''
+        startup_timer = StartupTimer()
+        startup_timer.mark("window shown")
+        with startup_timer.span("graphs (matplotlib)"):
+            self.add_graphs()
+        startup_timer.mark("graphs shown")
+        self.warm_up_worker = WarmUpWorker()
+        self.warm_up_worker.finished.connect(self.on_warm_up_done)
+        self.warm_up_worker.start()
+
+    def on_warm_up_done(self):
+        ''' background imports are done, startup is over '''
+        startup_timer = StartupTimer()
+        startup_timer.mark("warm up done")
+        startup_timer.finish()
+        self.warm_up_worker.deleteLater()
+        self.warm_up_worker = None
 
     def create_ui_layout(self):
         ''' creates the ui layout '''
@@ -54,6 +129,10 @@ class MainWindow(QMainWindow):
         self.analysis_type_dropdown.activated.connect(self.update_layout_axis_selection)
         self.upload_button.clicked.connect(self.update_layout_file_selection)
         self.start_analysis_button.start_signal.connect(self.start_analysis)
+        self.cancel_analysis_button.clicked.connect(self.cancel_analysis)
+        self.watch_folder_button.toggled.connect(self.toggle_watch_folder)
+        self.full_resolution_checkbox.toggled.connect(self.toggle_full_resolution)
+        self.trace_filter_dropdown.filter_changed.connect(lambda: self.apply_preferences({"analysis_parameters"}))
         self.setWindowTitle("TRAQ Calibration Analyzer")
         self.setMinimumSize(QSize(1200, 800))
 
@@ -79,15 +158,22 @@ class MainWindow(QMainWindow):
         # top left div
         self.top_left_layout = QVBoxLayout()
         self.top_left_layout.addWidget(self.start_analysis_button)
+        self.top_left_layout.addWidget(self.cancel_analysis_button)
+        self.top_left_layout.addWidget(self.progress_bar)
+        self.top_left_layout.addWidget(self.watch_folder_button)
+        self.top_left_layout.addWidget(self.watch_status_text)
         self.top_left_layout.addLayout(self.upload_button_layout)
         self.top_left_layout.addLayout(self.analysis_type_layout)
         self.top_left_layout.addLayout(self.axis_layout)
+        self.top_left_layout.addWidget(self.full_resolution_checkbox)
+        self.top_left_layout.addWidget(self.trace_filter_dropdown)
 
         #top right div
         self.top_right_layout = QVBoxLayout()
         self.top_right_layout.addWidget(self.slope_lcd)
         self.top_right_layout.addWidget(self.int_lcd)
         self.top_right_layout.addWidget(self.r_squared_lcd)
+        self.top_right_layout.addWidget(self.confidence_text)
 
         # top div (contains left and right)
         self.top_layout = QHBoxLayout()
@@ -103,7 +189,11 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(widget)
 
     def start_analysis(self):
-        ''' starts the analysis '''
+        ''' starts the analysis on a background worker, results come back in on_analysis_finished '''
+        if self.analysis_worker is not None: # one at a time
+            return
+        self.stop_watching()
+        self.stop_live_tail()
         #set vars
         if self.upload_button.selected_folder is not None:
             directory = self.upload_button.selected_folder
@@ -112,13 +202,189 @@ class MainWindow(QMainWindow):
         analysis_type = self.analysis_type_dropdown.selected_analysis_type
         axis_order_in_file = self.axis_select_dropdown.axis_order
 
-        analysis_core = AnalysisCore(directory, analysis_type, axis_order_in_file)
-        fig1, ax1, fig2, ax2, measured_line, qa_checks = analysis_core.run()
-        self.update_graphs(fig1, fig2)
+        self.analysis_worker = AnalysisWorker(directory, analysis_type, axis_order_in_file, self.trace_points())
+        self.analysis_worker.progress.connect(self.progress_bar.update_progress)
+        self.analysis_worker.analysis_finished.connect(self.on_analysis_finished)
+        self.analysis_worker.analysis_failed.connect(self.on_analysis_failed)
+        self.analysis_worker.finished.connect(self.on_worker_done)
+        self.set_analysis_running(True)
+        self.analysis_worker.start()
+
+    def cancel_analysis(self):
+        ''' cancels the running analysis at the next run boundary '''
+        if self.analysis_worker is not None:
+            self.analysis_worker.cancel()
+            self.cancel_analysis_button.setDisabled(True)
+
+    def set_analysis_running(self, running: bool):
+        ''' flips the buttons / progress bar between running and idle '''
+        self.start_analysis_button.setDisabled(running)
+        self.cancel_analysis_button.setDisabled(not running)
+        if running:
+            self.progress_bar.update_progress(0, 0)
+
+    def on_analysis_finished(self, analysis_core, result):
+        ''' shows the results of a finished analysis, and starts watching the folder if watch mode is on '''
+        self.analysis_core = analysis_core
+        watching = self.watch_folder_button.isChecked()
+        if result is not None:
+            self.show_results(provisional=watching, result=result)
+        elif not watching: # watch mode can start on a folder with less than 2 concentrations
+            self.on_analysis_failed("Need at least 2 concentrations to fit a line")
+        if watching:
+            self.start_watching()
+
+    def trace_points(self) -> int | None:
+        ''' the trace plot's point budget, so the analysis worker can decimate for it. None before the graphs exist
+        or with full resolution on, then the GUI decimates (or doesn't) when it draws
+        '''
+        if self.figure1 is None or self.full_resolution_checkbox.isChecked():
+            return None
+        decimator = getattr(self.figure1, "trace_decimator", None)
+        if decimator is not None:
+            return decimator.max_points()
+        from src.analysis.decimation import TraceDecimator # pylint: disable=import-outside-toplevel
+        # the axes aren't made yet, this is the width they'll get (the canvas, the figure may not have its size yet)
+        subplot = self.figure1.subplotpars
+        return TraceDecimator.points_for_width(self.canvas1.width() * self.canvas1.device_pixel_ratio * (subplot.right - subplot.left))
+
+    def show_results(self, use_running_fit: bool = False, provisional: bool = False, result: "AnalysisResult | None" = None):
+        ''' draws a result of the current AnalysisCore into the existing figures and puts it on screen. the result
+        is worked out here (AnalysisCore.compute) if it isn't passed in, ie after a watched file is added.
+        provisional results (watch mode) go in the status line instead of alerts
+        '''
+        self.add_graphs() # no-op unless results beat the startup timer
+        try:
+            if result is None:
+                result = self.analysis_core.compute(use_running_fit)
+            self.analysis_core.draw(result, self.figure1, self.figure2)
+        except Exception as e: # pylint: disable=broad-except
+            self.on_analysis_failed(f"{type(e).__name__}: {e}")
+            return
+        measured_line, qa_checks = result.measured_line, result.qa_checks
+        self.update_graphs()
+        self.timing_panel.show_timings(self.analysis_core.timings()) # after update_graphs, so the redraw is in there
+        if not provisional:
+            self.refresh_history()
+            self.refresh_sweep()
         self.update_lcd_metrics(measured_line.slope, measured_line.y_intercept, measured_line.r_squared)
-        self.check_for_qa_issue(qa_checks, measured_line)
-
-    def check_for_qa_issue(self, qa_checks: dict[ str, bool], measured_line: Line):
+        flags = self.analysis_core.data.flags
+        # the bootstrap is from when the lot was loaded, new files in watch mode make it stale
+        self.confidence_text.show_confidence(None if provisional else self.analysis_core.confidence)
+        if not provisional:
+            self.check_for_qa_issue(qa_checks, measured_line)
+            if flags:
+                RunFlagsAlert(flags).exec()
+            return
+        failed = [check for check, passed in qa_checks.items() if not passed]
+        run_count = len(self.analysis_core.data.nested_data)
+        flagged = f", {len(flags)} flagged" if flags else ""
+        if failed:
+            self.watch_status_text.show_status(f"Provisional QA ({run_count} runs{flagged}): FAIL on {', '.join(failed)}")
+        else:
+            self.watch_status_text.show_status(f"Provisional QA ({run_count} runs{flagged}): PASS")
+
+    def toggle_watch_folder(self, checked: bool):
+        ''' turns watch folder mode on (runs the folder first, then watches it) or off '''
+        if not checked:
+            self.stop_watching()
+            self.watch_status_text.show_status("Stopped watching")
+            return
+        if self.upload_button.selected_folder is None:
+            self.watch_folder_button.setChecked(False)
+            return
+        self.start_analysis()
+
+    def start_watching(self):
+        ''' starts watching the folder of the current analysis for new files '''
+        if self.analysis_core.data.archive is not None:
+            self.watch_folder_button.setChecked(False)
+            self.watch_status_text.show_status("Lot archives can't be watched, only folders")
+            return
+        self.folder_watcher = FolderWatcher(self.analysis_core.data.directory, self.analysis_core.data.file_paths())
+        self.folder_watcher.files_ready.connect(self.add_watched_files)
+        self.watch_status_text.show_status(f"Watching {self.analysis_core.data.directory}")
+        self.folder_watcher.start()
+
+    def stop_watching(self):
+        ''' stops watching, if we were '''
+        if self.folder_watcher is not None:
+            self.folder_watcher.stop()
+            self.folder_watcher.deleteLater()
+            self.folder_watcher = None
+        self.watched_files = []
+
+    def add_watched_files(self, file_paths: list[str]):
+        ''' reads only the new files, in the background (one worker at a time, files that show up meanwhile wait for
+        the next one). what was read is added in on_watched_files_read
+        '''
+        self.watched_files.extend(file_paths)
+        if self.watch_worker is not None or not self.watched_files:
+            return
+        self.watch_worker = WatchWorker(self.analysis_core, self.watched_files)
+        self.watched_files = []
+        self.watch_worker.files_read.connect(self.on_watched_files_read)
+        self.watch_worker.finished.connect(self.on_watch_done)
+        self.watch_worker.start()
+
+    def on_watched_files_read(self, read: list, unreadable: list[str]):
+        ''' updates the data / regression incrementally with the new runs and refreshes everything '''
+        if self.watch_worker.analysis_core is not self.analysis_core or self.folder_watcher is None:
+            return # another analysis ran, or watching stopped, while they were read
+        self.analysis_core.instrumentation.merge(self.watch_worker.instrumentation)
+        skipped = [os.path.basename(file_path) for file_path in unreadable]
+        for file_path, read_run in read:
+            try:
+                self.analysis_core.add_file(file_path, read_run)
+            except Exception: # pylint: disable=broad-except
+                skipped.append(os.path.basename(file_path)) # bad name, leave the rest of the lot alone
+        if not self.analysis_core.can_fit():
+            self.watch_status_text.show_status("Waiting for at least 2 concentrations")
+        else:
+            self.show_results(use_running_fit=True, provisional=True)
+        if skipped:
+            self.watch_status_text.show_status(f"{self.watch_status_text.text()} (skipped unreadable: {', '.join(skipped)})")
+
+    def on_watch_done(self):
+        ''' cleans up once the watch worker has stopped, and reads the files that showed up meanwhile '''
+        self.watch_worker.deleteLater()
+        self.watch_worker = None
+        if self.folder_watcher is not None:
+            self.add_watched_files([])
+
+    def on_analysis_failed(self, message: str):
+        ''' shows why the analysis couldn't run '''
+        alert = ErrorAlert(message)
+        alert.exec()
+
+    def on_worker_done(self):
+        ''' cleans up once the worker thread has actually stopped (finished, failed or cancelled) '''
+        self.analysis_worker.deleteLater()
+        self.analysis_worker = None
+        self.set_analysis_running(False)
+
+    def closeEvent(self, event): # pylint: disable=invalid-name
+        ''' stops a running analysis before the window (and its worker thread) goes away '''
+        if self.analysis_worker is not None:
+            self.analysis_worker.cancel()
+            self.analysis_worker.wait()
+        if self.warm_up_worker is not None:
+            self.warm_up_worker.wait()
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+            self.export_worker.wait()
+        if self.sweep_worker is not None:
+            self.sweep_worker.wait()
+        if self.watch_worker is not None:
+            self.watch_worker.wait()
+        if self.comparison_worker is not None:
+            self.comparison_worker.cancel()
+            self.comparison_worker.wait()
+        self.stop_watching()
+        self.stop_live_tail()
+        super().closeEvent(event)
+
+    def check_for_qa_issue(self, qa_checks: dict[ str, bool], measured_line: "Line"):
         ''' checks if the qa_checks dict is truthy, if not then alerts with what didn't pass'''
         for check, passed in qa_checks.items():
             if not passed:
@@ -149,9 +415,24 @@ class MainWindow(QMainWindow):
             self.axis_select_dropdown.setDisabled(True)
 
     def add_graph_layout(self):
-        ''' Adds a layout for displaying graphs '''
+        ''' Adds a layout for displaying graphs, the graphs themselves are added by add_graphs '''
         self.graph_layout = QHBoxLayout()  # Create a new vertical layout for graphs
 
+        # Add the graph layout to the main layout
+        self.main_layout.addLayout(self.graph_layout)
+        self.main_layout.addWidget(self.timing_panel) # stage timings, under the graphs
+        self.main_layout.addWidget(self.history_panel) # saved results of past lots
+        self.main_layout.addWidget(self.sweep_panel) # linearity against the read time
+        self.main_layout.addWidget(self.comparison_panel) # several lots on one graph
+
+    def add_graphs(self):
+        ''' makes the two figures / canvases, once. imports matplotlib, which is slow, so it's left until after the window shows '''
+        if self.canvas1 is not None:
+            return
+        # pylint: disable=import-outside-toplevel
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
+
         # First graph
         self.figure1 = Figure()
         self.canvas1 = FigureCanvas(self.figure1)
@@ -162,26 +443,21 @@ class MainWindow(QMainWindow):
         self.canvas2 = FigureCanvas(self.figure2)
         self.graph_layout.addWidget(self.canvas2)
 
-        # Add the graph layout to the main layout
-        self.main_layout.addLayout(self.graph_layout)
-
-    def update_graphs(self, fig1, fig2):
-        ''' updates the graphs with the new figures '''
-        # Remove the old canvas widgets from the layout
-        self.graph_layout.removeWidget(self.canvas1)
-        self.canvas1.deleteLater()
-        self.graph_layout.removeWidget(self.canvas2)
-        self.canvas2.deleteLater()
-
-        # Update the figures
-        self.figure1 = fig1
-        self.figure2 = fig2
-
-        # Create new canvas widgets with the updated figures
-        self.canvas1 = FigureCanvas(self.figure1)
-        self.graph_layout.addWidget(self.canvas1)
-        self.canvas2 = FigureCanvas(self.figure2)
-        self.graph_layout.addWidget(self.canvas2)
+    def update_graphs(self):
+        ''' redraws both graphs after their figures were updated in place. the canvases (and figures)
+        live as long as the window, so reruns don't rebuild widgets or leak figures.
+        draws straight away (not draw_idle) so the redraw can be timed with the rest of the analysis
+        '''
+        self.toggle_full_resolution(self.full_resolution_checkbox.isChecked())
+        with self.analysis_core.instrumentation.span("redraw"):
+            self.canvas1.draw()
+            self.canvas2.draw()
+
+    def toggle_full_resolution(self, checked: bool):
+        ''' switches the trace plot between decimated and every raw sample '''
+        decimator = getattr(self.figure1, "trace_decimator", None)
+        if decimator is not None and decimator.full_resolution != checked:
+            decimator.set_full_resolution(checked)
 
     def create_menu_bar(self):
         ''' Creates the menu bar for the application '''
@@ -194,15 +470,278 @@ class MainWindow(QMainWindow):
         save_action = file_menu.addAction('Save')
         save_action.triggered.connect(self.save_file)  # Connect to a method to handle saving
 
+        # Add 'Open Lot Archive' action, analyzes a packed .traqlot file instead of a folder
+        open_archive_action = file_menu.addAction('Open Lot Archive...')
+        open_archive_action.triggered.connect(self.open_lot_archive)
+
+        # Add 'Live Tail File' action, follows a run's file while the instrument is still writing it
+        live_tail_action = file_menu.addAction('Live Tail File...')
+        live_tail_action.triggered.connect(self.open_live_tail)
+        stop_live_tail_action = file_menu.addAction('Stop Live Tail')
+        stop_live_tail_action.triggered.connect(self.stop_live_tail)
+
         # Add 'Preferences' action
         preferences_action = file_menu.addAction('Preferences')
         preferences_action.triggered.connect(self.open_preferences)  # Connect to a method to open preferences
 
-    def save_file(self):
-        ''' Handle file saving '''
-        self.save_dialog.exec()
+        # Add 'Clear Run Cache' action, forces the next analysis to reparse every file
+        clear_cache_action = file_menu.addAction('Clear Run Cache')
+        clear_cache_action.triggered.connect(self.clear_run_cache)
 
+    def save_file(self):
+        ''' exports the current lot (runs, measurements, line and QA) in the background, in the format of the chosen file type '''
+        if self.analysis_core is None or not self.analysis_core.can_fit():
+            self.watch_status_text.show_status("Nothing to export yet, run an analysis first")
+            return
+        if self.export_worker is not None:
+            self.watch_status_text.show_status("Already exporting, wait for it to finish")
+            return
+        if self.save_dialog is None:
+            self.save_dialog = SaveDialog()
+        if not self.save_dialog.exec():
+            return
+        from src.analysis.export import LotSnapshot # pylint: disable=import-outside-toplevel
+        path = self.save_dialog.selectedFiles()[0]
+        self.export_worker = ExportWorker(LotSnapshot(self.analysis_core), path) # snapshot here, the worker only reads it
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.export_finished.connect(self.on_export_finished)
+        self.export_worker.export_failed.connect(self.on_export_failed)
+        self.export_worker.finished.connect(self.on_export_done)
+        self.watch_status_text.show_status(f"Exporting to {path}")
+        self.export_worker.start()
+
+    def on_export_progress(self, done: int, total: int):
+        ''' shows how far the export is '''
+        self.watch_status_text.show_status(f"Exporting to {self.export_worker.path}: {done * 100 // max(total, 1)}%")
+
+    def on_export_finished(self, file_paths: list[str]):
+        ''' says where the export went '''
+        self.watch_status_text.show_status(f"Exported to {', '.join(file_paths)}")
+
+    def on_export_failed(self, message: str):
+        ''' shows why the export couldn't be written '''
+        self.watch_status_text.show_status("Export failed")
+        ErrorAlert(message, "Export Failed").exec()
+
+    def on_export_done(self):
+        ''' cleans up once the export thread has stopped '''
+        self.export_worker.deleteLater()
+        self.export_worker = None
+
+
+    def open_lot_archive(self):
+        ''' picks a lot archive to analyze, it takes the place of the data folder '''
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Lot Archive", "", "Lot archives (*.traqlot);;All files (*)")
+        if file_path:
+            self.upload_button.selected_folder = file_path
+            self.update_layout_file_selection()
+
+    def open_live_tail(self):
+        ''' picks a file that's being written and plots it as it grows, with the analysis type / axis order chosen above '''
+        file_path, _ = QFileDialog.getOpenFileName(self, "Live Tail File", "", "Data files (*.txt);;All files (*)")
+        if file_path:
+            self.start_live_tail(file_path)
+
+    def start_live_tail(self, file_path: str):
+        ''' starts following a file, any folder watching / previous tail stops '''
+        from src.analysis.live import LiveTail # pylint: disable=import-outside-toplevel
+        self.stop_watching()
+        self.watch_folder_button.setChecked(False)
+        self.stop_live_tail()
+        self.add_graphs()
+        prefs = Preferences()
+        time_point = float(prefs.get_preference("analysis_parameters", "measurement_time", "10"))
+        interpolate = prefs.get_preference("analysis_parameters", "interpolate_measurement", "0") == "1"
+        window = float(prefs.get_preference("analysis_parameters", "measurement_window", "0"))
+        precision = prefs.get_preference("performance_parameters", "precision", "float64")
+        max_fps = float(prefs.get_preference("live_parameters", "max_fps", "10"))
+        try:
+            live_tail = LiveTail(file_path, self.analysis_type_dropdown.selected_analysis_type, self.axis_select_dropdown.axis_order,
+                                 time_point, interpolate, precision, window)
+        except (IndexError, ValueError) as e: # ie a file name without a concentration
+            self.on_analysis_failed(f"{type(e).__name__}: {e}")
+            return
+        self.live_tail_watcher = LiveTailWatcher(live_tail, max_fps)
+        self.live_tail_watcher.updated.connect(self.show_live_tail)
+        self.live_tail_watcher.failed.connect(self.on_live_tail_failed)
+        self.watch_status_text.show_status(f"Live: waiting for data in {os.path.basename(file_path)}")
+        self.live_tail_watcher.start()
+
+    def show_live_tail(self):
+        ''' replots the growing run into the traces graph, called at most max_fps times a second '''
+        from src.analysis.analysis import SubplotAnalysis # pylint: disable=import-outside-toplevel
+        live_tail = self.live_tail_watcher.live_tail
+        SubplotAnalysis(live_tail, live_tail.measurement_engine.time_point).run_analysis(self.figure1)
+        self.toggle_full_resolution(self.full_resolution_checkbox.isChecked())
+        self.canvas1.draw_idle()
+        x_axis = live_tail.x_axis
+        reading = live_tail.reading()
+        status = f"Live: {os.path.basename(live_tail.file_path)}, {len(x_axis)} samples, {x_axis[-1]:.1f} s"
+        if reading is None:
+            status += f", waiting for {live_tail.measurement_engine.time_point:g} s"
+        else:
+            status += f", reading at {live_tail.measurement_engine.time_point:g} s: {reading:.6g}"
+        if live_tail.flags:
+            status += f" ({'; '.join(live_tail.flags)})"
+        self.watch_status_text.show_status(status)
+
+    def on_live_tail_failed(self, message: str):
+        ''' the file went away or has rows that don't parse '''
+        self.stop_live_tail()
+        self.watch_status_text.show_status(f"Live tail stopped, {message}")
+
+    def stop_live_tail(self):
+        ''' stops following the live file, if we were '''
+        if self.live_tail_watcher is not None:
+            self.live_tail_watcher.stop()
+            self.live_tail_watcher.deleteLater()
+            self.live_tail_watcher = None
+
+    def refresh_history(self):
+        ''' reloads the history panel from the results database, if it's open '''
+        if not self.history_panel.is_open():
+            return
+        database = self.get_results_database()
+        analysis_type = self.history_panel.selected_analysis_type()
+        self.history_panel.set_analysis_types(database.analysis_types())
+        trend = database.weekly_trend(analysis_type) if analysis_type is not None else []
+        self.history_panel.show_history(database.recent(analysis_type=analysis_type), trend, database.failure_rates())
+
+    def get_results_database(self) -> ResultsDatabase:
+        ''' the results database from the preferences. opening one sets up the schema and optimizes it, so that's only
+        done again if the path changed
+        '''
+        path = Preferences().get_preference("history_parameters", "database_path", "results/history.sqlite3")
+        if self.results_database is None or self.results_database.path != path:
+            self.results_database = ResultsDatabase(path)
+        return self.results_database
+
+    def refresh_sweep(self):
+        ''' reruns the linearity sweep for the current lot in the background, if the sweep panel is open '''
+        if not self.sweep_panel.is_open() or self.sweep_worker is not None:
+            return
+        if self.analysis_core is None or not self.analysis_core.can_fit():
+            self.sweep_panel.show_message("Run an analysis to sweep its read times")
+            return
+        self.sweep_panel.show_message("Sweeping read times...")
+        self.sweep_worker = SweepWorker(self.analysis_core)
+        self.sweep_worker.sweep_finished.connect(self.show_sweep)
+        self.sweep_worker.sweep_failed.connect(self.sweep_panel.show_message)
+        self.sweep_worker.finished.connect(self.on_sweep_done)
+        self.sweep_worker.start()
+
+    def show_sweep(self, sweep):
+        ''' plots a finished sweep into the sweep panel '''
+        from src.analysis.analysis import SweepAnalysis # pylint: disable=import-outside-toplevel
+        if self.sweep_figure is None:
+            # pylint: disable=import-outside-toplevel
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
+            self.sweep_figure = Figure()
+            canvas = FigureCanvas(self.sweep_figure)
+            canvas.mpl_connect("button_press_event", self.on_sweep_clicked)
+            self.sweep_panel.set_canvas(canvas)
+        self.sweep = sweep
+        time_point = self.analysis_core.la.measurement_engine.time_point
+        SweepAnalysis(sweep, time_point).run_analysis(self.sweep_figure)
+        self.sweep_figure.canvas.draw_idle()
+        on_grid = sweep.times[0] <= time_point <= sweep.times[-1]
+        self.sweep_panel.show_sweep(sweep.point(sweep.best_index()), sweep.point(sweep.nearest_index(time_point)) if on_grid else None)
+
+    def on_sweep_clicked(self, event):
+        ''' shows the line at the clicked read time '''
+        if self.sweep is None or event.xdata is None:
+            return
+        from src.analysis.analysis import SweepAnalysis # pylint: disable=import-outside-toplevel
+        point = self.sweep.point(self.sweep.nearest_index(event.xdata))
+        SweepAnalysis.mark_time(self.sweep_figure, point["time"])
+        self.sweep_figure.canvas.draw_idle()
+        self.sweep_panel.show_selected(point)
+
+    def on_sweep_done(self):
+        ''' cleans up once the sweep thread has stopped, and sweeps again if the lot changed while it ran '''
+        stale = self.sweep_worker.analysis_core is not self.analysis_core
+        if self.sweep_worker.seconds is not None:
+            self.sweep_worker.analysis_core.instrumentation.add_time("sweep", self.sweep_worker.seconds)
+        self.sweep_worker.deleteLater()
+        self.sweep_worker = None
+        if stale:
+            self.refresh_sweep()
+
+    def start_comparison(self):
+        ''' loads the lots in the comparison panel in the background (lots in the lot cache come back straight away) '''
+        if self.comparison_worker is not None:
+            return
+        directories = self.comparison_panel.directories()
+        if not directories:
+            self.comparison_panel.show_message("Add two or more lot folders to compare them")
+            return
+        self.comparison_panel.show_progress(0, len(directories))
+        self.comparison_worker = ComparisonWorker(directories, self.analysis_type_dropdown.selected_analysis_type,
+                                                  self.axis_select_dropdown.axis_order)
+        self.comparison_worker.progress.connect(self.comparison_panel.show_progress)
+        self.comparison_worker.comparison_finished.connect(self.show_comparison)
+        self.comparison_worker.comparison_failed.connect(self.comparison_panel.show_message)
+        self.comparison_worker.comparison_cancelled.connect(lambda: self.comparison_panel.show_message("Comparison cancelled"))
+        self.comparison_worker.finished.connect(self.on_comparison_done)
+        self.comparison_worker.start()
+
+    def show_comparison(self, comparison):
+        ''' overlays the loaded lots in the comparison panel and fills in its table '''
+        # pylint: disable=import-outside-toplevel
+        from src.analysis.analysis import ComparisonAnalysis
+        from src.analysis.comparison import LotCache
+        if self.comparison_figure is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
+            self.comparison_figure = Figure()
+            self.comparison_panel.set_canvas(FigureCanvas(self.comparison_figure))
+        lots = {os.path.basename(os.path.normpath(directory)) or directory: core for directory, core in comparison.cores.items()}
+        ComparisonAnalysis(lots, self.comparison_panel.traces_checkbox.isChecked(),
+                           self.full_resolution_checkbox.isChecked()).run_analysis(self.comparison_figure)
+        self.comparison_figure.canvas.draw_idle()
+        rows = []
+        for label, core in lots.items():
+            row = {"label": label, "runs": len(core.data.nested_data), "slope": None}
+            if core.can_fit():
+                measured_line, qa_checks, _ = core.check()
+                row.update(slope=measured_line.slope, y_intercept=measured_line.y_intercept,
+                           r_squared=measured_line.r_squared, passed=all(qa_checks.values()))
+            rows.append(row)
+        self.comparison_panel.show_results(rows, comparison.errors)
+        self.comparison_panel.show_cache(LotCache().stats())
+
+    def on_comparison_done(self):
+        ''' cleans up once the comparison thread has stopped '''
+        self.comparison_worker.deleteLater()
+        self.comparison_worker = None
+
+    def clear_run_cache(self):
+        ''' empties the on disk cache of parsed runs, and the lots kept in memory '''
+        # pylint: disable=import-outside-toplevel
+        from src.analysis.cache import RunCache
+        from src.analysis.comparison import LotCache
+        RunCache("cache").invalidate()
+        LotCache().clear()
 
     def open_preferences(self):
         ''' Open the preferences dialog '''
-        self.preferences_dialog.exec()
+        if self.preferences_dialog is None:
+            from src.menu.preferences_dialog import PreferencesDialog # pylint: disable=import-outside-toplevel
+            self.preferences_dialog = PreferencesDialog()
+        if self.preferences_dialog.exec():
+            self.apply_preferences(self.preferences_dialog.changed_categories)
+
+    def apply_preferences(self, changed_categories: set[str]):
+        ''' reruns the lot on screen with new measurement / QA settings. the lot isn't reloaded, only the stages after
+        what changed are redone (see AnalysisCore.apply_preferences), unless it has streamed runs that need reading again
+        '''
+        if not changed_categories & {"analysis_parameters", "qa_parameters", "calibration_parameters"}:
+            return
+        if self.analysis_core is None or self.analysis_worker is not None or self.live_tail_watcher is not None:
+            return
+        if not self.analysis_core.apply_preferences():
+            self.start_analysis() # streamed runs were only kept around the old measurement time
+            return
+        if self.analysis_core.can_fit():
+            self.show_results(provisional=self.folder_watcher is not None)
@@ -22,7 +22,7 @@ class Preferences:
 
     def get_preference(self, category: str, key: str, default={}) -> str:
         ''' gets a preference from the preferences dict, if it doesn't exist, returns the default '''
-        category_dict = self.preferences.get(category, default)
+        category_dict = self.preferences.get(category, {})
         value = category_dict.get(key, default)
         return value
     
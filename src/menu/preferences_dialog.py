@@ -15,6 +15,7 @@ class PreferencesDialog(QDialog):
         super().__init__()
         self.setWindowTitle("Preferences")
         self.changes = {}
+        self.changed_categories = set() # categories the last accept changed, so the main window knows what to redo
         self.setup_ui()
 
     def setup_ui(self):
@@ -73,6 +74,122 @@ class PreferencesDialog(QDialog):
         self.qa_group_layout.addWidget(self.y_intercept_rpd_input)
 
 
+        self.measurement_time_label = QLabel("Measurement time (s):")
+        self.interpolate_label = QLabel("Interpolate to the exact measurement time (1 = on, 0 = nearest sample):")
+        measurement_time = prefs.get_preference("analysis_parameters", "measurement_time", "10")
+        interpolate = prefs.get_preference("analysis_parameters", "interpolate_measurement", "0")
+        self.measurement_time_input = PreferenceLineEdit(measurement_time, "analysis_parameters", "measurement_time")
+        self.interpolate_input = PreferenceLineEdit(interpolate, "analysis_parameters", "interpolate_measurement")
+        self.measurement_window_label = QLabel("Average the readings over a window around the measurement time (s, 0 = single reading):")
+        measurement_window = prefs.get_preference("analysis_parameters", "measurement_window", "0")
+        self.measurement_window_input = PreferenceLineEdit(measurement_window, "analysis_parameters", "measurement_window")
+        self.filter_window_label = QLabel("Trace filter window (s):")
+        self.filter_polyorder_label = QLabel("Savitzky-Golay polynomial order:")
+        filter_window = prefs.get_preference("analysis_parameters", "filter_window", "1")
+        filter_polyorder = prefs.get_preference("analysis_parameters", "filter_polyorder", "2")
+        self.filter_window_input = PreferenceLineEdit(filter_window, "analysis_parameters", "filter_window")
+        self.filter_polyorder_input = PreferenceLineEdit(filter_polyorder, "analysis_parameters", "filter_polyorder")
+        self.bootstrap_resamples_label = QLabel("Bootstrap resamples for confidence intervals (0 = off):")
+        self.bootstrap_confidence_label = QLabel("Confidence level (%):")
+        bootstrap_resamples = prefs.get_preference("analysis_parameters", "bootstrap_resamples", "0")
+        bootstrap_confidence = prefs.get_preference("analysis_parameters", "bootstrap_confidence", "95")
+        self.bootstrap_resamples_input = PreferenceLineEdit(bootstrap_resamples, "analysis_parameters", "bootstrap_resamples")
+        self.bootstrap_confidence_input = PreferenceLineEdit(bootstrap_confidence, "analysis_parameters", "bootstrap_confidence")
+        self.sweep_points_label = QLabel("Read time sweep grid points:")
+        sweep_points = prefs.get_preference("analysis_parameters", "sweep_points", "1000")
+        self.sweep_points_input = PreferenceLineEdit(sweep_points, "analysis_parameters", "sweep_points")
+
+        self.measurement_group_box = QGroupBox("Measurement")
+        self.measurement_group_layout = QGridLayout()
+        self.measurement_group_box.setLayout(self.measurement_group_layout)
+
+        self.measurement_group_layout.addWidget(self.measurement_time_label)
+        self.measurement_group_layout.addWidget(self.measurement_time_input)
+        self.measurement_group_layout.addWidget(self.interpolate_label)
+        self.measurement_group_layout.addWidget(self.interpolate_input)
+        self.measurement_group_layout.addWidget(self.measurement_window_label)
+        self.measurement_group_layout.addWidget(self.measurement_window_input)
+        self.measurement_group_layout.addWidget(self.filter_window_label)
+        self.measurement_group_layout.addWidget(self.filter_window_input)
+        self.measurement_group_layout.addWidget(self.filter_polyorder_label)
+        self.measurement_group_layout.addWidget(self.filter_polyorder_input)
+        self.measurement_group_layout.addWidget(self.bootstrap_resamples_label)
+        self.measurement_group_layout.addWidget(self.bootstrap_resamples_input)
+        self.measurement_group_layout.addWidget(self.bootstrap_confidence_label)
+        self.measurement_group_layout.addWidget(self.bootstrap_confidence_input)
+        self.measurement_group_layout.addWidget(self.sweep_points_label)
+        self.measurement_group_layout.addWidget(self.sweep_points_input)
+
+
+        self.load_workers_label = QLabel("Loading worker processes (1 loads serially, 0 uses every core):")
+        load_workers = prefs.get_preference("performance_parameters", "load_workers", "1")
+        self.load_workers_input = PreferenceLineEdit(load_workers, "performance_parameters", "load_workers")
+
+        self.performance_group_box = QGroupBox("Performance")
+        self.performance_group_layout = QGridLayout()
+        self.performance_group_box.setLayout(self.performance_group_layout)
+
+        self.cache_enabled_label = QLabel("Cache parsed runs on disk (1 = on, 0 = off):")
+        self.cache_max_mb_label = QLabel("Run cache size limit (MB):")
+        cache_enabled = prefs.get_preference("performance_parameters", "cache_enabled", "1")
+        cache_max_mb = prefs.get_preference("performance_parameters", "cache_max_mb", "1024")
+        self.cache_enabled_input = PreferenceLineEdit(cache_enabled, "performance_parameters", "cache_enabled")
+        self.cache_max_mb_input = PreferenceLineEdit(cache_max_mb, "performance_parameters", "cache_max_mb")
+        self.instrumentation_label = QLabel("Time each analysis stage for the Timings panel (1 = on, 0 = off):")
+        instrumentation = prefs.get_preference("performance_parameters", "instrumentation", "1")
+        self.instrumentation_input = PreferenceLineEdit(instrumentation, "performance_parameters", "instrumentation")
+        self.precision_label = QLabel("Sample precision (float64, or float32 for half the memory on big lots):")
+        precision = prefs.get_preference("performance_parameters", "precision", "float64")
+        self.precision_input = PreferenceLineEdit(precision, "performance_parameters", "precision")
+        self.lot_cache_mb_label = QLabel("Lots kept in memory for going back to them / comparing (MB, 0 = off):")
+        lot_cache_mb = prefs.get_preference("performance_parameters", "lot_cache_mb", "1024")
+        self.lot_cache_mb_input = PreferenceLineEdit(lot_cache_mb, "performance_parameters", "lot_cache_mb")
+        self.stream_min_mb_label = QLabel("Stream files this big, keeping only the samples around the measurement time (MB, 0 = off):")
+        stream_min_mb = prefs.get_preference("performance_parameters", "stream_min_mb", "256")
+        self.stream_min_mb_input = PreferenceLineEdit(stream_min_mb, "performance_parameters", "stream_min_mb")
+        self.stream_max_points_label = QLabel("Points kept of a streamed trace for the plot:")
+        stream_max_points = prefs.get_preference("performance_parameters", "stream_max_points", "4000")
+        self.stream_max_points_input = PreferenceLineEdit(stream_max_points, "performance_parameters", "stream_max_points")
+        self.max_fps_label = QLabel("Live tail redraws per second (at most):")
+        max_fps = prefs.get_preference("live_parameters", "max_fps", "10")
+        self.max_fps_input = PreferenceLineEdit(max_fps, "live_parameters", "max_fps")
+
+        self.performance_group_layout.addWidget(self.load_workers_label)
+        self.performance_group_layout.addWidget(self.load_workers_input)
+        self.performance_group_layout.addWidget(self.cache_enabled_label)
+        self.performance_group_layout.addWidget(self.cache_enabled_input)
+        self.performance_group_layout.addWidget(self.cache_max_mb_label)
+        self.performance_group_layout.addWidget(self.cache_max_mb_input)
+        self.performance_group_layout.addWidget(self.instrumentation_label)
+        self.performance_group_layout.addWidget(self.instrumentation_input)
+        self.performance_group_layout.addWidget(self.precision_label)
+        self.performance_group_layout.addWidget(self.precision_input)
+        self.performance_group_layout.addWidget(self.lot_cache_mb_label)
+        self.performance_group_layout.addWidget(self.lot_cache_mb_input)
+        self.performance_group_layout.addWidget(self.stream_min_mb_label)
+        self.performance_group_layout.addWidget(self.stream_min_mb_input)
+        self.performance_group_layout.addWidget(self.stream_max_points_label)
+        self.performance_group_layout.addWidget(self.stream_max_points_input)
+        self.performance_group_layout.addWidget(self.max_fps_label)
+        self.performance_group_layout.addWidget(self.max_fps_input)
+
+        self.record_results_label = QLabel("Save every result to the history database (1 = on, 0 = off):")
+        self.database_path_label = QLabel("History database file:")
+        record_results = prefs.get_preference("history_parameters", "record_results", "1")
+        database_path = prefs.get_preference("history_parameters", "database_path", "results/history.sqlite3")
+        self.record_results_input = PreferenceLineEdit(record_results, "history_parameters", "record_results")
+        self.database_path_input = PreferenceLineEdit(database_path, "history_parameters", "database_path")
+
+        self.history_group_box = QGroupBox("History")
+        self.history_group_layout = QGridLayout()
+        self.history_group_box.setLayout(self.history_group_layout)
+
+        self.history_group_layout.addWidget(self.record_results_label)
+        self.history_group_layout.addWidget(self.record_results_input)
+        self.history_group_layout.addWidget(self.database_path_label)
+        self.history_group_layout.addWidget(self.database_path_input)
+
+
         # Create and set layout
         self.main_layout = QGridLayout()
         self.setLayout(self.main_layout)
@@ -80,6 +197,9 @@ class PreferencesDialog(QDialog):
         # Add widgets to layout
         self.main_layout.addWidget(self.calibration_group_box)
         self.main_layout.addWidget(self.qa_group_box)
+        self.main_layout.addWidget(self.measurement_group_box)
+        self.main_layout.addWidget(self.performance_group_box)
+        self.main_layout.addWidget(self.history_group_box)
         self.main_layout.addWidget(self.accept_button)
         self.main_layout.addWidget(self.cancel_button)
 
@@ -98,6 +218,7 @@ class PreferencesDialog(QDialog):
         pref_changes = PreferenceChanges()
         for category, key in pref_changes.changes.items():
             for key, value in pref_changes.changes[category].items():
-                prefs.preferences[category][key] = value
+                prefs.preferences.setdefault(category, {})[key] = value
         prefs.save_preferences()
+        self.changed_categories = set(pref_changes.changes)
         pref_changes.initialize() # reset the changes thing
\ No newline at end of file
@@ -1,16 +1,28 @@
 ''' defines all ui elements for the menu '''
-from PyQt6.QtCore import pyqtSignal
+import os
+import time
+from PyQt6.QtCore import pyqtSignal, Qt
 from PyQt6.QtWidgets import (
+    QWidget,
+    QVBoxLayout,
+    QHBoxLayout,
+    QListWidget,
+    QToolButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QHeaderView,
     QPushButton,
     QFileDialog,
     QComboBox,
     QLabel,
     QLCDNumber,
     QMessageBox,
-    QLineEdit
+    QLineEdit,
+    QProgressBar,
+    QCheckBox
 )
 
-from src.menu.preferences import PreferenceChanges
+from src.menu.preferences import PreferenceChanges, Preferences
 
 class AnalysisTypeDropdown(QComboBox):
     ''' dropdown for selecting the axis order in the file '''
@@ -48,6 +60,403 @@ class StartAnalysisButton(QPushButton):
         ''' emits the start signal '''
         self.start_signal.emit()
 
+class WatchFolderButton(QPushButton):
+    ''' toggle for watch folder mode, where new files are added to the analysis as they show up '''
+    def __init__(self):
+        super().__init__()
+        self.setText("Watch Folder")
+        self.setCheckable(True)
+
+class WatchStatusText(QLabel):
+    ''' shows the provisional QA result while watching a folder '''
+    def __init__(self):
+        super().__init__()
+        self.setVisible(False)
+
+    def show_status(self, text: str):
+        ''' shows a status line '''
+        self.setText(text)
+        self.setVisible(True)
+
+class FullResolutionCheckBox(QCheckBox):
+    ''' plots every raw sample of the traces instead of a decimated copy '''
+    def __init__(self):
+        super().__init__()
+        self.setText("Full resolution traces")
+
+class TraceFilterDropdown(QComboBox):
+    ''' dropdown for smoothing the traces before they're measured / plotted (see TraceFilter). it's the trace_filter
+    preference, so picking one saves it and emits filter_changed for the main window to rerun the lot
+    '''
+    FILTERS = {"No filter": "none", "Moving average": "moving_average", "Median": "median", "Savitzky-Golay": "savgol"}
+
+    filter_changed = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.addItems(list(self.FILTERS))
+        current = Preferences().get_preference("analysis_parameters", "trace_filter", "none")
+        methods = list(self.FILTERS.values())
+        self.setCurrentIndex(methods.index(current) if current in methods else 0)
+        self.activated.connect(self.on_change)
+
+    def on_change(self):
+        ''' saves the picked filter '''
+        prefs = Preferences()
+        prefs.preferences.setdefault("analysis_parameters", {})["trace_filter"] = self.FILTERS[self.currentText()]
+        prefs.save_preferences()
+        self.filter_changed.emit()
+
+class CancelAnalysisButton(QPushButton):
+    ''' button for cancelling a running analysis, only enabled while one is running '''
+    def __init__(self):
+        super().__init__()
+        self.setText("Cancel Analysis")
+        self.setDisabled(True)
+
+class AnalysisProgressBar(QProgressBar):
+    ''' shows how many files of the folder have been loaded '''
+    def __init__(self):
+        super().__init__()
+        self.setFormat("%v / %m files")
+        self.setValue(0)
+
+    def update_progress(self, done: int, total: int):
+        ''' slot for the worker progress signal '''
+        self.setMaximum(max(total, 1))
+        self.setValue(done)
+
+class TimingPanel(QWidget):
+    ''' collapsible panel with the stage timings / counters of the last analysis, closed by default '''
+    COLUMNS = ("Stage", "Count", "Last (ms)", "Total (ms)", "Max (ms)")
+
+    def __init__(self):
+        super().__init__()
+        self.toggle_button = QToolButton()
+        self.toggle_button.setText("Timings")
+        self.toggle_button.setCheckable(True)
+        self.toggle_button.setToolButtonStyle(Qt.ToolButtonStyle.ToolButtonTextBesideIcon)
+        self.toggle_button.setArrowType(Qt.ArrowType.RightArrow)
+        self.toggle_button.toggled.connect(self.set_open)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.counters_text = QLabel("No analysis yet")
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.toggle_button)
+        layout.addWidget(self.table)
+        layout.addWidget(self.counters_text)
+        self.setLayout(layout)
+        self.set_open(False)
+
+    def set_open(self, is_open: bool):
+        ''' expands / collapses the panel '''
+        self.toggle_button.setArrowType(Qt.ArrowType.DownArrow if is_open else Qt.ArrowType.RightArrow)
+        self.table.setVisible(is_open)
+        self.counters_text.setVisible(is_open)
+
+    def show_timings(self, timings: dict):
+        ''' fills the panel from an Instrumentation dict (ie AnalysisCore.timings()) '''
+        if not timings["enabled"]:
+            self.table.setRowCount(0)
+            self.counters_text.setText("Timing is turned off in the preferences")
+            return
+        spans = timings["spans"]
+        self.table.setRowCount(len(spans))
+        for row, (name, span) in enumerate(spans.items()):
+            values = (name, str(span["count"]), f"{span['last'] * 1000:.1f}", f"{span['total'] * 1000:.1f}", f"{span['max'] * 1000:.1f}")
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+        self.counters_text.setText(", ".join(f"{name}: {value}" for name, value in timings["counters"].items()))
+
+class HistoryPanel(QWidget):
+    ''' collapsible panel with the saved results (see ResultsDatabase): the latest lots, the weekly slope /
+    failure trend of one analysis type and the failure rate of every type. closed by default, the main window
+    fills it in (from the database) while it's open
+    '''
+    RESULT_COLUMNS = ("Analyzed", "Lot", "Type", "Slope", "Y int", "R^2", "Slope RPD", "Y int RPD", "QA")
+    TREND_COLUMNS = ("Week of", "Lots", "Mean slope", "Min slope", "Max slope", "Failed")
+    ALL_TYPES = "All analysis types"
+
+    refresh_requested = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.toggle_button = QToolButton()
+        self.toggle_button.setText("History")
+        self.toggle_button.setCheckable(True)
+        self.toggle_button.setToolButtonStyle(Qt.ToolButtonStyle.ToolButtonTextBesideIcon)
+        self.toggle_button.setArrowType(Qt.ArrowType.RightArrow)
+        self.toggle_button.toggled.connect(self.set_open)
+
+        self.type_dropdown = QComboBox()
+        self.type_dropdown.addItem(self.ALL_TYPES)
+        self.type_dropdown.activated.connect(self.refresh_requested.emit)
+        self.results_table = self.make_table(self.RESULT_COLUMNS)
+        self.trend_table = self.make_table(self.TREND_COLUMNS)
+        self.summary_text = QLabel("No results yet")
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.toggle_button)
+        layout.addWidget(self.type_dropdown)
+        layout.addWidget(self.results_table)
+        layout.addWidget(self.trend_table)
+        layout.addWidget(self.summary_text)
+        self.setLayout(layout)
+        self.set_open(False)
+
+    def make_table(self, columns: tuple[str, ...]) -> QTableWidget:
+        ''' read only table with stretched columns '''
+        table = QTableWidget(0, len(columns))
+        table.setHorizontalHeaderLabels(columns)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        table.verticalHeader().setVisible(False)
+        table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        return table
+
+    def is_open(self) -> bool:
+        ''' whether the panel is expanded (there's no point querying the database for it otherwise) '''
+        return self.toggle_button.isChecked()
+
+    def set_open(self, is_open: bool):
+        ''' expands / collapses the panel, asks for fresh results when it opens '''
+        self.toggle_button.setArrowType(Qt.ArrowType.DownArrow if is_open else Qt.ArrowType.RightArrow)
+        for widget in (self.type_dropdown, self.results_table, self.trend_table, self.summary_text):
+            widget.setVisible(is_open)
+        if is_open:
+            self.refresh_requested.emit()
+
+    def selected_analysis_type(self) -> str | None:
+        ''' the analysis type to filter on, None for all of them '''
+        text = self.type_dropdown.currentText()
+        return None if text == self.ALL_TYPES else text
+
+    def set_analysis_types(self, analysis_types: list[str]):
+        ''' the choices for the filter, keeps the current one '''
+        current = self.type_dropdown.currentText()
+        self.type_dropdown.clear()
+        self.type_dropdown.addItems([self.ALL_TYPES, *analysis_types])
+        self.type_dropdown.setCurrentText(current)
+
+    def fill_table(self, table: QTableWidget, rows: list[tuple[str, ...]]):
+        ''' replaces the contents of a table '''
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                table.setItem(row, column, QTableWidgetItem(value))
+
+    def show_history(self, results: list[dict], trend: list[dict], failure_rates: list[dict]):
+        ''' fills the panel from ResultsDatabase.recent / weekly_trend / failure_rates rows '''
+        self.fill_table(self.results_table, [(
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(result["analyzed_at"])), os.path.basename(result["lot"]), result["analysis_type"],
+            f"{result['slope']:.6g}", f"{result['y_intercept']:.6g}", f"{result['r_squared']:.6g}",
+            f"{result['slope_rpd']:.3g}", f"{result['y_intercept_rpd']:.3g}", "PASS" if result["passed"] else "FAIL"
+        ) for result in results])
+        self.fill_table(self.trend_table, [(
+            time.strftime("%Y-%m-%d", time.gmtime(week["week_start"])), str(week["lots"]),
+            f"{week['mean_slope']:.6g}", f"{week['min_slope']:.6g}", f"{week['max_slope']:.6g}", f"{week['failure_rate']:.0%}"
+        ) for week in trend])
+        self.trend_table.setVisible(self.is_open() and bool(trend))
+        if failure_rates:
+            self.summary_text.setText("Failed QA: " + ", ".join(f"{rate['analysis_type']} {rate['failure_rate']:.0%} of {rate['lots']}" for rate in failure_rates))
+        else:
+            self.summary_text.setText("No results yet")
+
+class SweepPanel(QWidget):
+    ''' collapsible panel for the linearity sweep (R^2 / slope against the read time). closed by default, the main
+    window runs the sweep and puts its canvas in here while it's open. clicking the graph shows the line at that time
+    '''
+    refresh_requested = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.toggle_button = QToolButton()
+        self.toggle_button.setText("Read Time Sweep")
+        self.toggle_button.setCheckable(True)
+        self.toggle_button.setToolButtonStyle(Qt.ToolButtonStyle.ToolButtonTextBesideIcon)
+        self.toggle_button.setArrowType(Qt.ArrowType.RightArrow)
+        self.toggle_button.toggled.connect(self.set_open)
+
+        self.canvas = None # set by the main window, matplotlib is slow to import
+        self.summary_text = QLabel("Run an analysis to sweep its read times")
+        self.selected_text = QLabel()
+
+        self.body_layout = QVBoxLayout()
+        self.body_layout.addWidget(self.summary_text)
+        self.body_layout.addWidget(self.selected_text)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.toggle_button)
+        layout.addLayout(self.body_layout)
+        self.setLayout(layout)
+        self.set_open(False)
+
+    def is_open(self) -> bool:
+        ''' whether the panel is expanded (there's no point running the sweep otherwise) '''
+        return self.toggle_button.isChecked()
+
+    def set_open(self, is_open: bool):
+        ''' expands / collapses the panel, asks for a sweep when it opens '''
+        self.toggle_button.setArrowType(Qt.ArrowType.DownArrow if is_open else Qt.ArrowType.RightArrow)
+        for widget in (self.canvas, self.summary_text, self.selected_text):
+            if widget is not None:
+                widget.setVisible(is_open)
+        if is_open:
+            self.refresh_requested.emit()
+
+    def set_canvas(self, canvas: QWidget):
+        ''' puts the sweep graph in the panel, once '''
+        self.canvas = canvas
+        self.canvas.setMinimumHeight(300)
+        self.body_layout.insertWidget(0, canvas)
+        self.canvas.setVisible(self.is_open())
+
+    def describe(self, point: dict[str, float]) -> str:
+        ''' one line for the line at one read time (see LinearitySweep.point) '''
+        return f"{point['time']:.4g} s: slope {point['slope']:.6g}, y int {point['y_intercept']:.6g}, R^2 {point['r_squared']:.6f}"
+
+    def show_sweep(self, best: dict[str, float], current: dict[str, float] | None):
+        ''' shows the suggested read time, next to the line at the measurement time if it's on the grid '''
+        lines = [f"Suggested read time {self.describe(best)}"]
+        if current is not None:
+            lines.append(f"Measurement time {self.describe(current)}")
+        self.summary_text.setText("\n".join(lines))
+        self.selected_text.setText("Click the graph to see the line at any read time")
+
+    def show_selected(self, point: dict[str, float]):
+        ''' shows the line at the clicked read time '''
+        self.selected_text.setText(f"Selected {self.describe(point)}")
+
+    def show_message(self, text: str):
+        ''' ie why there's no sweep '''
+        self.summary_text.setText(text)
+        self.selected_text.setText("")
+
+class ComparisonPanel(QWidget):
+    ''' collapsible panel for comparing lots: a list of lot folders (of the selected analysis type), their fitted
+    lines overlaid on one graph and a table of the lines. closed by default, the main window loads the lots and puts
+    the canvas in here
+    '''
+    COLUMNS = ("Lot", "Runs", "Slope", "Y int", "R^2", "QA")
+
+    compare_requested = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.toggle_button = QToolButton()
+        self.toggle_button.setText("Compare Lots")
+        self.toggle_button.setCheckable(True)
+        self.toggle_button.setToolButtonStyle(Qt.ToolButtonStyle.ToolButtonTextBesideIcon)
+        self.toggle_button.setArrowType(Qt.ArrowType.RightArrow)
+        self.toggle_button.toggled.connect(self.set_open)
+
+        self.lot_list = QListWidget()
+        self.lot_list.setMaximumHeight(100)
+        self.add_button = QPushButton("Add Lot")
+        self.add_button.clicked.connect(self.add_lot)
+        self.remove_button = QPushButton("Remove")
+        self.remove_button.clicked.connect(self.remove_lot)
+        self.compare_button = QPushButton("Compare")
+        self.compare_button.clicked.connect(self.compare_requested.emit)
+        self.traces_checkbox = QCheckBox("Show traces")
+        self.traces_checkbox.toggled.connect(self.compare_requested.emit)
+        buttons = QWidget()
+        buttons_layout = QHBoxLayout()
+        buttons_layout.setContentsMargins(0, 0, 0, 0)
+        for widget in (self.add_button, self.remove_button, self.compare_button, self.traces_checkbox):
+            buttons_layout.addWidget(widget)
+        buttons.setLayout(buttons_layout)
+
+        self.canvas = None # set by the main window, matplotlib is slow to import
+        self.results_table = QTableWidget(0, len(self.COLUMNS))
+        self.results_table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.results_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.results_table.verticalHeader().setVisible(False)
+        self.results_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.status_text = QLabel("Add two or more lot folders to compare them")
+        self.cache_text = QLabel()
+        self.body = [self.lot_list, buttons, self.results_table, self.status_text, self.cache_text]
+
+        self.body_layout = QVBoxLayout()
+        for widget in self.body:
+            self.body_layout.addWidget(widget)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.toggle_button)
+        layout.addLayout(self.body_layout)
+        self.setLayout(layout)
+        self.set_open(False)
+
+    def is_open(self) -> bool:
+        ''' whether the panel is expanded '''
+        return self.toggle_button.isChecked()
+
+    def set_open(self, is_open: bool):
+        ''' expands / collapses the panel '''
+        self.toggle_button.setArrowType(Qt.ArrowType.DownArrow if is_open else Qt.ArrowType.RightArrow)
+        for widget in (self.canvas, *self.body):
+            if widget is not None:
+                widget.setVisible(is_open)
+
+    def set_canvas(self, canvas: QWidget):
+        ''' puts the comparison graph in the panel, once '''
+        self.canvas = canvas
+        self.canvas.setMinimumHeight(300)
+        self.body_layout.insertWidget(2, canvas)
+        self.canvas.setVisible(self.is_open())
+
+    def directories(self) -> list[str]:
+        ''' the lot folders, in the order they were added '''
+        return [self.lot_list.item(row).text() for row in range(self.lot_list.count())]
+
+    def add_lot(self):
+        ''' picks a lot folder and adds it to the list (once) '''
+        directory = QFileDialog.getExistingDirectory(self, "Add Lot")
+        if directory and directory not in self.directories():
+            self.lot_list.addItem(directory)
+
+    def remove_lot(self):
+        ''' takes the selected lot off the list '''
+        for item in self.lot_list.selectedItems():
+            self.lot_list.takeItem(self.lot_list.row(item))
+
+    def show_progress(self, done: int, total: int):
+        ''' while the lots load '''
+        self.status_text.setText(f"Loading lots: {done} / {total}")
+
+    def show_results(self, rows: list[dict], errors: dict[str, str]):
+        ''' fills the table, one row per lot (label, runs, slope, y_intercept, r_squared, passed), and lists the lots
+        that couldn't be loaded
+        '''
+        self.results_table.setRowCount(len(rows))
+        for row, result in enumerate(rows):
+            if result["slope"] is None:
+                values = (result["label"], str(result["runs"]), "", "", "", "Can't fit")
+            else:
+                values = (result["label"], str(result["runs"]), f"{result['slope']:.6g}", f"{result['y_intercept']:.6g}",
+                          f"{result['r_squared']:.6g}", "PASS" if result["passed"] else "FAIL")
+            for column, value in enumerate(values):
+                self.results_table.setItem(row, column, QTableWidgetItem(value))
+        if errors:
+            self.status_text.setText("Couldn't load: " + ", ".join(f"{os.path.basename(directory)} ({error})" for directory, error in errors.items()))
+        else:
+            self.status_text.setText(f"Compared {len(rows)} lots")
+
+    def show_cache(self, stats: dict[str, int]):
+        ''' lot cache use, from LotCache.stats '''
+        self.cache_text.setText(f"Lot cache: {stats['lots']} lots, {stats['bytes'] / 2**20:.0f} MB of {stats['max_bytes'] / 2**20:.0f} MB "
+                                f"({stats['hits']} hits, {stats['misses']} misses)")
+
+    def show_message(self, text: str):
+        ''' ie why there's nothing to compare '''
+        self.status_text.setText(text)
+
 class AxisSelectDropdown(QComboBox):
     ''' dropdown for selecting the axis order in the file '''
     def __init__(self):
@@ -100,6 +509,26 @@ class LCD(QLCDNumber):
         self.setSegmentStyle(QLCDNumber.SegmentStyle.Filled)
         self.setDigitCount(8)
 
+class ConfidenceText(QLabel):
+    ''' shows the bootstrap confidence intervals of the line / RPDs and how often each QA check passed across resamples '''
+    NAMES = {"slope": "Slope", "y_intercept": "Y int", "r_squared": "R^2", "slope_rpd": "Slope RPD (%)", "y_intercept_rpd": "Y int RPD (%)"}
+
+    def __init__(self):
+        super().__init__()
+        self.setVisible(False)
+
+    def show_confidence(self, confidence: dict | None):
+        ''' shows the intervals from AnalysisCore.bootstrap, or hides the text for None '''
+        if confidence is None:
+            self.setVisible(False)
+            return
+        lines = [f"{confidence['confidence']:g}% intervals ({confidence['resamples']} resamples):"]
+        for name, interval in confidence["intervals"].items():
+            lines.append(f"{self.NAMES[name]}: {interval[0]:.6g} to {interval[1]:.6g}" if interval is not None else f"{self.NAMES[name]}: n/a")
+        lines.append("QA pass rate: " + ", ".join(f"{self.NAMES[check]} {rate:.0%}" for check, rate in confidence["pass_rates"].items()))
+        self.setText("\n".join(lines))
+        self.setVisible(True)
+
 class Alert(QMessageBox):
     ''' alert for displaying errors '''
     def __init__(self, parameter: str, value: float):
@@ -109,8 +538,33 @@ class Alert(QMessageBox):
         self.setStandardButtons(QMessageBox.StandardButton.Ok)
         self.setIcon(QMessageBox.Icon.Critical)
 
+class RunFlagsAlert(QMessageBox):
+    ''' warning for runs that loaded but look off, ie a stone run with no stage 2. the analysis still went ahead '''
+    def __init__(self, flags: dict[str, list[str]]):
+        super().__init__()
+        self.setText("Some Runs Were Flagged")
+        self.setInformativeText(f"{len(flags)} run(s) had problems while loading, check them before trusting this batch. See the details for which.")
+        self.setDetailedText("\n".join(f"{os.path.basename(file_path)}: {'; '.join(messages)}" for file_path, messages in sorted(flags.items())))
+        self.setStandardButtons(QMessageBox.StandardButton.Ok)
+        self.setIcon(QMessageBox.Icon.Warning)
+
+class ErrorAlert(QMessageBox):
+    ''' alert for an analysis (or export) that failed to run at all, ie a bad file in the folder '''
+    def __init__(self, message: str, title: str = "Analysis Failed"):
+        super().__init__()
+        self.setText(title)
+        self.setInformativeText(message)
+        self.setStandardButtons(QMessageBox.StandardButton.Ok)
+        self.setIcon(QMessageBox.Icon.Warning)
+
 class SaveDialog(QFileDialog):
-    ''' dialog for saving the file '''
+    ''' dialog for exporting the current lot, the file type picks the format '''
+    NAME_FILTERS = {
+        "Compressed NumPy (*.npz)": "npz",
+        "CSV, one row per sample (*.csv)": "csv",
+        "Chunked columnar (*.traqcol)": "traqcol",
+    }
+
     def __init__(self):
         super().__init__()
         self.setFileMode(QFileDialog.FileMode.AnyFile)
@@ -120,7 +574,13 @@ class SaveDialog(QFileDialog):
         self.setLabelText(QFileDialog.DialogLabel.Accept, "Save")
         self.setLabelText(QFileDialog.DialogLabel.Reject, "Cancel")
         self.setLabelText(QFileDialog.DialogLabel.FileType, "File type:")
-        self.setDefaultSuffix("json")
+        self.setNameFilters(list(self.NAME_FILTERS))
+        self.setDefaultSuffix("npz")
+        self.filterSelected.connect(self.on_filter_selected)
+
+    def on_filter_selected(self, name_filter: str):
+        ''' a typed file name with no extension gets the one of the selected file type '''
+        self.setDefaultSuffix(self.NAME_FILTERS.get(name_filter, "npz"))
 
 class PreferenceLineEdit(QLineEdit):
     ''' custom line edit class that includes the category / value of each pref it edits'''
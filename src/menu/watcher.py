@@ -0,0 +1,88 @@
+''' watches a data folder for new files while a lot is still being run, or one file while it's being written '''
+import os
+from PyQt6.QtCore import QObject, QFileSystemWatcher, QTimer, pyqtSignal
+
+
+class FolderWatcher(QObject):
+    ''' emits files_ready with new files in a folder once they've stopped growing.
+    the instrument writes files over time, so a new file is only handed over when its size
+    is the same on two polls in a row (and not empty)
+    '''
+    files_ready = pyqtSignal(list)
+    POLL_INTERVAL_MS = 500
+
+    def __init__(self, directory: str, known_file_paths: set[str]):
+        super().__init__()
+        self.directory = directory
+        self.known_file_paths = set(known_file_paths)
+        self.pending_sizes = {} # file path -> size on the last poll
+        self.watcher = QFileSystemWatcher([directory])
+        self.watcher.directoryChanged.connect(self.poll)
+        self.timer = QTimer()
+        self.timer.setInterval(self.POLL_INTERVAL_MS)
+        self.timer.timeout.connect(self.poll)
+
+    def start(self):
+        ''' starts watching, picking up anything that landed since the known files were loaded '''
+        self.poll()
+
+    def stop(self):
+        ''' stops watching '''
+        self.timer.stop()
+        self.watcher.removePaths(self.watcher.directories())
+
+    def poll(self):
+        ''' looks for new files, and hands over the ones whose size has settled '''
+        ready = []
+        for file in os.scandir(self.directory):
+            if not file.is_file() or file.name.startswith('.') or file.path in self.known_file_paths:
+                continue
+            size = file.stat().st_size
+            if size > 0 and self.pending_sizes.get(file.path) == size:
+                del self.pending_sizes[file.path]
+                self.known_file_paths.add(file.path)
+                ready.append(file.path)
+            else:
+                self.pending_sizes[file.path] = size
+        # keep polling while something is still being written, the directory signal won't fire for appends
+        if self.pending_sizes:
+            self.timer.start()
+        else:
+            self.timer.stop()
+        if ready:
+            self.files_ready.emit(sorted(ready))
+
+
+class LiveTailWatcher(QObject):
+    ''' polls a LiveTail (a file that's still being written) on a timer and emits updated when rows came in.
+    the timer runs at max_fps, so the canvas is redrawn at most that often however fast the instrument writes
+    '''
+    updated = pyqtSignal(int) # new rows
+    failed = pyqtSignal(str)
+
+    def __init__(self, live_tail, max_fps: float = 10):
+        super().__init__()
+        self.live_tail = live_tail
+        self.timer = QTimer()
+        self.timer.setInterval(max(int(1000 / max_fps), 1))
+        self.timer.timeout.connect(self.poll)
+
+    def start(self):
+        ''' reads what's there already, then keeps polling '''
+        self.poll()
+        self.timer.start()
+
+    def stop(self):
+        ''' stops polling '''
+        self.timer.stop()
+
+    def poll(self):
+        ''' parses whatever was appended, stops on a file that can't be read / parsed '''
+        try:
+            new_rows = self.live_tail.poll()
+        except (OSError, ValueError) as e:
+            self.stop()
+            self.failed.emit(f"{type(e).__name__}: {e}")
+            return
+        if new_rows:
+            self.updated.emit(new_rows)
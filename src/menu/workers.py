@@ -0,0 +1,183 @@
+''' background workers, so long running work doesn't freeze the window '''
+import threading
+import time
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from src.startup import StartupTimer
+# the analysis modules (numpy / scipy / matplotlib) are imported in run(), so they stay off the startup path
+
+
+class AnalysisWorker(QThread):
+    ''' loads an AnalysisCore off the GUI thread (the slow part: parsing, modifying, measuring), bootstraps
+    its confidence intervals if that's turned on, then fits, QA checks, records and decimates it (AnalysisCore.compute).
+    the main window only draws the result into its existing figures, which are updated in place
+    '''
+    progress = pyqtSignal(int, int) # files done, total files
+    analysis_finished = pyqtSignal(object, object) # the loaded AnalysisCore, its AnalysisResult (None with less than 2 concentrations)
+    analysis_failed = pyqtSignal(str)
+    analysis_cancelled = pyqtSignal()
+
+    def __init__(self, directory: str, analysis_type: str, axis_order_in_file: tuple[str, str], max_points: int | None = None):
+        super().__init__()
+        self.directory = directory
+        self.analysis_type = analysis_type
+        self.axis_order_in_file = axis_order_in_file
+        self.max_points = max_points # the trace plot's point budget, None leaves the decimating to the GUI
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        ''' asks the analysis to stop at the next run boundary '''
+        self.cancel_event.set()
+
+    def run(self):
+        ''' runs in the worker thread '''
+        from src.analysis.analysis import AnalysisCore # pylint: disable=import-outside-toplevel
+        from src.analysis.data import AnalysisCancelled # pylint: disable=import-outside-toplevel
+        try:
+            analysis_core = AnalysisCore(self.directory, self.analysis_type, self.axis_order_in_file, self.progress.emit, self.cancel_event,
+                                         use_lot_cache=True)
+            analysis_core.bootstrap() # no-op unless it's on in the preferences
+            result = analysis_core.compute(max_points=self.max_points) if analysis_core.can_fit() else None
+        except AnalysisCancelled:
+            self.analysis_cancelled.emit()
+            return
+        except Exception as e: # pylint: disable=broad-except
+            self.analysis_failed.emit(f"{type(e).__name__}: {e}")
+            return
+        self.analysis_finished.emit(analysis_core, result)
+
+
+class ExportWorker(QThread):
+    ''' writes an export (see src.analysis.export) off the GUI thread, chunk by chunk '''
+    progress = pyqtSignal(int, int) # chunks done, total chunks
+    export_finished = pyqtSignal(list) # the files written
+    export_failed = pyqtSignal(str)
+    export_cancelled = pyqtSignal()
+
+    def __init__(self, snapshot, path: str):
+        super().__init__()
+        self.snapshot = snapshot # a LotSnapshot, taken on the GUI thread
+        self.path = path
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        ''' asks the export to stop at the next chunk, the partial file is removed '''
+        self.cancel_event.set()
+
+    def run(self):
+        ''' runs in the worker thread '''
+        from src.analysis.export import LotExporter, ExportCancelled # pylint: disable=import-outside-toplevel
+        try:
+            file_paths = LotExporter(self.snapshot, self.path, self.progress.emit, self.cancel_event).export()
+        except ExportCancelled:
+            self.export_cancelled.emit()
+            return
+        except Exception as e: # pylint: disable=broad-except
+            self.export_failed.emit(f"{type(e).__name__}: {e}")
+            return
+        self.export_finished.emit(file_paths)
+
+
+class WatchWorker(QThread):
+    ''' reads the files that showed up in a watched folder off the GUI thread (AnalysisCore.read_file: parsing /
+    modifying, or streaming a long one), so a big file doesn't freeze the window. nothing of the core is changed
+    here, the main window adds what was read (AnalysisCore.add_file) and merges the timings once it's done
+    '''
+    files_read = pyqtSignal(list, list) # [(file path, what read_file gave)], [unreadable file paths]
+
+    def __init__(self, analysis_core, file_paths: list[str]):
+        super().__init__()
+        self.analysis_core = analysis_core
+        self.file_paths = file_paths
+        self.instrumentation = None # what the reads took, made in run()
+
+    def run(self):
+        ''' runs in the worker thread '''
+        from src.analysis.instrumentation import Instrumentation # pylint: disable=import-outside-toplevel
+        self.instrumentation = Instrumentation(self.analysis_core.instrumentation.enabled)
+        read, skipped = [], []
+        for file_path in self.file_paths:
+            try:
+                read.append((file_path, self.analysis_core.read_file(file_path, self.instrumentation)))
+            except Exception: # pylint: disable=broad-except
+                skipped.append(file_path) # bad name / contents, leave the rest of the lot alone
+        self.files_read.emit(read, skipped)
+
+
+class SweepWorker(QThread):
+    ''' runs the linearity sweep of an AnalysisCore off the GUI thread, it reads every sample of every run. the runs
+    are taken on the GUI thread (AnalysisCore.prepare_sweep) before it starts, and nothing of the core is touched
+    here, so watch mode can add runs / read the timings meanwhile. seconds is for the core's "sweep" span, which the
+    GUI thread records once this is done
+    '''
+    sweep_finished = pyqtSignal(object) # the LinearitySweep
+    sweep_failed = pyqtSignal(str)
+
+    def __init__(self, analysis_core):
+        super().__init__()
+        self.analysis_core = analysis_core # only to tell whether the lot changed while it ran
+        self.make_sweep = analysis_core.prepare_sweep()
+        self.seconds = None
+
+    def run(self):
+        ''' runs in the worker thread '''
+        started = time.perf_counter()
+        try:
+            sweep = self.make_sweep()
+        except Exception as e: # pylint: disable=broad-except
+            self.sweep_failed.emit(f"{type(e).__name__}: {e}")
+            return
+        self.seconds = time.perf_counter() - started
+        self.sweep_finished.emit(sweep)
+
+
+class ComparisonWorker(QThread):
+    ''' loads the lots of the comparison view off the GUI thread (see AnalysisCore.compare), lots already in the
+    lot cache come back straight away
+    '''
+    progress = pyqtSignal(int, int) # lots done, total lots
+    comparison_finished = pyqtSignal(object) # the LotComparison
+    comparison_failed = pyqtSignal(str)
+    comparison_cancelled = pyqtSignal()
+
+    def __init__(self, directories: list[str], analysis_type: str, axis_order_in_file: tuple[str, str]):
+        super().__init__()
+        self.directories = directories
+        self.analysis_type = analysis_type
+        self.axis_order_in_file = axis_order_in_file
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        ''' asks every lot to stop at the next run boundary '''
+        self.cancel_event.set()
+
+    def run(self):
+        ''' runs in the worker thread '''
+        from src.analysis.analysis import AnalysisCore # pylint: disable=import-outside-toplevel
+        from src.analysis.data import AnalysisCancelled # pylint: disable=import-outside-toplevel
+        try:
+            comparison = AnalysisCore.compare(self.directories, self.analysis_type, self.axis_order_in_file, self.progress.emit, self.cancel_event)
+        except AnalysisCancelled:
+            self.comparison_cancelled.emit()
+            return
+        except Exception as e: # pylint: disable=broad-except
+            self.comparison_failed.emit(f"{type(e).__name__}: {e}")
+            return
+        self.comparison_finished.emit(comparison)
+
+
+class WarmUpWorker(QThread):
+    ''' imports the slow analysis modules in the background once the window is up,
+    so the first analysis doesn't pay for them. each import is timed for the startup report
+    '''
+    MODULES = ("numpy", "scipy.stats", "src.analysis.analysis")
+
+    def run(self):
+        ''' runs in the worker thread '''
+        startup_timer = StartupTimer()
+        with startup_timer.span("background warm up"):
+            for module_name in self.MODULES:
+                try:
+                    startup_timer.timed_import(module_name)
+                except ImportError: # the analysis will raise it properly when it's actually needed
+                    pass
@@ -0,0 +1,95 @@
+''' startup timing, so cold start time on the QA workstations can be tracked. turned on with
+--startup-report on the command line (or TRAQ_STARTUP_REPORT=1), which prints a breakdown of
+the imports / stages once the window is up and the background warm up is done, and appends it
+as one json line to logs/startup.jsonl
+'''
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+class StartupTimer():
+    ''' singleton that records how long each import / startup stage took, relative to when it was first made
+    (which is the first thing main.py does). always records, it's a couple of perf_counter calls per stage
+    '''
+    _instance = None
+    LOG_PATH = os.path.join("logs", "startup.jsonl")
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.initialize()
+        return cls._instance
+
+    def initialize(self):
+        ''' sets up the timer, only once '''
+        self.start = time.perf_counter()
+        self.enabled = "--startup-report" in sys.argv or os.environ.get("TRAQ_STARTUP_REPORT") == "1"
+        self.spans = [] # (kind, name, start, duration, thread), thread is "main" or "background", times in seconds from self.start
+        self.marks = {} # milestone name -> seconds from self.start
+        self.lock = threading.Lock() # the warm up thread records too
+        self.reported = False
+
+    def now(self) -> float:
+        ''' seconds since startup '''
+        return time.perf_counter() - self.start
+
+    @contextmanager
+    def span(self, name: str, kind: str = "stage"):
+        ''' times a block, ie with timer.span("main window"): ... '''
+        started = self.now()
+        try:
+            yield
+        finally:
+            with self.lock:
+                thread = "main" if threading.current_thread() is threading.main_thread() else "background"
+                self.spans.append((kind, name, started, self.now() - started, thread))
+
+    def timed_import(self, module_name: str):
+        ''' imports a module, timing it. modules that were already imported show up as ~0 '''
+        with self.span(module_name, "import"):
+            return importlib.import_module(module_name)
+
+    def mark(self, name: str):
+        ''' records a milestone, ie "window shown" '''
+        with self.lock:
+            self.marks[name] = self.now()
+
+    def to_dict(self) -> dict:
+        ''' everything recorded so far, for the log '''
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "python": sys.version.split()[0],
+                "marks": dict(self.marks),
+                "spans": [
+                    {"kind": kind, "name": name, "start": started, "duration": duration, "thread": thread}
+                    for kind, name, started, duration, thread in self.spans
+                ]
+            }
+
+    def report(self) -> str:
+        ''' human readable breakdown, milestones first then every span in the order it started '''
+        report = self.to_dict()
+        lines = ["startup report (seconds since launch)"]
+        for name, at in sorted(report["marks"].items(), key=lambda item: item[1]):
+            lines.append(f"  {at:8.3f}  {name}")
+        lines.append("  start     duration  kind    name")
+        for span in sorted(report["spans"], key=lambda span: span["start"]):
+            background = "" if span["thread"] == "main" else " [background]"
+            lines.append(f"  {span['start']:8.3f}  {span['duration']:8.3f}  {span['kind']:<6}  {span['name']}{background}")
+        return "\n".join(lines)
+
+    def finish(self):
+        ''' prints / logs the report, once, if it was asked for '''
+        with self.lock:
+            if not self.enabled or self.reported:
+                return
+            self.reported = True
+        print(self.report(), file=sys.stderr)
+        os.makedirs(os.path.dirname(self.LOG_PATH), exist_ok=True)
+        with open(self.LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.to_dict()) + "\n")
@@ -0,0 +1,18 @@
+''' batch QA records each lot once, against the master line it was checked with '''
+from benchmarks.generators import write_lot
+from src.analysis.results_db import ResultsDatabase
+from src.batch import check_lot
+from src.menu.preferences import Preferences
+
+
+def test_rendered_lot_is_recorded_once_against_the_cli_master_line(tmp_path, monkeypatch):
+    database_path = str(tmp_path / "history.sqlite3")
+    monkeypatch.setitem(Preferences().preferences, "history_parameters", {"record_results": "1", "database_path": database_path})
+    lot = str(tmp_path / "lot")
+    write_lot(lot, "LactateVSPCalibration", 12, 400)
+    result = check_lot(lot, "LactateVSPCalibration", ('current', 'time'), (123.0, None, None), render_directory=str(tmp_path / "plots"))
+    rows = ResultsDatabase(database_path).recent()
+    assert len(rows) == 1
+    assert rows[0]["slope_rpd"] == result["slope_rpd"]
+    assert rows[0]["y_intercept_rpd"] == result["y_intercept_rpd"]
+    assert (tmp_path / "plots" / "lot_traces.png").exists()
@@ -0,0 +1,107 @@
+''' the live tail and the streaming reader give what a whole run load gives, however the file is cut up, and adding
+runs one at a time (watch mode) gives what loading the whole lot gives '''
+import os
+import numpy
+import pytest
+
+from benchmarks.generators import write_vsp_file, write_lot, stone_rows, STONE_HEADER, STONE_FORMAT
+from src.analysis.analysis import AnalysisCore
+from src.analysis.data import Data
+from src.analysis.live import LiveTail
+from src.analysis.measurement import MeasurementEngine
+from src.analysis.streaming import StreamingReader
+
+TIME_POINT = 10
+WINDOW = 0.5
+
+
+def write_stone(file_path: str, stages=None):
+    ''' a 30 s stone run, stages replaces its stage column (ie no stage 2, or stage 2 twice) '''
+    rows = stone_rows(0, 3000, 3000, 5.0, 0.01, numpy.random.default_rng(0))
+    if stages is not None:
+        rows[:, 4] = stages
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(STONE_HEADER)
+        numpy.savetxt(f, rows, fmt=STONE_FORMAT, delimiter="\t")
+
+def repeated_stage_2() -> numpy.ndarray:
+    stages = numpy.ones(3000)
+    stages[500:1500] = 2
+    stages[2000:] = 2
+    return stages
+
+RUNS = {
+    "vsp": ("LactateVSPCalibration", lambda file_path: write_vsp_file(file_path, 1000), []),
+    "stone": ("LactateStoneCalibration", write_stone, []),
+    "stone no stage 2": ("LactateStoneCalibration", lambda file_path: write_stone(file_path, numpy.ones(3000)),
+                         ["no stage 2, used the whole run"]),
+    "stone repeated stage 2": ("LactateStoneCalibration", lambda file_path: write_stone(file_path, repeated_stage_2()),
+                               ["stage 2 starts 2 times, used the first"]),
+}
+
+
+def whole_run(tmp_path, name: str):
+    ''' writes the run in a lot of its own, returns its path, analysis type, the loaded run and its flags '''
+    analysis_type, write, _ = RUNS[name]
+    lot = tmp_path / "lot"
+    lot.mkdir()
+    file_path = str(lot / "5_00_rep0.txt")
+    write(file_path)
+    data = Data(str(lot), analysis_type)
+    return file_path, analysis_type, data.nested_data[0], data.flags.get(file_path, [])
+
+@pytest.mark.parametrize("name", RUNS)
+def test_live_tail_matches_the_whole_run(tmp_path, name):
+    file_path, analysis_type, run, flags = whole_run(tmp_path, name)
+    assert flags == RUNS[name][2]
+    with open(file_path, "rb") as f:
+        contents = f.read()
+    tail_path = str(tmp_path / os.path.basename(file_path))
+    tail = LiveTail(tail_path, analysis_type)
+    open(tail_path, "wb").close()
+    # cut anywhere, ie in the header or half way through a line
+    cuts = numpy.sort(numpy.random.default_rng(1).integers(0, len(contents), 40)).tolist() + [len(contents)]
+    written = 0
+    for cut in cuts:
+        with open(tail_path, "ab") as f:
+            f.write(contents[written:cut])
+        written = cut
+        tail.poll()
+    assert numpy.allclose(tail.x_axis, run.x_axis)
+    assert numpy.array_equal(tail.y_axis, run.y_axis)
+    assert tail.flags == flags
+
+@pytest.mark.parametrize("name", RUNS)
+def test_streamed_run_keeps_the_reading(tmp_path, name):
+    file_path, analysis_type, run, flags = whole_run(tmp_path, name)
+    reader = StreamingReader(analysis_type, time_point=TIME_POINT, window=WINDOW, min_bytes=1, max_points=200)
+    reader.BLOCK_BYTES = 4096 # lots of blocks, so windows / lines get cut between them
+    x_axis, y_axis, streamed_flags, rows = reader.read(file_path)
+    assert streamed_flags == flags
+    assert rows == (1000 if analysis_type == "LactateVSPCalibration" else 3000)
+    kept = (x_axis >= reader.keep_from) & (x_axis <= reader.keep_to)
+    inside = (run.x_axis >= reader.keep_from) & (run.x_axis <= reader.keep_to)
+    assert numpy.allclose(x_axis[kept], run.x_axis[inside])
+    assert numpy.array_equal(y_axis[kept], run.y_axis[inside])
+    for interpolate in (False, True):
+        for window in (0.0, WINDOW):
+            engine = MeasurementEngine(TIME_POINT, interpolate, window)
+            assert engine.measure(x_axis, y_axis) == pytest.approx(engine.measure(run.x_axis, run.y_axis))
+
+@pytest.mark.parametrize("analysis_type", ["LactateVSPCalibration", "LactateStoneCalibration"])
+def test_added_runs_keep_the_group_stds(tmp_path, analysis_type):
+    lot = str(tmp_path / "lot")
+    file_paths = write_lot(lot, analysis_type, 12, 1500)
+    later = file_paths[1::2] # every group starts with 1 or 2 runs
+    (tmp_path / "later").mkdir()
+    for file_path in later:
+        os.rename(file_path, str(tmp_path / "later" / os.path.basename(file_path)))
+    watched = AnalysisCore(lot, analysis_type, load_workers=1, use_cache=False, record_results=False)
+    for file_path in later:
+        os.rename(str(tmp_path / "later" / os.path.basename(file_path)), file_path)
+        watched.add_file(file_path)
+    loaded = AnalysisCore(lot, analysis_type, load_workers=1, use_cache=False, record_results=False)
+    assert watched.la.concentrations == loaded.la.concentrations
+    assert watched.la.replicate_counts == loaded.la.replicate_counts
+    assert watched.la.currents == pytest.approx(loaded.la.currents, rel=1E-9)
+    assert watched.la.current_stds == pytest.approx(loaded.la.current_stds, rel=1E-6)
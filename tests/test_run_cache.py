@@ -0,0 +1,51 @@
+''' the on disk run cache only hands back runs made by the current modifiers '''
+import os
+import numpy
+
+from benchmarks.generators import write_stone_file, stone_rows, STONE_HEADER, STONE_FORMAT
+from src.analysis.cache import RunCache
+from src.analysis.data import Data
+
+NO_STAGE_2 = "no stage 2, used the whole run"
+
+
+def write_lot(directory: str):
+    ''' a small stone lot, 2 concentrations x 2 replicates, plus a run that never gets to stage 2 '''
+    os.makedirs(directory)
+    for concentration in (1.0, 5.0):
+        for replicate in range(2):
+            file_name = f"{concentration:.2f}".replace(".", "_") + f"_rep{replicate}.txt"
+            write_stone_file(os.path.join(directory, file_name), 2000, concentration, seed=replicate)
+    rows = stone_rows(0, 2000, 2000, 5.0, 0.01, numpy.random.default_rng(0))
+    rows[:, 4] = 1
+    with open(os.path.join(directory, "5_00_rep2.txt"), "w", encoding="utf-8") as f:
+        f.write(STONE_HEADER)
+        numpy.savetxt(f, rows, fmt=STONE_FORMAT, delimiter="\t")
+
+def test_runs_cached_by_older_modifiers_miss(tmp_path):
+    lot = str(tmp_path / "lot")
+    write_lot(lot)
+    cache = RunCache(str(tmp_path / "cache"))
+    # what the modifiers before the stage 2 window channel pick cached: the key without a version, other samples, no flags
+    for file_name in os.listdir(lot):
+        key = cache.make_key(os.path.join(lot, file_name), "LactateStoneCalibration", ('current', 'time'), "modified")
+        cache.put(key, numpy.arange(10.0), numpy.full(10, 100.0))
+    cache.save_index()
+
+    fresh = Data(lot, "LactateStoneCalibration")
+    cached = Data(lot, "LactateStoneCalibration", cache=RunCache(str(tmp_path / "cache")))
+    assert cached.cache.hits == 0
+    assert cached.flags == fresh.flags == {os.path.join(lot, "5_00_rep2.txt"): [NO_STAGE_2]}
+    for fresh_run, cached_run in zip(fresh.nested_data, cached.nested_data):
+        assert numpy.array_equal(fresh_run.x_axis, cached_run.x_axis)
+        assert numpy.array_equal(fresh_run.y_axis, cached_run.y_axis)
+
+def test_current_entries_hit_with_their_flags(tmp_path):
+    lot = str(tmp_path / "lot")
+    write_lot(lot)
+    Data(lot, "LactateStoneCalibration", cache=RunCache(str(tmp_path / "cache")))
+    cached = Data(lot, "LactateStoneCalibration", cache=RunCache(str(tmp_path / "cache")))
+    assert cached.cache.hits == 5
+    assert cached.flags == {os.path.join(lot, "5_00_rep2.txt"): [NO_STAGE_2]}
+    float32 = Data(lot, "LactateStoneCalibration", cache=RunCache(str(tmp_path / "cache")), dtype=numpy.float32)
+    assert float32.cache.hits == 0 # float32 runs are cached on their own